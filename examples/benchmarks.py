@@ -0,0 +1,450 @@
+"""
+Benchmarks for the different ways pypandoc can run pandoc.
+
+Usage: python examples/benchmarks.py <benchmark> [options]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import pypandoc
+
+SNIPPET = "# Some title\n\nSome *emphasised* text with a [link](https://pandoc.org).\n"
+
+
+def timed(func, repeat):
+    """Return the latencies of `repeat` calls of `func` in milliseconds."""
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def report(name, latencies):
+    latencies = sorted(latencies)
+    print(
+        "{:<24} median {:8.2f} ms   p95 {:8.2f} ms   min {:8.2f} ms".format(
+            name,
+            statistics.median(latencies),
+            latencies[int(len(latencies) * 0.95) - 1],
+            latencies[0],
+        )
+    )
+
+
+def bench_server(args):
+    """Latency of convert_text through a pandoc server vs. starting pandoc."""
+    source = SNIPPET * args.size
+
+    def convert(backend):
+        return lambda: pypandoc.convert_text(source, "html", "md", backend=backend)
+
+    report("subprocess", timed(convert("subprocess"), args.repeat))
+    with pypandoc.PandocServer(allow_network_access=True) as server:
+        convert(server)()  # warm up
+        report("server", timed(convert(server), args.repeat))
+
+
+def bench_lua(args):
+    """Latency of convert_text in pandoc lua workers vs. starting pandoc."""
+    source = SNIPPET * args.size
+
+    def convert(backend):
+        return lambda: pypandoc.convert_text(source, "html", "md", backend=backend)
+
+    report("subprocess", timed(convert("subprocess"), args.repeat))
+    with pypandoc.LuaWorkerPool(size=1) as pool:
+        convert(pool)()  # warm up
+        report("lua workers", timed(convert(pool), args.repeat))
+
+
+def bench_threads(args):
+    """Throughput of convert_text with different cworkdirs in 1..N threads."""
+    source = SNIPPET * args.size
+
+    with tempfile.TemporaryDirectory() as workdir:
+
+        def convert(_):
+            pypandoc.convert_text(source, "html", "md", cworkdir=workdir)
+
+        convert(None)  # warm up
+        single = None
+        threads = 1
+        while threads <= (os.cpu_count() or 1) * 2:
+            with ThreadPoolExecutor(threads) as executor:
+                start = time.perf_counter()
+                list(executor.map(convert, range(args.repeat)))
+                rate = args.repeat / (time.perf_counter() - start)
+            single = single or rate
+            print(
+                "{:>3} threads   {:8.1f} conversions/s   x{:.2f}".format(
+                    threads, rate, rate / single
+                )
+            )
+            threads *= 2
+
+
+def bench_many(args):
+    """Throughput of convert_text in a loop vs. convert_many."""
+    # distinct sources, identical ones running at the same time share a pandoc
+    sources = [SNIPPET * args.size + "%d\n" % i for i in range(args.repeat)]
+
+    start = time.perf_counter()
+    for source in sources:
+        pypandoc.convert_text(source, "html", "md")
+    loop = args.repeat / (time.perf_counter() - start)
+    print("{:<24} {:8.1f} conversions/s".format("convert_text loop", loop))
+
+    start = time.perf_counter()
+    pypandoc.convert_many(sources, "html", "md")
+    many = args.repeat / (time.perf_counter() - start)
+    print("{:<24} {:8.1f} conversions/s".format("convert_many", many))
+
+
+def bench_multi(args):
+    """Latency of convert_text for every format vs. convert_multi."""
+    source = SNIPPET * args.size
+    formats = ["html", "docx", "latex"]
+
+    def separately():
+        for to in formats:
+            pypandoc.convert_text(
+                source, to, "md", return_bytes=to == "docx", extra_args=["-s"]
+            )
+
+    def multi():
+        pypandoc.convert_multi(source, formats, "md", extra_args=["-s"])
+
+    report("convert_text per format", timed(separately, args.repeat))
+    report("convert_multi", timed(multi, args.repeat))
+
+
+def bench_converter(args):
+    """Latency of convert_text with many options vs. a prepared Converter."""
+    source = SNIPPET * args.size
+    extra_args = ["--standalone", "--wrap=none", "--toc", "--columns=72"]
+    extra_args += ["--metadata=key%d=value" % i for i in range(50)]
+
+    def convert_text():
+        pypandoc.convert_text(source, "html", "md", extra_args=extra_args)
+
+    report("convert_text", timed(convert_text, args.repeat))
+    for defaults_file in (False, True):
+        with pypandoc.Converter(
+            "html", "md", extra_args=extra_args, defaults_file=defaults_file
+        ) as converter:
+            report(
+                "Converter" + (", defaults file" if defaults_file else ""),
+                timed(lambda: converter.convert_text(source), args.repeat),
+            )
+
+
+class ForkingPopen(subprocess.Popen):
+    """Popen which always forks, like it does on Python < 3.10."""
+
+    def __init__(self, *args, **kwargs):
+        # a preexec_fn rules out vfork() and posix_spawn()
+        kwargs.setdefault("preexec_fn", lambda: None)
+        super().__init__(*args, **kwargs)
+
+
+def bench_spawn(args):
+    """Latency of convert_text with the spawn strategies as the process grows."""
+    source = SNIPPET * args.size
+    # started while the process is small
+    pypandoc.set_spawn_strategy("forkserver")
+    ballast = []
+    for rss in args.rss:
+        while len(ballast) < rss:
+            block = bytearray(2**30)
+            block[::4096] = b"\1" * (2**30 // 4096)  # make the pages resident
+            ballast.append(block)
+        print("about %d GiB allocated" % rss)
+        for strategy in ("subprocess", "posix_spawn", "forkserver", "fork"):
+            if strategy == "fork":
+                subprocess.Popen = ForkingPopen
+                pypandoc.set_spawn_strategy("subprocess")
+            else:
+                pypandoc.set_spawn_strategy(strategy)
+            try:
+                report(
+                    strategy,
+                    timed(
+                        lambda: pypandoc.convert_text(source, "html", "md"),
+                        args.repeat,
+                    ),
+                )
+            finally:
+                subprocess.Popen = ForkingPopen.__bases__[0]
+    pypandoc.set_spawn_strategy("subprocess")
+
+
+def bench_supervisor(args):
+    """Throughput, threads and context switches of convert_many with pandoc
+    looked after by worker threads vs. the supervisor thread."""
+    import resource
+    import threading
+
+    sources = [SNIPPET * args.size + str(i) for i in range(args.repeat * 4)]
+    for workers in (1, 8, 32, 128):
+        for supervised in (False, True):
+            pypandoc._SUPERVISED = supervised
+            peak = [threading.active_count()]
+            done = threading.Event()
+
+            def sample():
+                while not done.wait(0.005):
+                    peak[0] = max(peak[0], threading.active_count())
+
+            sampler = threading.Thread(target=sample)
+            sampler.start()
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            start = time.perf_counter()
+            pypandoc.convert_many(sources, "html", "md", max_workers=workers)
+            elapsed = time.perf_counter() - start
+            after = resource.getrusage(resource.RUSAGE_SELF)
+            done.set()
+            sampler.join()
+            print(
+                "{:<10} {:>3} workers: {:7.1f} conversions/s, {:3d} threads, "
+                "{:6d} context switches".format(
+                    "supervisor" if supervised else "threads",
+                    workers,
+                    len(sources) / elapsed,
+                    # without the sampler
+                    peak[0] - 1,
+                    after.ru_nvcsw + after.ru_nivcsw - usage.ru_nvcsw - usage.ru_nivcsw,
+                )
+            )
+    pypandoc._SUPERVISED = os.name == "posix"
+
+
+def bench_pipes(args):
+    """Throughput of feeding large inputs to a process: subprocess's
+    communicate(), the supervisor with default and enlarged pipes and a file
+    as stdin; then convert_text with bytes vs. a file object."""
+    for megabytes in args.mb:
+        data = b"Some *emphasised* text.\n\n" * (megabytes * 2**20 // 25)
+        with tempfile.TemporaryFile() as f:
+            f.write(data)
+            f.flush()
+
+            def start(stdin=subprocess.PIPE):
+                # dd really reads the input, wc -c would only stat a file
+                return subprocess.Popen(
+                    ["dd", "of=/dev/null", "bs=1M", "status=none"],
+                    stdin=stdin,
+                    stdout=subprocess.PIPE,
+                )
+
+            def communicate():
+                start().communicate(data)
+
+            def supervisor(enlarge):
+                p = start()
+                if enlarge:
+                    pypandoc._enlarge_pipes(p, len(data))
+                pypandoc._supervise(p, data).result()
+
+            def file_as_stdin():
+                f.seek(0)
+                p = start(f.fileno())
+                p.communicate()
+
+            print("%d MiB" % megabytes)
+            for name, func in (
+                ("communicate()", communicate),
+                ("supervisor", lambda: supervisor(False)),
+                ("supervisor, 1 MiB pipes", lambda: supervisor(True)),
+                ("file as stdin", file_as_stdin),
+            ):
+                latencies = timed(func, args.repeat)
+                print(
+                    "{:<24} {:8.0f} MiB/s".format(
+                        name, megabytes / statistics.median(latencies) * 1000
+                    )
+                )
+
+    source = SNIPPET.encode("utf-8") * (2**20 // len(SNIPPET))
+    with tempfile.TemporaryFile() as f:
+        f.write(source)
+        f.flush()
+
+        def from_file():
+            f.seek(0)
+            pypandoc.convert_text(f, "plain", "md")
+
+        print("convert_text, 1 MiB")
+        report("bytes", timed(lambda: pypandoc.convert_text(source, "plain", "md"), 3))
+        report("file object", timed(from_file, 3))
+
+
+def bench_stream(args):
+    """Peak Python memory of convert_text vs. convert_text_stream."""
+    source = SNIPPET * args.size
+
+    def peak(func):
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak / 2**20
+
+    output = pypandoc.convert_text(source, "html", "md")
+    print("{:<24} {:8.1f} MiB".format("output", len(output.encode()) / 2**20))
+    print(
+        "{:<24} {:8.1f} MiB peak".format(
+            "convert_text", peak(lambda: pypandoc.convert_text(source, "html", "md"))
+        )
+    )
+
+    def stream():
+        for _ in pypandoc.convert_text_stream(source, "html", "md"):
+            pass
+
+    print("{:<24} {:8.1f} MiB peak".format("convert_text_stream", peak(stream)))
+
+
+def bench_bytes(args):
+    """Latency of docx output through a temporary file vs. return_bytes."""
+    source = SNIPPET * args.size
+
+    def through_file():
+        with tempfile.NamedTemporaryFile(suffix=".docx") as f:
+            pypandoc.convert_text(source, "docx", "md", outputfile=f.name)
+            return f.read()
+
+    report("temporary file", timed(through_file, args.repeat))
+    report(
+        "return_bytes",
+        timed(
+            lambda: pypandoc.convert_text(source, "docx", "md", return_bytes=True),
+            args.repeat,
+        ),
+    )
+
+
+def bench_cache(args):
+    """Latency of repeated convert_text calls with and without result caches."""
+    source = SNIPPET * args.size
+
+    def convert():
+        return pypandoc.convert_text(source, "html", "md")
+
+    report("no cache", timed(convert, args.repeat))
+    pypandoc.set_result_cache(pypandoc.ResultCache())
+    convert()  # fill the cache
+    report("memory cache hit", timed(convert, args.repeat))
+    with tempfile.TemporaryDirectory() as directory:
+        pypandoc.set_result_cache(pypandoc.DiskResultCache(directory))
+        convert()
+        report("disk cache hit", timed(convert, args.repeat))
+    pypandoc.set_result_cache(None)
+
+
+def bench_ast(args):
+    """Latency of converting a source again, to another format, with and
+    without an AST cache."""
+    source = SNIPPET * args.size
+
+    def convert():
+        return pypandoc.convert_text(source, "latex", "md")
+
+    report("no AST cache", timed(convert, args.repeat))
+    pypandoc.set_ast_cache(pypandoc.ResultCache())
+    pypandoc.convert_text(source, "html", "md")  # fill the cache
+    report("AST cache hit", timed(convert, args.repeat))
+    pypandoc.set_ast_cache(None)
+
+
+FILTER_SCRIPT = """#!{}
+from pandocfilters import Str, toJSONFilter
+
+
+def upper_case(key, value, format, meta):
+    if key == "Str":
+        return Str(value.upper())
+
+
+toJSONFilter(upper_case)
+"""
+
+
+def upper_case(key, value, format, meta):
+    if key == "Str":
+        return {"t": "Str", "c": value.upper()}
+
+
+def bench_filters(args):
+    """Latency of a pandocfilters filter as a script, run by a filter server
+    and as a Python function."""
+    source = SNIPPET * args.size
+
+    with tempfile.TemporaryDirectory() as directory:
+        script = os.path.join(directory, "upper_case.py")
+        with open(script, "w") as f:
+            f.write(FILTER_SCRIPT.format(sys.executable))
+        os.chmod(script, 0o755)
+
+        def convert(filters):
+            return lambda: pypandoc.convert_text(source, "html", "md", filters=filters)
+
+        report("filter script", timed(convert([script]), args.repeat))
+        with pypandoc.FilterServer(script) as server:
+            convert([server])()  # start the server
+            report("filter server", timed(convert([server]), args.repeat))
+        report("filter function", timed(convert([upper_case]), args.repeat))
+
+
+BENCHMARKS = {
+    "ast": bench_ast,
+    "bytes": bench_bytes,
+    "cache": bench_cache,
+    "converter": bench_converter,
+    "filters": bench_filters,
+    "lua": bench_lua,
+    "many": bench_many,
+    "multi": bench_multi,
+    "pipes": bench_pipes,
+    "server": bench_server,
+    "spawn": bench_spawn,
+    "stream": bench_stream,
+    "supervisor": bench_supervisor,
+    "threads": bench_threads,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument(
+        "--size", type=int, default=1, help="number of copies of the test snippet"
+    )
+    parser.add_argument(
+        "--rss",
+        type=lambda x: [int(y) for y in x.split(",")],
+        default=[0, 1, 2],
+        help="GiB to allocate before each round of the spawn benchmark",
+    )
+    parser.add_argument(
+        "--mb",
+        type=lambda x: [int(y) for y in x.split(",")],
+        default=[1, 16, 256, 1024],
+        help="input sizes in MiB for the pipes benchmark",
+    )
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
+
+
+if __name__ == "__main__":
+    main()
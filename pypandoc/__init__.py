@@ -1,35 +1,199 @@
+import asyncio
+import atexit
+import codecs
+import contextlib
+import copy
 import glob
+import io
+import mmap
 import os
 import re
+import shutil
+import socket
+import stat
 import subprocess
 import sys
 import tempfile
 import textwrap
+import threading
+import time
 import typing
 import urllib.parse
 import urllib.request
+import zlib
+from collections import namedtuple
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    CancelledError,
+    Future,
+    ThreadPoolExecutor,
+)
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures import wait
 from pathlib import Path
 from typing import Iterable, Iterator, Union
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from .defaults_file import _to_defaults, _write_defaults_file
+from .filter_server import FilterServer
 from .handler import _check_log_handler, logger
+from .lua_worker import LuaWorkerPool
+from .lua_worker import _convert_text as _convert_text_with_workers
 from .pandoc_download import DEFAULT_TARGET_FOLDER, download_pandoc
+from .probe_cache import (
+    _get_binary_fingerprint,
+    _get_binary_info,
+    _get_candidates_key,
+    _get_discovered_path,
+    _set_binary_info,
+    _set_discovered_path,
+)
+from .python_filters import _apply_filters as _apply_python_filters
+from .result_cache import DiskResultCache, ResultCache
+from .result_cache import _get_key as _get_result_cache_key
+from .server import PandocServer
+from .server import _convert_batches as _convert_batches_with_server
+from .server import _convert_text as _convert_text_with_server
+from .server import set_server_network_access
+from .spawn_server import _SpawnServer
+from .supervisor import _communicate as _supervisor_communicate
+from .supervisor import _kill_process
 
 __author__ = "Juho Vepsäläinen; Maintained by Jessica Tegner"
 __version__ = "1.17"
 __all__ = [
     "convert_file",
+    "convert_file_async",
     "convert_text",
+    "convert_text_async",
+    "convert_many",
+    "convert_file_stream",
+    "convert_multi",
+    "convert_file_multi",
+    "convert_text_stream",
+    "imap_convert",
+    "ConversionResult",
     "get_pandoc_formats",
     "get_pandoc_version",
     "get_pandoc_path",
     "download_pandoc",
+    "PandocServer",
+    "set_server_network_access",
+    "LuaWorkerPool",
+    "ResultCache",
+    "DiskResultCache",
+    "set_result_cache",
+    "get_result_cache",
+    "set_ast_cache",
+    "FilterServer",
+    "Converter",
+    "set_filter_servers",
+    "get_ast_cache",
+    "set_spawn_strategy",
+    "get_spawn_strategy",
+    "ConversionTimeoutError",
+    "CancellationToken",
 ]
 
 _MAX_TINYTEX_INSTALL_ATTEMPTS = 3
+# set creation flag to not open pandoc in new console on windows
+_CREATION_FLAGS = 0x08000000 if sys.platform == "win32" else 0
+# input formats which are read as bytes instead of being decoded
+_BINARY_INPUT_FORMATS = ("docx", "odt", "epub", "epub3", "pdf", "pptx")
+# objects which are written to pandoc's stdin as they are
+_BYTES_LIKE = (bytes, bytearray, memoryview, mmap.mmap)
+# size of the chunks streamed input is read and written in
+_INPUT_CHUNK_SIZE = 65536
+# output formats which are returned as bytes instead of being decoded
+_BINARY_OUTPUT_FORMATS = ("odt", "docx", "epub", "epub3", "pdf")
+# pandoc's pipes are looked after by one supervisor thread where selectors can
+# be used with pipes, see pypandoc.supervisor
+_SUPERVISED = os.name == "posix"
+# size of the pipes to and from pandoc for large inputs on Linux (the default
+# maximum for unprivileged processes), see _enlarge_pipes()
+_PIPE_SIZE = 2**20
+_F_SETPIPE_SZ = (
+    getattr(fcntl, "F_SETPIPE_SZ", 1031) if sys.platform.startswith("linux") else None
+)
+# seconds between checks of the timeout and the cancellation token of a
+# conversion waiting for an identical one, see _wait_in_flight()
+_IN_FLIGHT_POLL_INTERVAL = 0.05
+# seconds a failed pandoc lookup is remembered, see _ensure_pandoc_path()
+_PANDOC_NOT_FOUND_TTL = 60.0
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "currsize"])
+# result of one conversion of convert_many()/imap_convert(): the position of
+# the source in the input and either the output or the exception raised
+ConversionResult = namedtuple("ConversionResult", ["index", "output", "error"])
+
+
+class ConversionTimeoutError(TimeoutError):
+    """Raised when a conversion didn't finish within its `timeout`.
+
+    pandoc was killed together with everything it started, like filters and
+    PDF engines, before this is raised. `stderr` has what pandoc wrote to its
+    stderr until then.
+    """
+
+    def __init__(self, timeout: float, stderr: bytes = b""):
+        self.timeout = timeout
+        self.stderr = stderr.decode("utf-8", errors="replace") if stderr else ""
+        message = "Pandoc didn't finish within %g seconds" % timeout
+        if self.stderr:
+            message += ": " + self.stderr
+        super().__init__(message)
+
+
+class CancellationToken:
+    """Cancels the conversions it's passed to, from any thread.
+
+    Running pandoc processes are killed together with everything they started,
+    conversions which haven't started yet don't start. A cancelled conversion
+    raises (or, in a batch, has as its error) a
+    :class:`concurrent.futures.CancelledError`. A token can't be reset.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self._callbacks = []
+
+    def cancel(self) -> None:
+        """Cancel the conversions."""
+        with self._lock:
+            if self._cancelled:
+                return
+            self._cancelled = True
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    @property
+    def cancelled(self) -> bool:
+        """Whether :meth:`cancel` was called."""
+        return self._cancelled
+
+    def _add_callback(self, callback) -> None:
+        """Call `callback` when the token is cancelled, or right away if it
+        already is."""
+        with self._lock:
+            if not self._cancelled:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def _remove_callback(self, callback) -> None:
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
 
 
 def convert_text(
-    source: typing.Union[str, bytes],
+    source: typing.Union[str, bytes, typing.IO, Iterable],
     to: str,
     format: str,
     extra_args: Iterable = (),
@@ -39,10 +203,17 @@ def convert_text(
     verify_format: bool = True,
     sandbox: bool = False,
     cworkdir: Union[str, None] = None,
-) -> str:
+    backend: Union[str, PandocServer, LuaWorkerPool] = "subprocess",
+    return_bytes: bool = False,
+    sink: Union[None, int, typing.IO] = None,
+    timeout: Union[float, None] = None,
+) -> Union[str, bytes]:
     """Converts given `source` from `format` to `to`.
 
-    :param source: Unicode string or bytes (see encoding)
+    :param source: Unicode string or bytes (see encoding). Bytes may also be
+        given as a bytearray, memoryview or mmap, and a large source can be
+        given as a file object or an iterable of str or bytes chunks, which is
+        written to pandoc chunk by chunk.
 
     :param str to: format into which the input should be converted;
         can be one of `pypandoc.get_pandoc_formats()[1]`
@@ -60,7 +231,149 @@ def convert_text(
         The output filename can be specified as a string or pathlib.Path object.
         (Default value = None)
 
-    :param list filters: pandoc filters e.g. filters=['pandoc-citeproc']
+    :param list filters: pandoc filters e.g. filters=['pandoc-citeproc'], or
+        Python functions ``action(key, value, format, meta)`` which are applied
+        to the document in this process (see :mod:`pypandoc.python_filters`)
+
+    :param bool verify_format: Verify from and to format before converting.
+        Should only be set False when confident of the formats
+        and performance is an issue. (Default value = True)
+
+    :param bool sandbox: Run pandoc in pandocs own sandbox mode, limiting IO operations
+        in readers and writers to reading the files specified on the command line.
+        Anyone using pandoc on untrusted user input should use this option.
+        Note: This only does something, on pandoc >= 2.15 (Default value = False)
+
+    :param str cworkdir: set the current working directory (Default value = None)
+
+    :param backend: "subprocess" to start pandoc for the conversion, "server" to
+        convert with a shared, long-running ``pandoc server`` (pandoc >= 3.0,
+        needs :func:`set_server_network_access`),
+        "lua" to convert in a shared pool of long-running ``pandoc lua`` workers
+        (pandoc >= 3.2), or a :class:`PandocServer` or :class:`LuaWorkerPool`
+        to use. Conversions the backend can't do (e.g. non-Lua filters, an
+        outputfile, a cworkdir or unsupported extra_args) fall back to starting
+        pandoc. (Default value = "subprocess")
+
+    :param bool return_bytes: return pandoc's output as bytes instead of
+        decoding it. Binary formats like docx or pdf don't need an outputfile
+        this way. (Default value = False)
+
+    :param sink: a writable file object or file descriptor to write the output
+        to instead of returning it. If it has a file descriptor, pandoc writes
+        to it directly, otherwise the output is passed on in chunks. Text files
+        get the output decoded, anything else the raw bytes. (Default value = None)
+
+    :param float timeout: the seconds after which the conversion is given up:
+        pandoc is killed together with the filters and PDF engines it started
+        and :class:`ConversionTimeoutError` is raised. It covers all pandoc runs
+        of the conversion, including retries. Python filters can't be
+        interrupted, the timeout is only checked between them. A backend isn't
+        used for conversions with a timeout. (Default value = None)
+
+    :returns: converted string (or bytes, see return_bytes) or an empty string
+        if an outputfile or a sink was given
+    :rtype: str or bytes
+
+    :raises RuntimeError:
+        if any of the inputs are not valid of if pandoc fails with an error
+    :raises ConversionTimeoutError:
+        if the conversion didn't finish within `timeout`
+    :raises OSError:
+        if pandoc is not found; make sure it has been installed
+        and is available at path.
+    """
+    if backend == "server" or isinstance(backend, PandocServer):
+        convert_with_backend = _convert_text_with_server
+    elif backend == "lua" or isinstance(backend, LuaWorkerPool):
+        convert_with_backend = _convert_text_with_workers
+    elif backend != "subprocess":
+        raise RuntimeError("Invalid backend! Got %s" % backend)
+
+    # the backends take the source as a whole and return str, leave anything
+    # else to pandoc
+    if (
+        backend != "subprocess"
+        and isinstance(source, (str, bytes))
+        and not return_bytes
+        and sink is None
+        and timeout is None
+    ):
+        _check_log_handler()
+        if verify_format:
+            format, to = _validate_formats(format, to, outputfile)
+        output = convert_with_backend(
+            backend,
+            _decode_text_source(source, format, encoding),
+            normalize_format(to),
+            normalize_format(format),
+            extra_args,
+            encoding,
+            outputfile,
+            filters,
+            cworkdir,
+            sandbox,
+        )
+        if output is not None:
+            return output
+
+    return _convert_input(
+        _encode_text_source(source, format, encoding),
+        format,
+        "string",
+        to,
+        extra_args=extra_args,
+        outputfile=outputfile,
+        filters=filters,
+        verify_format=verify_format,
+        sandbox=sandbox,
+        cworkdir=cworkdir,
+        return_bytes=return_bytes,
+        sink=sink,
+        timeout=timeout,
+    )
+
+
+def convert_file(
+    source_file: Union[list, str, Path, Iterator],
+    to: str,
+    format: Union[str, None] = None,
+    extra_args: Iterable = (),
+    outputfile: Union[None, str, Path] = None,
+    filters: Union[Iterable, None] = None,
+    verify_format: bool = True,
+    sandbox: bool = False,
+    cworkdir: Union[str, None] = None,
+    sort_files=True,
+    return_bytes: bool = False,
+    sink: Union[None, int, typing.IO] = None,
+    timeout: Union[float, None] = None,
+) -> Union[str, bytes]:
+    """Converts given `source` from `format` to `to`.
+
+    :param (str, list, pathlib.Path) source_file: If a string, should be either
+        an absolute file path, relative file path, or a file pattern (like dir/*.md).
+        If a list, should be a list of file paths, file patterns, or pathlib.Path
+        objects. In addition, pathlib.Path objects as well as the generators produced by
+        pathlib.Path.glob may be specified.
+
+    :param str to: format into which the input should be converted; can be one of
+            `pypandoc.get_pandoc_formats()[1]`
+
+    :param str format: the format of the inputs;
+        will be inferred from the source_file with a known filename extension;
+        can be one of `pypandoc.get_pandoc_formats()[1]` (Default value = None)
+
+    :param list extra_args: extra arguments (list of strings) to be passed to pandoc
+            (Default value = ())
+
+    :param str outputfile: output will be written to outputfile or the converted content
+            returned if None. The output filename can be specified as a string
+            or pathlib.Path object. (Default value = None)
+
+    :param list filters: pandoc filters e.g. filters=['pandoc-citeproc'], or
+        Python functions ``action(key, value, format, meta)`` which are applied
+        to the document in this process (see :mod:`pypandoc.python_filters`)
 
     :param bool verify_format: Verify from and to format before converting.
         Should only be set False when confident of the formats
@@ -71,10 +384,1099 @@ def convert_text(
         Anyone using pandoc on untrusted user input should use this option.
         Note: This only does something, on pandoc >= 2.15 (Default value = False)
 
-    :param str cworkdir: set the current working directory (Default value = None)
+    :param str cworkdir: set the current working directory (Default value = None)
+
+    :param bool sort_files: causes the files to be sorted before being passed to pandoc
+        (Default value = True)
+
+    :param bool return_bytes: return pandoc's output as bytes instead of
+        decoding it. Binary formats like docx or pdf don't need an outputfile
+        this way. (Default value = False)
+
+    :param sink: a writable file object or file descriptor to write the output
+        to instead of returning it. If it has a file descriptor, pandoc writes
+        to it directly, otherwise the output is passed on in chunks. Text files
+        get the output decoded, anything else the raw bytes. (Default value = None)
+
+    :param float timeout: the seconds after which the conversion is given up:
+        pandoc is killed together with the filters and PDF engines it started
+        and :class:`ConversionTimeoutError` is raised. It covers all pandoc runs
+        of the conversion, including retries. Python filters can't be
+        interrupted, the timeout is only checked between them. A backend isn't
+        used for conversions with a timeout. (Default value = None)
+
+    :returns: converted string (or bytes, see return_bytes) or an empty string
+        if an outputfile or a sink was given
+    :rtype: str or bytes
+
+    :raises RuntimeError:
+        if any of the inputs are not valid of if pandoc fails with an error
+    :raises ConversionTimeoutError:
+        if the conversion didn't finish within `timeout`
+    :raises OSError:
+        if pandoc is not found; make sure it has been installed
+        and is available at path.
+    """
+    # check if we have a working directory
+    # if we don't, we use the current working directory
+    if cworkdir is None:
+        cworkdir = os.getcwd()
+
+    source_file, format = _resolve_source_files(source_file, format, cworkdir)
+
+    return _convert_input(
+        source_file,
+        format,
+        "path",
+        to,
+        extra_args=extra_args,
+        outputfile=outputfile,
+        filters=filters,
+        verify_format=verify_format,
+        sandbox=sandbox,
+        cworkdir=cworkdir,
+        sort_files=sort_files,
+        return_bytes=return_bytes,
+        sink=sink,
+        timeout=timeout,
+    )
+
+
+async def convert_text_async(
+    source: typing.Union[str, bytes, typing.IO, Iterable],
+    to: str,
+    format: str,
+    extra_args: Iterable = (),
+    encoding: str = "utf-8",
+    outputfile: Union[None, str, Path] = None,
+    filters: Union[Iterable, None] = None,
+    verify_format: bool = True,
+    sandbox: bool = False,
+    cworkdir: Union[str, None] = None,
+    return_bytes: bool = False,
+    timeout: Union[float, None] = None,
+    cancel: Union[CancellationToken, None] = None,
+) -> Union[str, bytes]:
+    """Converts given `source` from `format` to `to` without blocking the event loop.
+
+    This is the asyncio version of :func:`convert_text` and takes the same
+    arguments (except `backend`). Pandoc is run with
+    :func:`asyncio.create_subprocess_exec`, so no thread is held while it works.
+    If the task is cancelled, pandoc is killed.
+
+    :param CancellationToken cancel: a token which cancels the conversion from
+        any thread, which then raises :class:`concurrent.futures.CancelledError`
+        (Default value = None)
+
+    :returns: converted string (or bytes, see return_bytes) or an empty string
+        if an outputfile was given
+    :rtype: str or bytes
+
+    :raises RuntimeError:
+        if any of the inputs are not valid of if pandoc fails with an error
+    :raises ConversionTimeoutError:
+        if the conversion didn't finish within `timeout`
+    :raises OSError:
+        if pandoc is not found; make sure it has been installed
+        and is available at path.
+    """
+    return await _convert_input_async(
+        _encode_text_source(source, format, encoding),
+        format,
+        "string",
+        to,
+        extra_args=extra_args,
+        outputfile=outputfile,
+        filters=filters,
+        verify_format=verify_format,
+        sandbox=sandbox,
+        cworkdir=cworkdir,
+        return_bytes=return_bytes,
+        timeout=timeout,
+        cancel=cancel,
+    )
+
+
+async def convert_file_async(
+    source_file: Union[list, str, Path, Iterator],
+    to: str,
+    format: Union[str, None] = None,
+    extra_args: Iterable = (),
+    outputfile: Union[None, str, Path] = None,
+    filters: Union[Iterable, None] = None,
+    verify_format: bool = True,
+    sandbox: bool = False,
+    cworkdir: Union[str, None] = None,
+    sort_files=True,
+    return_bytes: bool = False,
+    timeout: Union[float, None] = None,
+    cancel: Union[CancellationToken, None] = None,
+) -> Union[str, bytes]:
+    """Converts given `source` from `format` to `to` without blocking the event loop.
+
+    This is the asyncio version of :func:`convert_file` and takes the same
+    arguments. Pandoc is run with :func:`asyncio.create_subprocess_exec`, so no
+    thread is held while it works. If the task is cancelled, pandoc is killed.
+
+    :param CancellationToken cancel: a token which cancels the conversion from
+        any thread, which then raises :class:`concurrent.futures.CancelledError`
+        (Default value = None)
+
+    :returns: converted string (or bytes, see return_bytes) or an empty string
+        if an outputfile was given
+    :rtype: str or bytes
+
+    :raises RuntimeError:
+        if any of the inputs are not valid of if pandoc fails with an error
+    :raises ConversionTimeoutError:
+        if the conversion didn't finish within `timeout`
+    :raises OSError:
+        if pandoc is not found; make sure it has been installed
+        and is available at path.
+    """
+    if cworkdir is None:
+        cworkdir = os.getcwd()
+
+    source_file, format = _resolve_source_files(source_file, format, cworkdir)
+
+    return await _convert_input_async(
+        source_file,
+        format,
+        "path",
+        to,
+        extra_args=extra_args,
+        outputfile=outputfile,
+        filters=filters,
+        verify_format=verify_format,
+        sandbox=sandbox,
+        cworkdir=cworkdir,
+        sort_files=sort_files,
+        return_bytes=return_bytes,
+        timeout=timeout,
+        cancel=cancel,
+    )
+
+
+def convert_many(
+    sources: Iterable[Union[str, bytes]],
+    to: str,
+    format: str,
+    extra_args: Iterable = (),
+    encoding: str = "utf-8",
+    filters: Union[Iterable, None] = None,
+    verify_format: bool = True,
+    sandbox: bool = False,
+    cworkdir: Union[str, None] = None,
+    max_workers: Union[int, None] = None,
+    timeout: Union[float, None] = None,
+    cancel: Union[CancellationToken, None] = None,
+    backend: Union[str, PandocServer] = "subprocess",
+) -> list:
+    """Converts every source in `sources` from `format` to `to`.
+
+    Like :func:`imap_convert`, but waits for all conversions and returns a list
+    of :class:`ConversionResult`, in the order of `sources`.
+    """
+    return list(
+        imap_convert(
+            sources,
+            to,
+            format,
+            extra_args=extra_args,
+            encoding=encoding,
+            filters=filters,
+            verify_format=verify_format,
+            sandbox=sandbox,
+            cworkdir=cworkdir,
+            max_workers=max_workers,
+            timeout=timeout,
+            cancel=cancel,
+            backend=backend,
+        )
+    )
+
+
+def imap_convert(
+    sources: Iterable[Union[str, bytes]],
+    to: str,
+    format: str,
+    extra_args: Iterable = (),
+    encoding: str = "utf-8",
+    filters: Union[Iterable, None] = None,
+    verify_format: bool = True,
+    sandbox: bool = False,
+    cworkdir: Union[str, None] = None,
+    max_workers: Union[int, None] = None,
+    ordered: bool = True,
+    timeout: Union[float, None] = None,
+    cancel: Union[CancellationToken, None] = None,
+    backend: Union[str, PandocServer] = "subprocess",
+) -> Iterator[ConversionResult]:
+    """Lazily converts every source in `sources` from `format` to `to`.
+
+    All sources share the same options, so the formats are validated and the
+    pandoc command line is built only once. At most `max_workers` pandoc
+    processes run at the same time and only a few more sources are read from
+    `sources` ahead of them, so `sources` may be an arbitrarily long iterator.
+
+    A conversion which fails, or a source which can't be converted at all (e.g.
+    one of an invalid type), doesn't stop the others: its result has the
+    exception in ``error`` (and ``output`` is None).
+
+    The other arguments have the same meaning as for :func:`convert_text`.
+
+    :param int max_workers: the maximal number of pandoc processes to run at the
+        same time (Default value = the number of CPUs)
+
+    :param bool ordered: yield the results in the order of `sources` instead of
+        as soon as they are done (Default value = True)
+
+    :param float timeout: the seconds after which a conversion is given up,
+        counted from when it starts; its result then has a
+        :class:`ConversionTimeoutError` as error (Default value = None)
+
+    :param CancellationToken cancel: a token which cancels the batch from any
+        thread: running pandoc processes are killed and no more sources are
+        read. The results of the cancelled conversions have a
+        :class:`concurrent.futures.CancelledError` as error
+        (Default value = None)
+
+    :param backend: "subprocess" to start pandoc for every conversion, or
+        "server" or a :class:`PandocServer` to send the sources to a ``pandoc
+        server`` in batches of up to 64 (see :func:`convert_text`). The server
+        takes str and bytes sources; `max_workers` and `ordered` don't apply
+        to it. Conversions the server can't do, or with a `timeout` or a
+        `cancel` token, start pandoc. (Default value = "subprocess")
+
+    :returns: an iterator of :class:`ConversionResult`
+
+    :raises RuntimeError:
+        if the formats are not valid
+    :raises OSError:
+        if pandoc is not found; make sure it has been installed
+        and is available at path.
+    """
+    if backend not in ("subprocess", "server") and not isinstance(
+        backend, PandocServer
+    ):
+        raise RuntimeError("Invalid backend! Got %s" % backend)
+    max_workers = max_workers or os.cpu_count() or 1
+    conversion = _prepare_conversion(
+        None,
+        format,
+        "string",
+        to,
+        extra_args=extra_args,
+        filters=filters,
+        verify_format=verify_format,
+        sandbox=sandbox,
+        cworkdir=cworkdir,
+        timeout=timeout,
+        cancel=cancel,
+    )
+    if backend != "subprocess" and timeout is None and cancel is None:
+        if verify_format:
+            format, to = _validate_formats(format, to, None)
+        results = _convert_batches_with_server(
+            backend,
+            sources,
+            normalize_format(to),
+            normalize_format(format),
+            extra_args,
+            encoding,
+            filters,
+            cworkdir,
+            sandbox,
+        )
+        if results is not None:
+            return (
+                ConversionResult(index, output, error)
+                for index, (output, error) in enumerate(results)
+            )
+    return _imap_conversions(
+        _with_sources(conversion, sources, format, encoding), max_workers, ordered
+    )
+
+
+def _with_sources(conversion: "_Conversion", sources, format, encoding):
+    """Yield a copy of `conversion` for every source, or the exception raised
+    for a source which can't be converted at all (e.g. one of a wrong type)."""
+    for source in sources:
+        try:
+            yield conversion.with_input(_encode_text_source(source, format, encoding))
+        except Exception as e:
+            yield e
+
+
+def _imap_conversions(conversions, max_workers, ordered):
+    """Run `conversions` and yield their :class:`ConversionResult`.
+
+    An exception instead of a conversion is the error of its result.
+    """
+
+    def run(index, conversion):
+        try:
+            return ConversionResult(index, _run_conversion(conversion), None)
+        except Exception as e:
+            return ConversionResult(index, None, e)
+
+    conversions = enumerate(conversions)
+    # keep pandoc busy while the oldest conversion is consumed, but never read
+    # more than this many sources ahead
+    window = 2 * max_workers
+    pending = []
+    # only for the conversions the supervisor can't run on its own
+    executor = None
+    try:
+        for index, conversion in conversions:
+            if isinstance(conversion, Exception):
+                failed = Future()
+                failed.set_result(ConversionResult(index, None, conversion))
+                pending.append(failed)
+                continue
+            if conversion.cancel is not None and conversion.cancel.cancelled:
+                break
+            running = [future for future in pending if not future.done()]
+            if len(running) >= max_workers:
+                wait(running, return_when=FIRST_COMPLETED)
+            if _SUPERVISED and _is_supervisable(conversion):
+                pending.append(_start_supervised(index, conversion))
+            else:
+                if executor is None:
+                    executor = ThreadPoolExecutor(max_workers)
+                pending.append(executor.submit(run, index, conversion))
+            while len(pending) >= window:
+                yield from _pop_done(pending, ordered)
+        while pending:
+            yield from _pop_done(pending, ordered)
+    finally:
+        # the consumer may stop early: stop the remaining conversions
+        for future in pending:
+            future.cancel()
+        if executor is not None:
+            executor.shutdown()
+
+
+def _is_supervisable(conversion: "_Conversion") -> bool:
+    """Return whether `conversion` is done by a single pandoc run, which needs
+    nothing but its input and output."""
+    return not (
+        conversion.python_filters
+        or _uses_ast_cache(conversion)
+        or conversion.pdf_to_memory
+        or conversion.sink is not None
+        or conversion.max_attempts > 1
+    )
+
+
+def _start_supervised(index, conversion: "_Conversion") -> Future:
+    """Start pandoc for `conversion` and let the supervisor thread finish it.
+
+    :returns: a future of the :class:`ConversionResult`; cancelling it kills
+        pandoc
+    """
+    result = Future()
+    conversion = conversion.started()
+    key = conversion.cache_key()
+    try:
+        timeout = conversion.check_limits()
+        output = _get_cached_result(key) if key is not None else None
+        if output is None:
+            logger.debug("Running pandoc...")
+            p = _spawn_pandoc(conversion, subprocess.PIPE)
+    except Exception as e:
+        result.set_result(ConversionResult(index, None, e))
+        return result
+    if output is not None:
+        result.set_result(ConversionResult(index, output, None))
+        return result
+
+    def finish(communicated):
+        if not result.set_running_or_notify_cancel():
+            return
+        try:
+            stdout, stderr = communicated.result()
+            output = _finish_conversion(conversion, p.returncode, stdout, stderr)
+        except subprocess.TimeoutExpired as e:
+            error = ConversionTimeoutError(conversion.timeout, e.stderr)
+            result.set_result(ConversionResult(index, None, error))
+            return
+        except Exception as e:
+            result.set_result(ConversionResult(index, None, e))
+            return
+        if key is not None and __result_cache is not None:
+            __result_cache.put(key, output)
+        result.set_result(ConversionResult(index, output, None))
+
+    communicated = _supervise(p, conversion.piped_input, timeout)
+    result.add_done_callback(lambda f: f.cancelled() and communicated.cancel())
+    communicated.add_done_callback(finish)
+    if conversion.cancel is not None:
+        conversion.cancel._add_callback(communicated.cancel)
+        communicated.add_done_callback(
+            lambda f: conversion.cancel._remove_callback(communicated.cancel)
+        )
+    return result
+
+
+def _pop_done(pending, ordered):
+    """Remove the next finished futures from `pending` and yield their results."""
+    if ordered:
+        yield pending.pop(0).result()
+        return
+    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+    for future in done:
+        pending.remove(future)
+        yield future.result()
+
+
+def convert_multi(
+    source: Union[str, bytes],
+    to: Iterable[str],
+    format: str,
+    extra_args: Iterable = (),
+    encoding: str = "utf-8",
+    outputfiles: Union[typing.Mapping[str, Union[str, Path]], None] = None,
+    filters: Union[Iterable, None] = None,
+    verify_format: bool = True,
+    sandbox: bool = False,
+    cworkdir: Union[str, None] = None,
+    max_workers: Union[int, None] = None,
+    timeout: Union[float, None] = None,
+) -> dict:
+    """Converts given `source` from `format` to every format in `to`.
+
+    The source is read and the filters are run only once, into pandoc's JSON
+    representation of the document. The outputs are then written from it by
+    up to `max_workers` pandoc processes at the same time, which is much faster
+    than converting the source again for every format if reading it is
+    expensive.
+
+    The extra_args are passed to both steps, except for the filters,
+    ``--citeproc`` and ``--shift-heading-level-by``, which only take effect
+    while reading. The other arguments have the same meaning as for
+    :func:`convert_text`.
+
+    :param list to: the formats to convert to, e.g. ``["html", "docx", "pdf"]``
+
+    :param dict outputfiles: the files to write some or all of the formats to,
+        by format (Default value = None)
+
+    :param int max_workers: the maximal number of pandoc processes writing the
+        outputs at the same time (Default value = the number of CPUs)
+
+    :param float timeout: the seconds after which the conversion is given up,
+        for reading the source and writing all outputs together
+        (Default value = None)
+
+    :returns: a dict with the output of each format in `to`: the path of its
+        outputfile, or the converted string, or bytes for binary formats like
+        docx and pdf
+    :rtype: dict
+
+    :raises RuntimeError:
+        if any of the inputs are not valid of if pandoc fails with an error
+    :raises OSError:
+        if pandoc is not found; make sure it has been installed
+        and is available at path.
+    """
+    return _convert_multi(
+        source,
+        "string",
+        to,
+        format,
+        extra_args=extra_args,
+        encoding=encoding,
+        outputfiles=outputfiles,
+        filters=filters,
+        verify_format=verify_format,
+        sandbox=sandbox,
+        cworkdir=cworkdir,
+        max_workers=max_workers,
+        timeout=timeout,
+    )
+
+
+def convert_file_multi(
+    source_file: Union[list, str, Path, Iterator],
+    to: Iterable[str],
+    format: Union[str, None] = None,
+    extra_args: Iterable = (),
+    outputfiles: Union[typing.Mapping[str, Union[str, Path]], None] = None,
+    filters: Union[Iterable, None] = None,
+    verify_format: bool = True,
+    sandbox: bool = False,
+    cworkdir: Union[str, None] = None,
+    sort_files=True,
+    max_workers: Union[int, None] = None,
+    timeout: Union[float, None] = None,
+) -> dict:
+    """Converts given `source_file` from `format` to every format in `to`.
+
+    This is the version of :func:`convert_multi` for files, see
+    :func:`convert_file` for the other arguments.
+
+    :returns: a dict with the output of each format in `to`
+    :rtype: dict
+
+    :raises RuntimeError:
+        if any of the inputs are not valid of if pandoc fails with an error
+    :raises OSError:
+        if pandoc is not found; make sure it has been installed
+        and is available at path.
+    """
+    if cworkdir is None:
+        cworkdir = os.getcwd()
+
+    source_file, format = _resolve_source_files(source_file, format, cworkdir)
+
+    return _convert_multi(
+        source_file,
+        "path",
+        to,
+        format,
+        extra_args=extra_args,
+        outputfiles=outputfiles,
+        filters=filters,
+        verify_format=verify_format,
+        sandbox=sandbox,
+        cworkdir=cworkdir,
+        sort_files=sort_files,
+        max_workers=max_workers,
+        timeout=timeout,
+    )
+
+
+# options which transform the document while it's read, so they must not take
+# effect again when the outputs are written from its JSON representation
+_READING_OPTIONS = {
+    "--filter",
+    "-F",
+    "--lua-filter",
+    "-L",
+    "--shift-heading-level-by",
+    "--base-header-level",
+}
+_READING_FLAGS = {"--citeproc", "-C"}
+
+
+# options which only affect how the document is written, so they don't change
+# its JSON representation; unknown options are assumed to affect both
+_WRITING_OPTIONS = {
+    "--output",
+    "-o",
+    "--template",
+    "--toc-depth",
+    "--pdf-engine",
+    "--pdf-engine-opt",
+    "--reference-doc",
+    "--variable",
+    "-V",
+    "--css",
+    "-c",
+    "--wrap",
+    "--columns",
+    "--highlight-style",
+    "--syntax-highlighting",
+    "--email-obfuscation",
+    "--id-prefix",
+    "--title-prefix",
+    "-T",
+    "--include-in-header",
+    "-H",
+    "--include-before-body",
+    "-B",
+    "--include-after-body",
+    "-A",
+    "--top-level-division",
+    "--number-offset",
+    "--slide-level",
+    "--epub-cover-image",
+    "--epub-metadata",
+    "--epub-embed-font",
+    "--epub-title-page",
+    "--epub-subdirectory",
+    "--dpi",
+    "--eol",
+    "--reference-location",
+    "--markdown-headings",
+    "--split-level",
+    "--chunk-template",
+    "--ipynb-output",
+}
+_WRITING_FLAGS = {
+    "--standalone",
+    "-s",
+    "--toc",
+    "--table-of-contents",
+    "--number-sections",
+    "-N",
+    "--self-contained",
+    "--embed-resources",
+    "--section-divs",
+    "--html-q-tags",
+    "--ascii",
+    "--reference-links",
+    "--no-highlight",
+    "--listings",
+    "--incremental",
+    "-i",
+    "--list-tables",
+    "--mathjax",
+    "--katex",
+    "--webtex",
+    "--mathml",
+    "--gladtex",
+}
+
+
+def _get_writing_args(extra_args) -> list:
+    """Return `extra_args` without the options which only apply while reading."""
+    return _remove_options(extra_args, _READING_OPTIONS, _READING_FLAGS)
+
+
+def _get_reading_args(extra_args) -> list:
+    """Return `extra_args` without the options which only apply while writing."""
+    return _remove_options(extra_args, _WRITING_OPTIONS, _WRITING_FLAGS)
+
+
+def _remove_options(extra_args, options, flags) -> list:
+    """Return `extra_args` without `options` (and their values) and `flags`."""
+    args = []
+    skip_value = False
+    for arg in extra_args:
+        if skip_value:
+            skip_value = False
+            continue
+        arg = str(arg)
+        if arg[:2] in options and not arg.startswith("--"):
+            # the value may follow a short option directly, e.g. -Lfilter.lua
+            name, has_value = arg[:2], len(arg) > 2
+        else:
+            name, has_value, _ = arg.partition("=")
+        if name in options:
+            skip_value = not has_value
+        elif name not in flags:
+            args.append(arg)
+    return args
+
+
+def _get_document(reading: "_Conversion") -> bytes:
+    """Return pandoc's JSON representation of the source `reading` converts.
+
+    `reading` converts to JSON. If an AST cache is set and the source is in
+    memory, the document is taken from the cache or stored in it.
+    """
+    cache = __ast_cache
+    key = reading.ast_key() if cache is not None else None
+    if key is not None:
+        document = cache.get(key)
+        if document is not None:
+            logger.debug("Using cached document")
+            return zlib.decompress(document)
+    document = bytes(_run_conversion(reading))
+    if key is not None:
+        cache.put(key, zlib.compress(document))
+    return document
+
+
+async def _get_document_async(reading: "_Conversion") -> bytes:
+    cache = __ast_cache
+    key = reading.ast_key() if cache is not None else None
+    if key is not None:
+        document = cache.get(key)
+        if document is not None:
+            logger.debug("Using cached document")
+            return zlib.decompress(document)
+    document = bytes(await _run_conversion_async(reading))
+    if key is not None:
+        cache.put(key, zlib.compress(document))
+    return document
+
+
+def _prepare_writing(conversion: "_Conversion") -> "_Conversion":
+    """Return the conversion writing the output of `conversion` from the JSON
+    representation of its source.
+
+    The source is read (or taken from the AST cache) and the Python filters
+    are applied in this process, each group of them followed by the pandoc
+    filters after it in `filters`. The pandoc filters after the last group run
+    while writing.
+    """
+    document = _get_document(conversion.to_document())
+    filter_args = []
+    for i, (actions, filter_args) in enumerate(conversion.python_filters):
+        document = _apply_python_filters(
+            document, actions, _get_base_format(conversion.to)
+        )
+        if filter_args and i + 1 < len(conversion.python_filters):
+            document = bytes(
+                _run_conversion(conversion.filtering(document, filter_args))
+            )
+    return conversion.from_document(document, filter_args)
+
+
+async def _prepare_writing_async(conversion: "_Conversion") -> "_Conversion":
+    document = await _get_document_async(conversion.to_document())
+    loop = asyncio.get_event_loop()
+    filter_args = []
+    for i, (actions, filter_args) in enumerate(conversion.python_filters):
+        document = await loop.run_in_executor(
+            None,
+            _apply_python_filters,
+            document,
+            actions,
+            _get_base_format(conversion.to),
+        )
+        if filter_args and i + 1 < len(conversion.python_filters):
+            document = bytes(
+                await _run_conversion_async(conversion.filtering(document, filter_args))
+            )
+    return conversion.from_document(document, filter_args)
+
+
+def _uses_ast_cache(conversion: "_Conversion") -> bool:
+    """Return whether `conversion` should write its source's cached document."""
+    return (
+        __ast_cache is not None
+        and conversion.to != "json"
+        and conversion.ast_key_args() is not None
+    )
+
+
+def _convert_multi(
+    source,
+    input_type,
+    to,
+    format,
+    extra_args=(),
+    encoding="utf-8",
+    outputfiles=None,
+    filters=None,
+    verify_format=True,
+    sandbox=False,
+    cworkdir=None,
+    sort_files=True,
+    max_workers=None,
+    timeout=None,
+):
+    if isinstance(to, str):
+        to = [to]
+    to = list(to)
+    outputfiles = outputfiles or {}
+    extra_args = list(extra_args)
+
+    if input_type == "string":
+        source = _encode_text_source(source, format, encoding)
+    reading = _prepare_conversion(
+        source,
+        format,
+        input_type,
+        "json",
+        extra_args=extra_args,
+        filters=filters,
+        verify_format=verify_format,
+        sandbox=sandbox,
+        cworkdir=cworkdir,
+        sort_files=sort_files,
+        return_bytes=True,
+        timeout=timeout,
+    ).started()
+    writings = []
+    for output_format in to:
+        outputfile = outputfiles.get(output_format)
+        base_format = _get_base_format(normalize_format(output_format))
+        writings.append(
+            _prepare_conversion(
+                None,
+                "json",
+                "string",
+                output_format,
+                extra_args=_get_writing_args(extra_args),
+                outputfile=outputfile,
+                verify_format=verify_format,
+                sandbox=sandbox,
+                cworkdir=cworkdir,
+                return_bytes=(
+                    outputfile is None and base_format in _BINARY_OUTPUT_FORMATS
+                ),
+                timeout=timeout,
+            )
+        )
+        # one deadline for reading the source and writing all outputs
+        writings[-1].deadline = reading.deadline
+
+    # the outputs are cached by the source and the options of the conversion
+    # to each format, so cached ones are found without reading the source;
+    # tagged, as filters see json as the output format here, unlike in
+    # convert_text()
+    keys = [None] * len(to)
+    if get_result_cache() is not None:
+        keys = [
+            _prepare_conversion(
+                source,
+                format,
+                input_type,
+                output_format,
+                extra_args=extra_args,
+                outputfile=outputfiles.get(output_format),
+                filters=filters,
+                verify_format=False,
+                sandbox=sandbox,
+                cworkdir=cworkdir,
+                sort_files=sort_files,
+                return_bytes=writing.return_bytes,
+            ).cache_key("multi")
+            for output_format, writing in zip(to, writings)
+        ]
+    outputs = [_get_cached_result(key) if key is not None else None for key in keys]
+    missing = [i for i, output in enumerate(outputs) if output is None]
+
+    if missing:
+        logger.debug("Reading the source once for %d formats...", len(missing))
+        document = _get_document(reading)
+        max_workers = min(max_workers or os.cpu_count() or 1, len(missing))
+        results = list(
+            _imap_conversions(
+                (writings[i].with_input(document) for i in missing),
+                max_workers,
+                True,
+            )
+        )
+        for result in results:
+            if result.error is not None:
+                raise result.error
+        for i, result in zip(missing, results):
+            outputs[i] = result.output
+            if keys[i] is not None:
+                get_result_cache().put(keys[i], result.output)
+    outputs = dict(zip(to, outputs))
+    for output_format, outputfile in outputfiles.items():
+        if output_format in outputs:
+            outputs[output_format] = str(outputfile)
+    return outputs
+
+
+class Converter:
+    """Converts sources from `format` to `to` with the same options every time.
+
+    The work which only depends on the options is done once, when the
+    converter is created: the formats are validated, the filters and the
+    sandbox option are resolved and pandoc's command line and environment are
+    built. Every conversion then only has to start pandoc. The arguments have
+    the same meaning as for :func:`convert_text`.
+
+    :param bool defaults_file: pass the options in a pandoc defaults file
+        instead of on the command line, which keeps it short for long sets of
+        options; only options pypandoc knows how to express there are moved
+        (needs pandoc >= 2.11, Default value = False)
+
+    :param float timeout: the seconds after which each conversion is given up,
+        see :func:`convert_text` (Default value = None)
+
+    :raises RuntimeError:
+        if the formats are not valid
+    :raises OSError:
+        if pandoc is not found; make sure it has been installed
+        and is available at path.
+    """
+
+    def __init__(
+        self,
+        to: str,
+        format: str,
+        extra_args: Iterable = (),
+        encoding: str = "utf-8",
+        filters: Union[Iterable, None] = None,
+        verify_format: bool = True,
+        sandbox: bool = False,
+        cworkdir: Union[str, None] = None,
+        return_bytes: bool = False,
+        defaults_file: bool = False,
+        timeout: Union[float, None] = None,
+    ):
+        self._defaults_file = None
+        base_format = _get_base_format(normalize_format(to))
+        if verify_format:
+            # binary formats are checked again when converting, once it's
+            # known whether there is an outputfile
+            format, to = _validate_formats(
+                format,
+                to,
+                "output.pdf" if base_format in _BINARY_OUTPUT_FORMATS else None,
+            )
+        self.to = normalize_format(to)
+        self.format = normalize_format(format)
+        self.encoding = encoding
+        self.cworkdir = cworkdir
+        self.return_bytes = return_bytes
+        self._conversion = _prepare_conversion(
+            None,
+            self.format,
+            "string",
+            self.to,
+            extra_args=extra_args,
+            filters=filters,
+            verify_format=False,
+            sandbox=sandbox,
+            cworkdir=cworkdir,
+            return_bytes=return_bytes,
+            timeout=timeout,
+        )
+        if defaults_file:
+            self._use_defaults_file()
+
+    def _use_defaults_file(self) -> None:
+        if not ensure_pandoc_minimal_version(2, 11):
+            logger.warning(
+                "Defaults files need pandoc >= 2.11, passing the options as "
+                "arguments instead."
+            )
+            return
+        args = self._conversion.args
+        # --output=- is kept, it's how binary formats are written to stdout
+        options = [arg for arg in args[3:] if arg != "--output=-"]
+        defaults, remaining = _to_defaults(options)
+        if not defaults:
+            return
+        self._defaults_file = _write_defaults_file(defaults)
+        self._conversion.args = (
+            args[:3]
+            + ["--defaults=" + self._defaults_file]
+            + remaining
+            + (["--output=-"] if "--output=-" in args else [])
+        )
+
+    @property
+    def args(self) -> list:
+        """pandoc's command line, without the sources and the outputfile."""
+        return list(self._conversion.args)
+
+    def convert_text(
+        self,
+        source: typing.Union[str, bytes, typing.IO, Iterable],
+        outputfile: Union[None, str, Path] = None,
+    ) -> Union[str, bytes]:
+        """Converts given `source`, see :func:`pypandoc.convert_text`."""
+        return _run_conversion(self._text_conversion(source, outputfile))
+
+    def convert_file(
+        self,
+        source_file: Union[list, str, Path, Iterator],
+        outputfile: Union[None, str, Path] = None,
+        sort_files=True,
+    ) -> Union[str, bytes]:
+        """Converts given `source_file`, see :func:`pypandoc.convert_file`."""
+        return _run_conversion(
+            self._file_conversion(source_file, outputfile, sort_files)
+        )
+
+    async def convert_text_async(
+        self,
+        source: typing.Union[str, bytes, typing.IO, Iterable],
+        outputfile: Union[None, str, Path] = None,
+    ) -> Union[str, bytes]:
+        """The asyncio version of :meth:`convert_text`."""
+        return await _run_conversion_async(self._text_conversion(source, outputfile))
+
+    async def convert_file_async(
+        self,
+        source_file: Union[list, str, Path, Iterator],
+        outputfile: Union[None, str, Path] = None,
+        sort_files=True,
+    ) -> Union[str, bytes]:
+        """The asyncio version of :meth:`convert_file`."""
+        return await _run_conversion_async(
+            self._file_conversion(source_file, outputfile, sort_files)
+        )
+
+    def _text_conversion(self, source, outputfile) -> "_Conversion":
+        conversion = self._conversion.with_input(
+            _encode_text_source(source, self.format, self.encoding)
+        )
+        return self._with_outputfile(conversion, outputfile)
+
+    def _file_conversion(self, source_file, outputfile, sort_files) -> "_Conversion":
+        source_file, _ = _resolve_source_files(
+            source_file, self.format, self.cworkdir or os.getcwd()
+        )
+        if isinstance(source_file, (str, Path)):
+            source_file = [source_file]
+        source_file = [str(x) for x in source_file]
+        if sort_files:
+            source_file = sorted(source_file)
+        conversion = self._conversion.with_input_files(source_file)
+        return self._with_outputfile(conversion, outputfile)
+
+    def _with_outputfile(self, conversion, outputfile) -> "_Conversion":
+        base_format = _get_base_format(self.to)
+        if outputfile is None:
+            if base_format in _BINARY_OUTPUT_FORMATS and not self.return_bytes:
+                raise RuntimeError(
+                    "Output to %s only works by using a outputfile." % base_format
+                )
+            return conversion
+        if self.return_bytes:
+            raise RuntimeError("return_bytes can't be used with an outputfile")
+        outputfile = str(outputfile)
+        if base_format == "pdf" and not outputfile.endswith(".pdf"):
+            raise RuntimeError(
+                'PDF output needs an outputfile with ".pdf" as a fileending.'
+            )
+        return conversion.with_output_to(outputfile)
+
+    def close(self) -> None:
+        """Remove the defaults file, if there is one."""
+        if self._defaults_file is not None:
+            with contextlib.suppress(OSError):
+                os.remove(self._defaults_file)
+            self._defaults_file = None
+
+    def __enter__(self) -> "Converter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+
+def convert_text_stream(
+    source: typing.Union[str, bytes, typing.IO, Iterable],
+    to: str,
+    format: str,
+    extra_args: Iterable = (),
+    encoding: str = "utf-8",
+    filters: Union[Iterable, None] = None,
+    verify_format: bool = True,
+    sandbox: bool = False,
+    cworkdir: Union[str, None] = None,
+    chunk_size: int = 65536,
+    return_bytes: bool = False,
+    timeout: Union[float, None] = None,
+) -> Iterator[Union[str, bytes]]:
+    """Converts given `source` from `format` to `to` and yields the output in chunks.
+
+    Unlike :func:`convert_text`, the output is never held in memory as a whole:
+    the chunks are yielded as pandoc writes them. If pandoc fails, its error is
+    raised after the last chunk. Stopping the iteration early kills pandoc.
+
+    The other arguments have the same meaning as for :func:`convert_text`.
+
+    :param int chunk_size: the maximal size of a chunk in bytes
+        (Default value = 65536)
+
+    :param bool return_bytes: yield the raw bytes pandoc writes instead of
+        decoding them as UTF-8; binary output formats like docx are always
+        yielded as bytes, PDF can't be streamed (Default value = False)
+
+    :param float timeout: the seconds after which pandoc is killed and
+        :class:`ConversionTimeoutError` is raised, counted from the start until
+        the last chunk, so it includes the time the chunks are consumed in
+        (Default value = None)
 
-    :returns: converted string or an empty string if an outputfile was given
-    :rtype: str
+    :returns: an iterator of str (or bytes) chunks
 
     :raises RuntimeError:
         if any of the inputs are not valid of if pandoc fails with an error
@@ -82,106 +1484,291 @@ def convert_text(
         if pandoc is not found; make sure it has been installed
         and is available at path.
     """
-
-    # Binary container formats must not be decoded — they are ZIP archives
-    # where a decode/encode round-trip silently corrupts data.
-    _binary_input_formats = {"docx", "odt", "epub", "epub3", "pdf", "pptx"}
-    base_format = _get_base_format(format) if format else ""
-    if isinstance(source, bytes) and base_format not in _binary_input_formats:
-        source = source.decode(encoding, errors="replace")
-
-    return _convert_input(
-        source,
+    conversion = _prepare_conversion(
+        _encode_text_source(source, format, encoding),
         format,
         "string",
         to,
         extra_args=extra_args,
-        outputfile=outputfile,
         filters=filters,
         verify_format=verify_format,
         sandbox=sandbox,
         cworkdir=cworkdir,
+        outputfile=_stream_outputfile(to),
+        timeout=timeout,
     )
+    return _stream_conversion(conversion, chunk_size, return_bytes)
 
 
-def convert_file(
+def convert_file_stream(
     source_file: Union[list, str, Path, Iterator],
     to: str,
     format: Union[str, None] = None,
     extra_args: Iterable = (),
-    outputfile: Union[None, str, Path] = None,
     filters: Union[Iterable, None] = None,
     verify_format: bool = True,
     sandbox: bool = False,
     cworkdir: Union[str, None] = None,
     sort_files=True,
-) -> str:
-    """Converts given `source` from `format` to `to`.
+    chunk_size: int = 65536,
+    return_bytes: bool = False,
+    timeout: Union[float, None] = None,
+) -> Iterator[Union[str, bytes]]:
+    """Converts given `source_file` from `format` to `to` and yields the output in chunks.
 
-    :param (str, list, pathlib.Path) source_file: If a string, should be either
-        an absolute file path, relative file path, or a file pattern (like dir/*.md).
-        If a list, should be a list of file paths, file patterns, or pathlib.Path
-        objects. In addition, pathlib.Path objects as well as the generators produced by
-        pathlib.Path.glob may be specified.
+    This is the streaming version of :func:`convert_file`; see
+    :func:`convert_text_stream` for how the output is yielded.
 
-    :param str to: format into which the input should be converted; can be one of
-            `pypandoc.get_pandoc_formats()[1]`
+    :returns: an iterator of str (or bytes) chunks
 
-    :param str format: the format of the inputs;
-        will be inferred from the source_file with a known filename extension;
-        can be one of `pypandoc.get_pandoc_formats()[1]` (Default value = None)
+    :raises RuntimeError:
+        if any of the inputs are not valid of if pandoc fails with an error
+    :raises OSError:
+        if pandoc is not found; make sure it has been installed
+        and is available at path.
+    """
+    if cworkdir is None:
+        cworkdir = os.getcwd()
 
-    :param list extra_args: extra arguments (list of strings) to be passed to pandoc
-            (Default value = ())
+    source_file, format = _resolve_source_files(source_file, format, cworkdir)
 
-    :param str outputfile: output will be written to outputfile or the converted content
-            returned if None. The output filename can be specified as a string
-            or pathlib.Path object. (Default value = None)
+    conversion = _prepare_conversion(
+        source_file,
+        format,
+        "path",
+        to,
+        extra_args=extra_args,
+        filters=filters,
+        verify_format=verify_format,
+        sandbox=sandbox,
+        cworkdir=cworkdir,
+        sort_files=sort_files,
+        outputfile=_stream_outputfile(to),
+        timeout=timeout,
+    )
+    return _stream_conversion(conversion, chunk_size, return_bytes)
 
-    :param list filters: pandoc filters e.g. filters=['pandoc-citeproc']
 
-    :param bool verify_format: Verify from and to format before converting.
-        Should only be set False when confident of the formats
-        and performance is an issue. (Default value = True)
+def _stream_outputfile(to):
+    # pandoc only writes binary formats to stdout when asked to with "-o -"
+    base_format = _get_base_format(normalize_format(to))
+    if base_format in _BINARY_OUTPUT_FORMATS and base_format != "pdf":
+        return "-"
+    return None
 
-    :param bool sandbox: Run pandoc in pandocs own sandbox mode, limiting IO operations
-        in readers and writers to reading the files specified on the command line.
-        Anyone using pandoc on untrusted user input should use this option.
-        Note: This only does something, on pandoc >= 2.15 (Default value = False)
 
-    :param str cworkdir: set the current working directory (Default value = None)
+def _decode_text_source(source, format, encoding):
+    """Decode `source` for :func:`convert_text`, unless it's a binary format."""
+    # Binary container formats must not be decoded — they are ZIP archives
+    # where a decode/encode round-trip silently corrupts data.
+    base_format = _get_base_format(format) if format else ""
+    if isinstance(source, bytes) and base_format not in _BINARY_INPUT_FORMATS:
+        source = source.decode(encoding, errors="replace")
+    return source
 
-    :param bool sort_files: causes the files to be sorted before being passed to pandoc
-        (Default value = True)
 
-    :returns: converted string or an empty string if an outputfile was given
-    :rtype: str
+def _encode_text_source(source, format, encoding):
+    """Return `source` of :func:`convert_text` as the input for pandoc's stdin.
 
-    :raises RuntimeError:
-        if any of the inputs are not valid of if pandoc fails with an error
-    :raises OSError:
-        if pandoc is not found; make sure it has been installed
-        and is available at path.
+    That's either a bytes-like object, written at once, or an iterable of bytes
+    chunks, written one after the other. Text is encoded as UTF-8. Bytes in
+    another encoding are transcoded chunk by chunk, while valid UTF-8 is passed
+    on unchanged. Undecodable bytes are replaced, like
+    ``bytes.decode(encoding, errors="replace")`` does.
     """
-    # check if we have a working directory
-    # if we don't, we use the current working directory
-    if cworkdir is None:
-        cworkdir = os.getcwd()
+    binary = bool(format) and _get_base_format(format) in _BINARY_INPUT_FORMATS
+    if isinstance(source, str):
+        return source.encode("utf-8")
+    if isinstance(source, _BYTES_LIKE):
+        if binary or _is_utf8(source, encoding):
+            return source
+        return _TranscodedBuffer(source, encoding)
+    if hasattr(source, "read"):
+        file_input = _FileInput.from_file(source, binary, encoding)
+        if file_input is not None:
+            return file_input
+        chunks = _read_chunks(source)
+    elif isinstance(source, Iterable):
+        chunks = iter(source)
+    else:
+        raise RuntimeError("Invalid source! Got %s" % type(source).__name__)
+    return chunks if binary else _transcode_chunks(chunks, encoding)
 
-    if _is_network_path(source_file):  # if the source_file is an url
-        format = _identify_format_from_path(source_file, format)
-        return _convert_input(
-            source_file,
-            format,
-            "path",
-            to,
-            extra_args=extra_args,
-            outputfile=outputfile,
-            filters=filters,
-            verify_format=verify_format,
-            sandbox=sandbox,
-            cworkdir=cworkdir,
+
+def _is_utf8(buffer, encoding) -> bool:
+    """Return whether `buffer` in `encoding` is valid UTF-8, checked in chunks."""
+    if codecs.lookup(encoding).name != "utf-8":
+        return False
+    view = memoryview(buffer).cast("B")
+    pos = 0
+    while pos < len(view):
+        chunk = view[pos : pos + _INPUT_CHUNK_SIZE]
+        final = pos + len(chunk) == len(view)
+        try:
+            pos += codecs.utf_8_decode(chunk, "strict", final)[1]
+        except UnicodeDecodeError:
+            return False
+    return True
+
+
+class _FileInput:
+    """A regular file which pandoc reads from directly, as its stdin.
+
+    The input doesn't pass through pypandoc then. Pandoc reads from `offset` to
+    the end of the file.
+    """
+
+    def __init__(self, fd: int, offset: int, size: int):
+        self.fd = fd
+        self.offset = offset
+        self.size = size
+
+    @classmethod
+    def from_file(cls, file, binary, encoding) -> Union["_FileInput", None]:
+        """Return the input for the binary file object `file`, if pandoc can
+        read it as it is: a regular file with a binary format or valid UTF-8.
+        """
+        if isinstance(file, io.TextIOBase):
+            return None
+        try:
+            fd = file.fileno()
+            offset = file.tell()
+            file_stat = os.fstat(fd)
+        except (AttributeError, OSError, ValueError):
+            # e.g. io.BytesIO
+            return None
+        if not stat.S_ISREG(file_stat.st_mode):
+            return None
+        size = max(file_stat.st_size - offset, 0)
+        if not binary and size:
+            with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mapped:
+                with memoryview(mapped) as view:
+                    if not _is_utf8(view[offset:], encoding):
+                        return None
+        # to the file object, the file is read to the end, like it would be if
+        # pypandoc read it
+        file.seek(0, os.SEEK_END)
+        return cls(fd, offset, size)
+
+    def rewind(self) -> int:
+        """Move the file to where pandoc starts reading and return its file
+        descriptor."""
+        os.lseek(self.fd, self.offset, os.SEEK_SET)
+        return self.fd
+
+
+class _TranscodedBuffer:
+    """The UTF-8 chunks of a bytes-like object, which can be iterated again."""
+
+    def __init__(self, buffer, encoding):
+        self.buffer = buffer
+        self.encoding = encoding
+
+    def __iter__(self):
+        view = memoryview(self.buffer).cast("B")
+        chunks = (
+            view[i : i + _INPUT_CHUNK_SIZE]
+            for i in range(0, len(view), _INPUT_CHUNK_SIZE)
         )
+        return _transcode_chunks(chunks, self.encoding)
+
+
+def _read_chunks(file):
+    while True:
+        chunk = file.read(_INPUT_CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _transcode_chunks(chunks, encoding):
+    """Yield `chunks` of str or bytes in `encoding` as UTF-8 bytes."""
+    utf8 = codecs.lookup(encoding).name == "utf-8"
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    # the start of a UTF-8 sequence split between two chunks
+    pending = b""
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            data = chunk.encode("utf-8")
+        elif utf8:
+            if pending:
+                chunk = pending + bytes(chunk)
+            try:
+                consumed = codecs.utf_8_decode(chunk, "strict", False)[1]
+                data = chunk[:consumed]
+            except UnicodeDecodeError:
+                text, consumed = codecs.utf_8_decode(chunk, "replace", False)
+                data = text.encode("utf-8")
+            pending = bytes(chunk[consumed:])
+        else:
+            data = decoder.decode(bytes(chunk)).encode("utf-8")
+        if data:
+            yield data
+    if utf8:
+        tail = codecs.utf_8_decode(pending, "replace", True)[0]
+    else:
+        tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail.encode("utf-8")
+
+
+def _write_input(stdin, input) -> None:
+    """Write `input` (see :func:`_encode_text_source`) to `stdin` and close it."""
+    chunks = [input] if isinstance(input, _BYTES_LIKE) else input
+    try:
+        for chunk in chunks:
+            try:
+                stdin.write(chunk)
+            except OSError:
+                # pandoc exited (or was killed) before reading all of its input
+                return
+    finally:
+        try:
+            stdin.close()
+        except OSError:
+            pass
+
+
+class _PipeThreads:
+    """Feed pandoc's stdin and drain its stderr in threads.
+
+    This way pandoc can never block on a full pipe while its stdout is read.
+    An exception raised while reading the input is kept in `error`.
+    """
+
+    def __init__(self, p, input):
+        self.stderr = b""
+        self.error = None
+        self._threads = [threading.Thread(target=self._drain, args=(p.stderr,))]
+        if p.stdin is not None:
+            self._threads.append(
+                threading.Thread(target=self._feed, args=(p.stdin, input))
+            )
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def _drain(self, stderr):
+        self.stderr = stderr.read()
+
+    def _feed(self, stdin, input):
+        try:
+            _write_input(stdin, input)
+        except Exception as e:
+            self.error = e
+
+    def join(self) -> None:
+        for thread in self._threads:
+            thread.join()
+
+
+def _resolve_source_files(source_file, format, cworkdir):
+    """Return the input files and their format for :func:`convert_file`.
+
+    :raises RuntimeError: if `source_file` doesn't point to any files
+    """
+    if _is_network_path(source_file):  # if the source_file is an url
+        return source_file, _identify_format_from_path(source_file, format)
 
     # convert the source file to a path object internally
     if isinstance(source_file, str):
@@ -227,19 +1814,7 @@ def convert_file(
     if len(discovered_source_files) == 1:
         discovered_source_files = discovered_source_files[0]
 
-    return _convert_input(
-        discovered_source_files,
-        format,
-        "path",
-        to,
-        extra_args=extra_args,
-        outputfile=outputfile,
-        filters=filters,
-        verify_format=verify_format,
-        sandbox=sandbox,
-        cworkdir=cworkdir,
-        sort_files=sort_files,
-    )
+    return discovered_source_files, format
 
 
 def _identify_path(source) -> bool:
@@ -414,8 +1989,257 @@ def _try_auto_install_packages(stderr):
         return []
 
 
-def _convert_input(
-    source: str,
+class _Conversion:
+    """Everything needed to run pandoc for one conversion."""
+
+    def __init__(
+        self,
+        args,
+        env,
+        cworkdir,
+        string_input,
+        input,
+        to,
+        outputfile,
+        return_bytes,
+        sink=None,
+        input_files=(),
+        python_filters=(),
+        timeout=None,
+        cancel=None,
+        deadline=None,
+    ):
+        self.args = args
+        self.env = env
+        self.cworkdir = cworkdir
+        self.string_input = string_input
+        self.input = input
+        self.to = to
+        self.outputfile = outputfile
+        self.return_bytes = return_bytes
+        self.sink = sink
+        self.input_files = list(input_files)
+        # (Python callables, arguments of the pandoc filters following them)
+        self.python_filters = list(python_filters)
+        self.timeout = timeout
+        self.cancel = cancel
+        # time.monotonic() when the conversion times out, see started()
+        self.deadline = deadline
+        # If converting to PDF or LaTeX, try to set up TinyTeX on PATH
+        # so pandoc finds LaTeX engines automatically.
+        self.needs_latex = _get_base_format(to) in ("pdf", "latex")
+        # When converting to PDF with pytinytex available, retry on missing
+        # LaTeX packages (auto-install via tlmgr and re-run pandoc).
+        if self.needs_latex and _is_tinytex_available():
+            self._max_attempts = _MAX_TINYTEX_INSTALL_ATTEMPTS
+        else:
+            self._max_attempts = 1
+
+    @property
+    def max_attempts(self) -> int:
+        # the chunks of an iterator can't be written to pandoc a second time
+        return 1 if isinstance(self.input, Iterator) else self._max_attempts
+
+    def started(self) -> "_Conversion":
+        """Return this conversion with its deadline set, if it has a timeout.
+
+        The deadline is set only once, so it's shared by all attempts and all
+        steps of the conversion.
+        """
+        if self.timeout is None or self.deadline is not None:
+            return self
+        conversion = copy.copy(self)
+        conversion.deadline = time.monotonic() + self.timeout
+        return conversion
+
+    def check_limits(self) -> Union[float, None]:
+        """Return the seconds left until the conversion times out (None without
+        a timeout), or raise if it was cancelled or has timed out."""
+        if self.cancel is not None and self.cancel.cancelled:
+            raise CancelledError("The conversion was cancelled")
+        if self.timeout is None:
+            return None
+        if self.deadline is None:
+            return self.timeout
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            raise ConversionTimeoutError(self.timeout)
+        return remaining
+
+    @property
+    def new_session(self) -> bool:
+        # pandoc gets a process group of its own, which is killed as a whole
+        return os.name == "posix" and (
+            self.timeout is not None or self.cancel is not None
+        )
+
+    def with_input(self, input) -> "_Conversion":
+        """Return a copy of this conversion which writes `input` to stdin."""
+        conversion = copy.copy(self)
+        conversion.input = input
+        return conversion
+
+    def with_input_files(self, input_files) -> "_Conversion":
+        """Return a copy of this conversion which reads the files `input_files`."""
+        conversion = copy.copy(self)
+        conversion.args = (
+            self.args[:3] + list(input_files) + self.args[3 + len(self.input_files) :]
+        )
+        conversion.string_input = False
+        conversion.input = None
+        conversion.input_files = list(input_files)
+        return conversion
+
+    def with_output_to(self, outputfile) -> "_Conversion":
+        """Return a copy of this conversion which writes to `outputfile`."""
+        conversion = copy.copy(self)
+        conversion.args = self.args + ["--output=" + outputfile]
+        conversion.outputfile = outputfile
+        conversion.return_bytes = False
+        conversion.sink = None
+        return conversion
+
+    @property
+    def source_in_memory(self) -> bool:
+        return self.string_input and isinstance(self.input, _BYTES_LIKE)
+
+    def get_stdin(self):
+        """Return what pandoc's stdin is: a pipe for sources in memory or the
+        file descriptor of a :class:`_FileInput`, rewound for this run."""
+        if isinstance(self.input, _FileInput):
+            return self.input.rewind()
+        return subprocess.PIPE if self.string_input else None
+
+    @property
+    def piped_input(self):
+        """The input which is written to pandoc's stdin pipe."""
+        return None if isinstance(self.input, _FileInput) else self.input
+
+    @property
+    def input_size(self) -> Union[int, None]:
+        """The size of the input in bytes, None if it isn't known."""
+        if isinstance(self.input, _BYTES_LIKE):
+            return memoryview(self.input).nbytes
+        if isinstance(self.input, _FileInput):
+            return self.input.size
+        return 0 if self.input is None else None
+
+    def cache_key(self, tag: Union[str, None] = None) -> Union[str, None]:
+        """Return the key of the result in the result cache, if it can be cached.
+
+        None without a result cache, so identical conversions are only shared
+        when their results are cached anyway. A `tag` keeps apart the results
+        of the same conversion done in another way, e.g. by convert_multi().
+        """
+        if (
+            get_result_cache() is None
+            or not self.source_in_memory
+            or self.outputfile not in (None, "-")
+            or self.sink is not None
+            or self.python_filters
+        ):
+            return None
+        return _get_result_cache_key(
+            get_pandoc_version(),
+            self.args,
+            self.input,
+            self.cworkdir,
+            self.return_bytes if tag is None else [tag, self.return_bytes],
+        )
+
+    def ast_key_args(self) -> Union[list, None]:
+        """Return the arguments the JSON representation of the source depends on.
+
+        That's the pandoc path, the input format and all arguments except for
+        the output format and the options which only affect writing. None if
+        the source isn't in memory or already is JSON.
+        """
+        if (
+            not self.source_in_memory
+            or self.args[1] == "--from=json"
+            or self.python_filters
+            or any(_is_defaults_option(arg) for arg in self.args)
+        ):
+            # the options in a defaults file can't be split into those for
+            # reading and writing
+            return None
+        return self.args[:2] + _get_reading_args(self.args[3:])
+
+    def ast_key(self) -> Union[str, None]:
+        """Return the key of the source's JSON representation in the AST cache."""
+        args = self.ast_key_args()
+        if args is None:
+            return None
+        return _get_result_cache_key(
+            get_pandoc_version(), args, self.input, self.cworkdir, "ast"
+        )
+
+    def to_document(self) -> "_Conversion":
+        """Return the conversion of the source to its JSON representation."""
+        args = self.args[:2] + ["--to=json"] + _get_reading_args(self.args[3:])
+        return _Conversion(
+            args,
+            self.env,
+            self.cworkdir,
+            self.string_input,
+            self.input,
+            "json",
+            None,
+            True,
+            input_files=self.input_files,
+            timeout=self.timeout,
+            cancel=self.cancel,
+            deadline=self.deadline,
+        )
+
+    def filtering(self, document: bytes, filter_args) -> "_Conversion":
+        """Return the conversion running the pandoc filters `filter_args` on
+        the JSON representation `document`."""
+        args = self.args[:1] + ["--from=json", "--to=json"]
+        if "--sandbox" in self.args:
+            args.append("--sandbox")
+        return _Conversion(
+            args + filter_args,
+            self.env,
+            self.cworkdir,
+            True,
+            document,
+            "json",
+            None,
+            True,
+            timeout=self.timeout,
+            cancel=self.cancel,
+            deadline=self.deadline,
+        )
+
+    def from_document(self, document: bytes, filter_args=()) -> "_Conversion":
+        """Return this conversion, but from the JSON representation `document`.
+
+        :param list filter_args: the arguments of pandoc filters to run before
+            writing
+        """
+        options = self.args[3 + len(self.input_files) :]
+        conversion = copy.copy(self)
+        conversion.args = (
+            self.args[:1]
+            + ["--from=json", self.args[2]]
+            + _get_writing_args(options)
+            + list(filter_args)
+        )
+        conversion.string_input = True
+        conversion.input_files = []
+        conversion.python_filters = []
+        conversion.input = document
+        return conversion
+
+    @property
+    def pdf_to_memory(self) -> bool:
+        # PDF engines need a real output file, see _run_conversion()
+        return self.return_bytes and _get_base_format(self.to) == "pdf"
+
+
+def _prepare_conversion(
+    source,
     format,
     input_type,
     to,
@@ -426,16 +2250,33 @@ def _convert_input(
     sandbox=False,
     cworkdir=None,
     sort_files=True,
-):
+    return_bytes=False,
+    sink=None,
+    timeout=None,
+    cancel=None,
+) -> "_Conversion":
 
     _check_log_handler()
 
     logger.debug("Ensuring pandoc path...")
-    _ensure_pandoc_path()
+    pandoc_path = _ensure_pandoc_path()
+
+    validated_outputfile = outputfile
+    # with a sink, the output isn't decoded either
+    return_bytes = return_bytes or sink is not None
+    if return_bytes:
+        if outputfile:
+            raise RuntimeError("return_bytes and sink can't be used with an outputfile")
+        base_to_format = _get_base_format(normalize_format(to))
+        if base_to_format == "pdf":
+            # written to a temporary file by _run_conversion()
+            validated_outputfile = "output.pdf"
+        elif base_to_format in _BINARY_OUTPUT_FORMATS:
+            outputfile = validated_outputfile = "-"
 
     if verify_format:
         logger.debug("Verifying format...")
-        format, to = _validate_formats(format, to, outputfile)
+        format, to = _validate_formats(format, to, validated_outputfile)
     else:
         format = normalize_format(format)
         to = normalize_format(to)
@@ -453,78 +2294,378 @@ def _convert_input(
     if sort_files:
         input_file = sorted(input_file)
 
-    args = [__pandoc_path, "--from=" + format]
+    args = [pandoc_path, "--from=" + format]
+
+    args.append("--to=" + to)
+
+    args += input_file
+
+    if outputfile:
+        args.append("--output=" + str(outputfile))
+
+    if sandbox:
+        # sandbox was introduced in pandoc 2.15, so only add if we are using >= 2.15.
+        if ensure_pandoc_minimal_version(2, 15):
+            logger.debug("Adding sandbox argument...")
+            args.append("--sandbox")
+        else:
+            logger.warning(
+                "Sandbox argument was used, but pandoc version is too low. "
+                "Ignoring argument."
+            )
+
+    args.extend(extra_args)
+
+    # adds the proper filter syntax for each item in the filters list
+    python_filters = []
+    if filters is not None:
+        if isinstance(filters, str):
+            filters = filters.split()
+        for x in filters:
+            if callable(x):
+                # applied by _prepare_writing(), together with the pandoc
+                # filters following them
+                if not python_filters or python_filters[-1][1]:
+                    python_filters.append(([], []))
+                python_filters[-1][0].append(x)
+            elif python_filters:
+                python_filters[-1][1].append(_get_filter_arg(x, cworkdir))
+            else:
+                args.append(_get_filter_arg(x, cworkdir))
+
+    if _get_base_format(to) in ("pdf", "latex"):
+        _try_setup_tinytex()
+
+    # To get access to pandoc-citeproc when we use a included copy of pandoc,
+    # we need to add the pypandoc/files dir to the PATH
+    new_env = os.environ.copy()
+    files_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "files")
+    new_env["PATH"] = new_env.get("PATH", "") + os.pathsep + files_path
+
+    if string_input and isinstance(source, str):
+        source = source.encode("utf-8")
+
+    return _Conversion(
+        args,
+        new_env,
+        cworkdir,
+        string_input,
+        source if string_input else None,
+        to,
+        outputfile,
+        return_bytes,
+        sink,
+        input_files=input_file,
+        python_filters=python_filters,
+        timeout=timeout,
+        cancel=cancel,
+    )
+
+
+def _is_defaults_option(arg) -> bool:
+    arg = str(arg)
+    return arg.partition("=")[0] == "--defaults" or arg.startswith("-d")
+
+
+def _get_filter_arg(filter, cworkdir) -> str:
+    if isinstance(filter, FilterServer):
+        return "--filter=" + filter.shim
+    if filter.endswith(".lua"):
+        return "--lua-filter=" + filter
+    if __filter_servers is not None and filter.endswith(".py"):
+        path = os.path.join(cworkdir or os.getcwd(), os.path.expanduser(filter))
+        if os.path.isfile(path):
+            return "--filter=" + _get_filter_server(path).shim
+    return "--filter=" + filter
+
+
+def _get_filter_server(path: str) -> FilterServer:
+    path = os.path.realpath(path)
+    with __filter_servers_lock:
+        if __filter_servers is None:
+            # disabled meanwhile; a server of its own is stopped when it's
+            # garbage collected
+            return FilterServer(path)
+        server = __filter_servers.get(path)
+        if server is None:
+            server = __filter_servers[path] = FilterServer(path)
+        return server
+
+
+def _retry_conversion(conversion: _Conversion, returncode, stderr, attempt) -> bool:
+    """Return whether a failed conversion is worth another attempt."""
+    # If pandoc failed and we have retries left, try auto-installing
+    # missing LaTeX packages.
+    if returncode != 0 and attempt < conversion.max_attempts - 1:
+        installed = _try_auto_install_packages(stderr.decode("utf-8", errors="replace"))
+        if installed:
+            logger.info(
+                "Auto-installed LaTeX packages: %s, retrying pandoc...",
+                installed,
+            )
+            return True  # retry with newly installed packages
+    # success, single-attempt mode or nothing could be installed
+    return False
+
+
+def _finish_conversion(conversion: _Conversion, returncode, stdout, stderr):
+    """Check the result of running pandoc and return the converted output."""
+    if (
+        stdout is not None
+        and not conversion.return_bytes
+        and not (
+            conversion.to in _BINARY_OUTPUT_FORMATS and conversion.outputfile == "-"
+        )
+    ):
+        stdout = stdout.decode("utf-8", errors="replace")
+
+    _check_conversion(conversion, returncode, stderr)
+
+    # if there is an outputfile, then stdout is likely empty!
+    # (and with a sink pandoc didn't write to us at all)
+    return stdout if stdout is not None else ""
+
+
+def _get_sink_fileno(sink) -> Union[int, None]:
+    """Return the file descriptor pandoc can write the output for `sink` to."""
+    if isinstance(sink, int):
+        return sink
+    if isinstance(sink, io.TextIOBase):
+        # the output has to be decoded and encoded in the encoding of the file
+        return None
+    try:
+        return sink.fileno()
+    except (AttributeError, OSError, ValueError):
+        # no file descriptor, e.g. io.BytesIO raises io.UnsupportedOperation
+        return None
+
+
+def _write_to_sink(sink, chunks) -> None:
+    for chunk in chunks:
+        sink.write(chunk)
+
+
+def _private_tempdir() -> tempfile.TemporaryDirectory:
+    """Return a temporary directory only the current user can access.
+
+    It's created in ``/dev/shm`` where that's available, so files written to
+    it stay in memory.
+    """
+    shm = "/dev/shm"
+    if os.path.isdir(shm) and os.access(shm, os.W_OK | os.X_OK):
+        return tempfile.TemporaryDirectory(prefix="pypandoc-", dir=shm)
+    return tempfile.TemporaryDirectory(prefix="pypandoc-")
+
+
+def _check_conversion(conversion: _Conversion, returncode, stderr) -> None:
+    """Raise pandoc's error if it failed, otherwise log its messages."""
+    stderr = stderr.decode("utf-8", errors="replace")
+
+    # check that pandoc returned successfully
+    if returncode != 0:
+        hint = ""
+        if conversion.needs_latex:
+            try:
+                import pytinytex  # noqa: F401
+
+                hint = (
+                    "\nHint: pytinytex is installed but could not resolve "
+                    "the missing LaTeX packages. You may need to install "
+                    "them manually with pytinytex.install('<package>')."
+                )
+            except ImportError:
+                hint = (
+                    "\nHint: Install pypandoc[tinytex] for automatic "
+                    "LaTeX package management: pip install pypandoc[tinytex]"
+                )
+        raise RuntimeError(
+            "Pandoc died with exitcode "
+            f'"{returncode}" during conversion: '
+            f"{stderr}{hint}"
+        )
+
+    # if there is output on stderr, process it and send to logger
+    if stderr:
+        for level, msg in _classify_pandoc_logging(stderr):
+            logger.log(level, msg)
+
+
+def _convert_input(
+    source: str,
+    format,
+    input_type,
+    to,
+    extra_args=(),
+    outputfile=None,
+    filters=None,
+    verify_format=True,
+    sandbox=False,
+    cworkdir=None,
+    sort_files=True,
+    return_bytes=False,
+    sink=None,
+    timeout=None,
+):
+    conversion = _prepare_conversion(
+        source,
+        format,
+        input_type,
+        to,
+        extra_args=extra_args,
+        outputfile=outputfile,
+        filters=filters,
+        verify_format=verify_format,
+        sandbox=sandbox,
+        cworkdir=cworkdir,
+        sort_files=sort_files,
+        return_bytes=return_bytes,
+        sink=sink,
+        timeout=timeout,
+    )
+
+    return _run_conversion(conversion)
+
+
+def _run_conversion(conversion: _Conversion):
+    conversion = conversion.started()
+    conversion.check_limits()
+    if conversion.python_filters or _uses_ast_cache(conversion):
+        conversion = _prepare_writing(conversion)
+    key = conversion.cache_key()
+    if key is None:
+        return _run_pandoc(conversion)
+    while True:
+        output = _get_cached_result(key)
+        if output is not None:
+            return output
+        future, leader = _join_in_flight(key)
+        if leader:
+            break
+        if _in_event_loop():
+            # the identical conversion may be awaited on this very loop, which
+            # can't go on while this thread waits for it
+            return _run_pandoc(conversion)
+        try:
+            return _wait_in_flight(future, conversion)
+        except CancelledError:
+            if not future.cancelled():
+                raise
+            # the conversion we waited for was cancelled, try again
 
-    args.append("--to=" + to)
+    try:
+        output = _run_pandoc(conversion)
+    except BaseException as e:
+        _leave_in_flight(key, future, exception=e)
+        raise
+    _leave_in_flight(key, future, output=output)
+    return output
 
-    args += input_file
 
-    if outputfile:
-        args.append("--output=" + str(outputfile))
+def _in_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
 
-    if sandbox:
-        # sandbox was introduced in pandoc 2.15, so only add if we are using >= 2.15.
-        if ensure_pandoc_minimal_version(2, 15):
-            logger.debug("Adding sandbox argument...")
-            args.append("--sandbox")
-        else:
-            logger.warning(
-                "Sandbox argument was used, but pandoc version is too low. "
-                "Ignoring argument."
-            )
 
-    args.extend(extra_args)
+def _wait_in_flight(future: Future, conversion: _Conversion):
+    """Wait for the result of the identical conversion `future`.
 
-    # adds the proper filter syntax for each item in the filters list
-    if filters is not None:
-        if isinstance(filters, str):
-            filters = filters.split()
-        f = [
-            "--lua-filter=" + x if x.endswith(".lua") else "--filter=" + x
-            for x in filters
-        ]
-        args.extend(f)
+    The wait is interrupted in short intervals to check the timeout and the
+    cancellation token of `conversion`.
+    """
+    while True:
+        remaining = conversion.check_limits()
+        if remaining is None or remaining > _IN_FLIGHT_POLL_INTERVAL:
+            remaining = _IN_FLIGHT_POLL_INTERVAL
+        try:
+            return future.result(remaining)
+        except FutureTimeoutError:
+            if future.done():
+                raise
 
-    # If converting to PDF or LaTeX, try to set up TinyTeX on PATH
-    # so pandoc finds LaTeX engines automatically.
-    needs_latex = _get_base_format(to) in ("pdf", "latex")
-    if needs_latex:
-        _try_setup_tinytex()
 
-    # To get access to pandoc-citeproc when we use a included copy of pandoc,
-    # we need to add the pypandoc/files dir to the PATH
-    new_env = os.environ.copy()
-    files_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "files")
-    new_env["PATH"] = new_env.get("PATH", "") + os.pathsep + files_path
-    creation_flag = (
-        0x08000000 if sys.platform == "win32" else 0
-    )  # set creation flag to not open pandoc in new console on windows
+def _get_cached_result(key: str):
+    cache = __result_cache
+    output = cache.get(key) if cache is not None else None
+    if output is not None:
+        logger.debug("Using cached conversion result")
+    return output
 
-    # When converting to PDF with pytinytex available, retry on missing
-    # LaTeX packages (auto-install via tlmgr and re-run pandoc).
-    if needs_latex and _is_tinytex_available():
-        max_attempts = _MAX_TINYTEX_INSTALL_ATTEMPTS
-    else:
-        max_attempts = 1
 
-    for attempt in range(max_attempts):
-        old_wd = os.getcwd()
-        if cworkdir and old_wd != cworkdir:
-            os.chdir(cworkdir)
+def _join_in_flight(key: str) -> typing.Tuple[Future, bool]:
+    """Return the future of the identical conversion which is running right now.
 
+    If there is none, a new future is registered and the caller has to run the
+    conversion and pass its result to :func:`_leave_in_flight()`. The second
+    value tells whether this is the case.
+    """
+    with __in_flight_lock:
+        future = __in_flight.get(key)
+        if future is not None:
+            return future, False
+        future = __in_flight[key] = Future()
+        return future, True
+
+
+def _leave_in_flight(key: str, future: Future, output=None, exception=None):
+    """Cache the result of a conversion and pass it to everyone waiting for it."""
+    if exception is None and __result_cache is not None:
+        __result_cache.put(key, output)
+    # remove the future only after caching the result, so identical
+    # conversions find either of them
+    with __in_flight_lock:
+        del __in_flight[key]
+    if exception is None:
+        future.set_result(output)
+    elif isinstance(exception, Exception) and not isinstance(
+        exception, (ConversionTimeoutError, CancelledError)
+    ):
+        future.set_exception(exception)
+    else:
+        # e.g. a KeyboardInterrupt, a cancelled task or the timeout or the
+        # cancellation token of this caller: the waiters have limits of their
+        # own and run the conversion themselves
+        future.cancel()
+
+
+def _run_pandoc(conversion: _Conversion):
+    if conversion.pdf_to_memory:
+        with _private_tempdir() as tempdir:
+            outputfile = os.path.join(tempdir, "output.pdf")
+            _run_pandoc(conversion.with_output_to(outputfile))
+            with open(outputfile, "rb") as f:
+                if conversion.sink is None:
+                    return f.read()
+                _write_to_sink(conversion.sink, _read_chunks(f))
+                return ""
+
+    stdout_fd = None
+    if conversion.sink is not None:
+        stdout_fd = _get_sink_fileno(conversion.sink)
+        if stdout_fd is None:
+            # nothing pandoc could write to: pass its output on chunk by chunk
+            chunks = _stream_conversion(
+                conversion,
+                _INPUT_CHUNK_SIZE,
+                not isinstance(conversion.sink, io.TextIOBase),
+            )
+            _write_to_sink(conversion.sink, chunks)
+            return ""
+        if hasattr(conversion.sink, "flush"):
+            # anything written to the sink so far goes before pandoc's output
+            conversion.sink.flush()
+
+    for attempt in range(conversion.max_attempts):
+        timeout = conversion.check_limits()
         logger.debug("Running pandoc...")
-        p = subprocess.Popen(
-            args,
-            stdin=subprocess.PIPE if string_input else None,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            env=new_env,
-            creationflags=creation_flag,
+        # run pandoc in cworkdir instead of changing the working directory of
+        # the whole process, so conversions in other threads aren't affected
+        p = _spawn_pandoc(
+            conversion, subprocess.PIPE if stdout_fd is None else stdout_fd
         )
 
-        if cworkdir is not None:
-            os.chdir(old_wd)
-
         # something else than 'None' indicates that the process already terminated
         if not (p.returncode is None):
             raise RuntimeError(
@@ -534,61 +2675,418 @@ def _convert_input(
                 )
             )
 
-        if string_input:
-            if isinstance(source, str):
-                source = source.encode("utf-8")
-        stdout, stderr = p.communicate(source if string_input else None)
+        stdout, stderr = _communicate(p, conversion, timeout)
 
-        if not (to in ["odt", "docx", "epub", "epub3", "pdf"] and outputfile == "-"):
-            stdout = stdout.decode("utf-8", errors="replace")
+        if not _retry_conversion(conversion, p.returncode, stderr, attempt):
+            break
 
-        stderr = stderr.decode("utf-8", errors="replace")
+    return _finish_conversion(conversion, p.returncode, stdout, stderr)
 
-        # If pandoc failed and we have retries left, try auto-installing
-        # missing LaTeX packages.
-        if p.returncode != 0 and attempt < max_attempts - 1:
-            installed = _try_auto_install_packages(stderr)
-            if installed:
-                logger.info(
-                    "Auto-installed LaTeX packages: %s, retrying pandoc...",
-                    installed,
-                )
-                continue  # retry with newly installed packages
-            # Nothing could be installed, no point retrying
-            break
 
-        break  # success or single-attempt mode
+def _spawn_pandoc(conversion: _Conversion, stdout):
+    """Start pandoc for `conversion` with the spawn strategy which is set.
 
-    # check that pandoc returned successfully
-    if p.returncode != 0:
-        hint = ""
-        if needs_latex:
+    Pandoc's stdin is a pipe if the source is in memory, its stderr always is.
+    """
+    stdin = conversion.get_stdin()
+    cwd = conversion.cworkdir or None
+    if __spawn_strategy == "forkserver":
+        p = __spawn_server.spawn(
+            conversion.args,
+            stdin,
+            stdout,
+            subprocess.PIPE,
+            conversion.env,
+            cwd,
+            conversion.new_session,
+        )
+    else:
+        p = subprocess.Popen(
+            conversion.args,
+            stdin=stdin,
+            stdout=stdout,
+            stderr=subprocess.PIPE,
+            env=conversion.env,
+            cwd=cwd,
+            creationflags=_CREATION_FLAGS,
+            # Python's file descriptors aren't inheritable anyway (PEP 446); not
+            # closing the others lets subprocess use posix_spawn() where it can
+            close_fds=__spawn_strategy != "posix_spawn",
+            start_new_session=conversion.new_session,
+        )
+    if _F_SETPIPE_SZ is not None:
+        _enlarge_pipes(p, conversion.input_size)
+    return p
+
+
+def _enlarge_pipes(p, input_size) -> None:
+    """Enlarge pandoc's stdin and stdout pipes for large inputs (or inputs of
+    unknown size), so they are written and read with fewer system calls.
+
+    Small inputs keep the default size: the pages of all pipes of a user are
+    limited, and new pipes are made smaller once that limit is reached.
+    """
+    if input_size is not None and input_size <= 65536:
+        return
+    size = _PIPE_SIZE if input_size is None else min(input_size, _PIPE_SIZE)
+    for pipe in (p.stdin, p.stdout):
+        if pipe is not None:
             try:
-                import pytinytex  # noqa: F401
+                fcntl.fcntl(pipe.fileno(), _F_SETPIPE_SZ, size)
+            except OSError:
+                # e.g. the limit of pipe pages is reached
+                pass
 
-                hint = (
-                    "\nHint: pytinytex is installed but could not resolve "
-                    "the missing LaTeX packages. You may need to install "
-                    "them manually with pytinytex.install('<package>')."
-                )
-            except ImportError:
-                hint = (
-                    "\nHint: Install pypandoc[tinytex] for automatic "
-                    "LaTeX package management: pip install pypandoc[tinytex]"
-                )
-        raise RuntimeError(
-            "Pandoc died with exitcode "
-            f'"{p.returncode}" during conversion: '
-            f"{stderr}{hint}"
+
+@contextlib.contextmanager
+def _on_cancel(conversion, callback):
+    """Call `callback` if `conversion` is cancelled while in this context."""
+    if conversion.cancel is None:
+        yield
+        return
+    conversion.cancel._add_callback(callback)
+    try:
+        yield
+    finally:
+        conversion.cancel._remove_callback(callback)
+
+
+def _communicate(p, conversion: _Conversion, timeout=None):
+    """Write the input of `conversion` to pandoc's stdin, read its output and
+    wait for it to exit, killing it after `timeout` seconds or if the
+    conversion is cancelled.
+
+    :returns: stdout (None if it isn't a pipe) and stderr
+    """
+    input = conversion.piped_input
+    if not _SUPERVISED:
+        watchdog = _Watchdog(p, conversion, timeout)
+        try:
+            if isinstance(input, _BYTES_LIKE) or input is None:
+                stdout, stderr = p.communicate(input)
+            else:
+                stdout, stderr = _communicate_chunks(p, input)
+        finally:
+            watchdog.stop()
+        watchdog.check(stderr)
+        return stdout, stderr
+    future = _supervise(p, input, timeout)
+    try:
+        with _on_cancel(conversion, future.cancel):
+            return future.result()
+    except subprocess.TimeoutExpired as e:
+        raise ConversionTimeoutError(conversion.timeout, e.stderr) from None
+    except BaseException:
+        # e.g. a KeyboardInterrupt: cancelling the future kills pandoc
+        future.cancel()
+        raise
+
+
+def _supervise(p, input, timeout=None) -> Future:
+    """Hand pandoc over to the supervisor thread.
+
+    An input in memory is written by the supervisor thread, streamed input
+    (see :func:`_encode_text_source`) by a thread of its own.
+
+    :returns: a future of stdout and stderr; cancelling it kills pandoc. It
+        fails with ``subprocess.TimeoutExpired`` if pandoc was killed after
+        `timeout` seconds.
+    """
+    return _supervisor_communicate(p, input, timeout)
+
+
+class _Watchdog:
+    """Kills pandoc once its conversion times out or is cancelled.
+
+    For where the supervisor thread doesn't look after pandoc: a timer thread
+    waits for the timeout.
+    """
+
+    def __init__(self, p, conversion: _Conversion, timeout):
+        self.timed_out = False
+        self.cancelled = False
+        self._p = p
+        self._conversion = conversion
+        self._timer = None
+        if timeout is not None:
+            self._timer = threading.Timer(timeout, self._time_out)
+            self._timer.daemon = True
+            self._timer.start()
+        if conversion.cancel is not None:
+            conversion.cancel._add_callback(self._cancel)
+
+    def _time_out(self) -> None:
+        self.timed_out = True
+        self._kill()
+
+    def _cancel(self) -> None:
+        self.cancelled = True
+        self._kill()
+
+    def _kill(self) -> None:
+        if self._p.returncode is None:
+            _kill_process(self._p)
+
+    def stop(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        if self._conversion.cancel is not None:
+            self._conversion.cancel._remove_callback(self._cancel)
+
+    def check(self, stderr) -> None:
+        """Raise if pandoc was killed because the conversion timed out or was
+        cancelled."""
+        if self.timed_out:
+            raise ConversionTimeoutError(self._conversion.timeout, stderr)
+        if self.cancelled:
+            raise CancelledError("The conversion was cancelled")
+
+
+def _communicate_chunks(p, chunks):
+    """Like ``p.communicate()``, but write an iterable of `chunks` to stdin."""
+    pipes = _PipeThreads(p, chunks)
+    stdout = None
+    try:
+        if p.stdout is not None:
+            stdout = p.stdout.read()
+        p.wait()
+    finally:
+        if p.returncode is None:
+            _kill_process(p)
+            p.wait()
+        pipes.join()
+        if p.stdout is not None:
+            p.stdout.close()
+        p.stderr.close()
+    if pipes.error is not None:
+        raise pipes.error
+    return stdout, pipes.stderr
+
+
+def _stream_conversion(conversion: _Conversion, chunk_size, return_bytes):
+    conversion = conversion.started()
+    conversion.check_limits()
+    if conversion.python_filters or _uses_ast_cache(conversion):
+        conversion = _prepare_writing(conversion)
+    timeout = conversion.check_limits()
+    logger.debug("Running pandoc...")
+    p = _spawn_pandoc(conversion, subprocess.PIPE)
+    pipes = _PipeThreads(p, conversion.piped_input)
+    watchdog = _Watchdog(p, conversion, timeout)
+
+    decoder = None
+    if not return_bytes and conversion.outputfile != "-":
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    try:
+        while True:
+            chunk = p.stdout.read1(chunk_size)
+            if not chunk:
+                break
+            if decoder is not None:
+                chunk = decoder.decode(chunk)
+                if not chunk:
+                    continue
+            yield chunk
+        if decoder is not None:
+            chunk = decoder.decode(b"", final=True)
+            if chunk:
+                yield chunk
+        p.wait()
+    finally:
+        # the consumer stopped early or something failed: don't leave pandoc
+        # behind
+        watchdog.stop()
+        if p.returncode is None:
+            _kill_process(p)
+            p.wait()
+        pipes.join()
+        p.stdout.close()
+        p.stderr.close()
+
+    watchdog.check(pipes.stderr)
+    if pipes.error is not None:
+        raise pipes.error
+    _check_conversion(conversion, p.returncode, pipes.stderr)
+
+
+async def _convert_input_async(
+    source: str,
+    format,
+    input_type,
+    to,
+    extra_args=(),
+    outputfile=None,
+    filters=None,
+    verify_format=True,
+    sandbox=False,
+    cworkdir=None,
+    sort_files=True,
+    return_bytes=False,
+    timeout=None,
+    cancel=None,
+):
+    conversion = _prepare_conversion(
+        source,
+        format,
+        input_type,
+        to,
+        extra_args=extra_args,
+        outputfile=outputfile,
+        filters=filters,
+        verify_format=verify_format,
+        sandbox=sandbox,
+        cworkdir=cworkdir,
+        sort_files=sort_files,
+        return_bytes=return_bytes,
+        timeout=timeout,
+        cancel=cancel,
+    )
+    return await _run_conversion_async(conversion)
+
+
+async def _run_conversion_async(conversion: _Conversion):
+    conversion = conversion.started()
+    conversion.check_limits()
+    if conversion.python_filters or _uses_ast_cache(conversion):
+        conversion = await _prepare_writing_async(conversion)
+    key = conversion.cache_key()
+    if key is None:
+        return await _run_pandoc_async(conversion)
+    while True:
+        output = _get_cached_result(key)
+        if output is not None:
+            return output
+        future, leader = _join_in_flight(key)
+        if leader:
+            break
+        try:
+            # shielded, so cancelling this task doesn't cancel the conversion
+            # others are waiting for
+            return await _limit_async(
+                asyncio.shield(asyncio.wrap_future(future)), conversion
+            )
+        except asyncio.CancelledError:
+            if not future.cancelled():
+                raise
+            continue
+
+    try:
+        output = await _run_pandoc_async(conversion)
+    except BaseException as e:
+        _leave_in_flight(key, future, exception=e)
+        raise
+    _leave_in_flight(key, future, output=output)
+    return output
+
+
+async def _run_pandoc_async(conversion: _Conversion):
+    if conversion.pdf_to_memory:
+        with _private_tempdir() as tempdir:
+            outputfile = os.path.join(tempdir, "output.pdf")
+            await _run_pandoc_async(conversion.with_output_to(outputfile))
+            with open(outputfile, "rb") as f:
+                return f.read()
+
+    loop = asyncio.get_running_loop()
+    for attempt in range(conversion.max_attempts):
+        conversion.check_limits()
+        logger.debug("Running pandoc...")
+        if __spawn_strategy == "forkserver":
+            # the spawn server is only talked to synchronously, pandoc's pipes
+            # are then looked after by the supervisor thread
+            p = await loop.run_in_executor(
+                None, _spawn_pandoc, conversion, subprocess.PIPE
+            )
+            stdout, stderr = await _limit_async(
+                asyncio.wrap_future(_supervise(p, conversion.piped_input)),
+                conversion,
+            )
+        else:
+            stdout, stderr, p = await _limit_async(
+                _communicate_async(conversion), conversion
+            )
+
+        # installing LaTeX packages blocks, so keep it off the event loop
+        retry = await loop.run_in_executor(
+            None, _retry_conversion, conversion, p.returncode, stderr, attempt
         )
+        if not retry:
+            break
 
-    # if there is output on stderr, process it and send to logger
-    if stderr:
-        for level, msg in _classify_pandoc_logging(stderr):
-            logger.log(level, msg)
+    return _finish_conversion(conversion, p.returncode, stdout, stderr)
 
-    # if there is an outputfile, then stdout is likely empty!
-    return stdout
+
+async def _communicate_async(conversion: _Conversion):
+    """Run pandoc for `conversion` as an asyncio subprocess.
+
+    :returns: pandoc's stdout, its stderr and the process
+    """
+    p = await asyncio.create_subprocess_exec(
+        *conversion.args,
+        stdin=conversion.get_stdin(),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        env=conversion.env,
+        cwd=conversion.cworkdir,
+        creationflags=_CREATION_FLAGS,
+        start_new_session=conversion.new_session,
+    )
+    try:
+        input = conversion.piped_input
+        if isinstance(input, _BYTES_LIKE) or input is None:
+            stdout, stderr = await p.communicate(input)
+        else:
+            stdout, stderr = await _communicate_chunks_async(p, input)
+    except BaseException:
+        # cancelled (or failed) while pandoc runs: don't leave it behind
+        if p.returncode is None:
+            _kill_process(p)
+            await asyncio.shield(p.wait())
+        raise
+    return stdout, stderr, p
+
+
+async def _limit_async(awaitable, conversion: _Conversion):
+    """Await `awaitable`, but cancel it once `conversion` times out or is
+    cancelled (through its :class:`CancellationToken`)."""
+    timeout = conversion.check_limits()
+    task = asyncio.ensure_future(awaitable)
+    loop = asyncio.get_running_loop()
+    cancelled = []
+
+    def cancel():
+        cancelled.append(True)
+        loop.call_soon_threadsafe(task.cancel)
+
+    with _on_cancel(conversion, cancel):
+        try:
+            return await asyncio.wait_for(task, timeout)
+        except ConversionTimeoutError:
+            # e.g. the identical conversion this one waited for timed out
+            raise
+        except asyncio.TimeoutError:
+            raise ConversionTimeoutError(conversion.timeout) from None
+        except asyncio.CancelledError:
+            if not cancelled:
+                raise
+            raise CancelledError("The conversion was cancelled") from None
+
+
+async def _communicate_chunks_async(p, chunks):
+    async def feed():
+        try:
+            for chunk in chunks:
+                p.stdin.write(chunk)
+                await p.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # pandoc exited before reading all of its input
+            pass
+        finally:
+            p.stdin.close()
+
+    stdout, stderr, _ = await asyncio.gather(p.stdout.read(), p.stderr.read(), feed())
+    await p.wait()
+    return stdout, stderr
 
 
 def _classify_pandoc_logging(raw, default_level="WARNING"):
@@ -653,13 +3151,38 @@ def get_pandoc_formats() -> Iterable:
     """
     Dynamic preprocessor for Pandoc formats.
     Return 2 lists. "from_formats" and "to_formats".
+
+    The formats are probed once per pandoc binary and cached, in memory and in
+    the persistent probe cache (see :mod:`pypandoc.probe_cache`). The cache is
+    keyed on the resolved path, inode, size and modification time of the binary,
+    so replacing pandoc invalidates it. Use :func:`get_pandoc_formats_cache_info()`
+    to inspect the in-memory cache and :func:`clean_pandocpath_cache()` to clear it.
     """
-    _ensure_pandoc_path()
+    global __formats_cache_hits, __formats_cache_misses
+
+    pandoc_path = _ensure_pandoc_path()
+    key = _get_binary_fingerprint(pandoc_path)
+    with __formats_cache_lock:
+        formats = __formats_cache.get(key)
+        if formats is None:
+            __formats_cache_misses += 1
+            formats = _get_binary_info(pandoc_path, "formats")
+            if formats is None:
+                formats = _get_pandoc_formats(pandoc_path)
+                _set_binary_info(pandoc_path, "formats", formats)
+            __formats_cache[key] = formats
+        else:
+            __formats_cache_hits += 1
+    # hand out copies, so callers can't modify the cached lists
+    return list(formats[0]), list(formats[1])
+
+
+def _get_pandoc_formats(pandoc_path: str) -> Iterable:
     creation_flag = (
         0x08000000 if sys.platform == "win32" else 0
     )  # set creation flag to not open pandoc in new console on windows
     p = subprocess.Popen(
-        [__pandoc_path, "--list-output-formats"],
+        [pandoc_path, "--list-output-formats"],
         stdin=subprocess.PIPE,
         stderr=subprocess.PIPE,
         stdout=subprocess.PIPE,
@@ -673,7 +3196,7 @@ def get_pandoc_formats() -> Iterable:
         return get_pandoc_formats_pre_1_18()
 
     p = subprocess.Popen(
-        [__pandoc_path, "--list-input-formats"],
+        [pandoc_path, "--list-input-formats"],
         stdin=subprocess.PIPE,
         stderr=subprocess.PIPE,
         stdout=subprocess.PIPE,
@@ -691,12 +3214,12 @@ def get_pandoc_formats_pre_1_18() -> Iterable:
     Dynamic preprocessor for Pandoc formats for version < 1.18.
     Return 2 lists. "from_formats" and "to_formats".
     """
-    _ensure_pandoc_path()
+    pandoc_path = _ensure_pandoc_path()
     creation_flag = (
         0x08000000 if sys.platform == "win32" else 0
     )  # set creation flag to not open pandoc in new console on windows
     p = subprocess.Popen(
-        [__pandoc_path, "-h"],
+        [pandoc_path, "-h"],
         stdin=subprocess.PIPE,
         stdout=subprocess.PIPE,
         creationflags=creation_flag,
@@ -757,6 +3280,9 @@ def get_pandoc_version() -> str:
     It will probe Pandoc for its version, cache it and return that value.
     If a cached version is found, it will return the cached version
     and stop probing Pandoc (unless :func:`clean_version_cache()` is called).
+    The version is also stored in the persistent probe cache
+    (see :mod:`pypandoc.probe_cache`), so new processes don't have to probe
+    the same binary again.
 
     :raises OSError:
         if pandoc is not found; make sure it has been installed
@@ -764,10 +3290,18 @@ def get_pandoc_version() -> str:
     """
     global __version
 
-    if __version is None:
-        _ensure_pandoc_path()
-        __version = _get_pandoc_version(__pandoc_path)
-    return __version
+    version = __version
+    if version is None:
+        with __version_lock:
+            if __version is None:
+                pandoc_path = _ensure_pandoc_path()
+                version = _get_binary_info(pandoc_path, "version")
+                if version is None:
+                    version = _get_pandoc_version(pandoc_path)
+                    _set_binary_info(pandoc_path, "version", version)
+                __version = version
+            version = __version
+    return version
 
 
 def get_pandoc_path() -> str:
@@ -787,8 +3321,7 @@ def get_pandoc_path() -> str:
 
     :raises OSError: if pandoc is not found
     """
-    _ensure_pandoc_path()
-    return __pandoc_path
+    return _ensure_pandoc_path()
 
 
 def ensure_pandoc_minimal_version(major: int, minor: int = 0) -> bool:
@@ -823,142 +3356,227 @@ def ensure_pandoc_maximal_version(major: int, minor: int = 9999) -> bool:
     return version[0] <= int(major) and version[1] <= int(minor)
 
 
-def _ensure_pandoc_path() -> None:
-    global __pandoc_path
+def _get_pandoc_search_paths() -> list:
+    """Return the candidate pandoc binaries, in order of preference."""
+    included_pandoc = os.path.join(
+        os.path.dirname(os.path.realpath(__file__)), "files", "pandoc"
+    )
+    search_paths = ["pandoc", included_pandoc]
+    pf = "linux" if sys.platform.startswith("linux") else sys.platform
+    try:
+        if pf == "win32":
+            search_paths.append(os.path.join(DEFAULT_TARGET_FOLDER[pf], "pandoc.exe"))
+        else:
+            search_paths.append(os.path.join(DEFAULT_TARGET_FOLDER[pf], "pandoc"))
+    except:  # noqa
+        # not one of the know platforms...
+        pass
+    if pf == "linux":
+        # Currently we install into ~/bin, but this is equally likely...
+        search_paths.append("~/.bin/pandoc")
+    # Also add the interpreter script path, as that's where pandoc could be
+    # installed if it's an environment and the environment wasn't activated
+    if pf == "win32":
+        search_paths.append(os.path.join(sys.exec_prefix, "Scripts", "pandoc.exe"))
+
+        # Since this only runs on Windows, use Windows slashes
+        if os.getenv("ProgramFiles", None):
+            search_paths.append(
+                os.path.expandvars("${ProgramFiles}\\Pandoc\\pandoc.exe")
+            )
+            search_paths.append(
+                os.path.expandvars("${ProgramFiles}\\Pandoc\\Pandoc.exe")
+            )
+        if os.getenv("ProgramFiles(x86)", None):
+            search_paths.append(
+                os.path.expandvars("${ProgramFiles(x86)}\\Pandoc\\pandoc.exe")
+            )
+            search_paths.append(
+                os.path.expandvars("${ProgramFiles(x86)}\\Pandoc\\Pandoc.exe")
+            )
 
-    _check_log_handler()
+    # bin can also be used on windows (conda at least has it in path), so
+    # include it unconditionally
+    search_paths.append(os.path.join(sys.exec_prefix, "bin", "pandoc.exe"))
+    search_paths.append(os.path.join(sys.exec_prefix, "bin", "pandoc"))
+    # If a user added the complete path to pandoc to an env, use that as the
+    # only way to get pandoc so that a user can overwrite even a higher
+    # version in some other places.
+    if os.getenv("PYPANDOC_PANDOC", None):
+        search_paths = [os.getenv("PYPANDOC_PANDOC")]
+    return search_paths
 
-    if __pandoc_path is None:
-        included_pandoc = os.path.join(
-            os.path.dirname(os.path.realpath(__file__)), "files", "pandoc"
-        )
-        search_paths = ["pandoc", included_pandoc]
-        pf = "linux" if sys.platform.startswith("linux") else sys.platform
+
+def _probe_pandoc_versions(search_paths: list) -> list:
+    """Return (path, version) for every usable pandoc in `search_paths`.
+
+    Candidates which don't exist or aren't executable are skipped without
+    starting a process; the remaining ones are probed concurrently. The result
+    keeps the order of `search_paths`.
+    """
+    candidates = []
+    seen = set()
+    for path in search_paths:
+        # Needed for windows and subprocess which can't expand it on it's
+        # own...
+        path = os.path.expanduser(path)
+        resolved = shutil.which(path)
+        if resolved is not None:
+            # the same binary found twice can't win the second time
+            resolved = os.path.realpath(resolved)
+            if resolved not in seen:
+                seen.add(resolved)
+                candidates.append(path)
+        elif os.path.exists(path):
+            logger.warning("Found %s, but not using it as it isn't executable", path)
+
+    def probe(path):
         try:
-            if pf == "win32":
-                search_paths.append(
-                    os.path.join(DEFAULT_TARGET_FOLDER[pf], "pandoc.exe")
-                )
-            else:
-                search_paths.append(os.path.join(DEFAULT_TARGET_FOLDER[pf], "pandoc"))
-        except:  # noqa
-            # not one of the know platforms...
-            pass
-        if pf == "linux":
-            # Currently we install into ~/bin, but this is equally likely...
-            search_paths.append("~/.bin/pandoc")
-        # Also add the interpreter script path, as that's where pandoc could be
-        # installed if it's an environment and the environment wasn't activated
-        if pf == "win32":
-            search_paths.append(os.path.join(sys.exec_prefix, "Scripts", "pandoc.exe"))
+            return _get_pandoc_version(path)
+        except Exception:
+            # we can't use that path...
+            logger.exception(
+                "Found {}, but not using it because of an error:".format(path)
+            )
+            return None
+
+    if len(candidates) > 1:
+        with ThreadPoolExecutor(max_workers=len(candidates)) as executor:
+            versions = list(executor.map(probe, candidates))
+    else:
+        versions = [probe(path) for path in candidates]
+    return [(p, v) for p, v in zip(candidates, versions) if v is not None]
 
-            # Since this only runs on Windows, use Windows slashes
-            if os.getenv("ProgramFiles", None):
-                search_paths.append(
-                    os.path.expandvars("${ProgramFiles}\\Pandoc\\pandoc.exe")
-                )
-                search_paths.append(
-                    os.path.expandvars("${ProgramFiles}\\Pandoc\\Pandoc.exe")
-                )
-            if os.getenv("ProgramFiles(x86)", None):
-                search_paths.append(
-                    os.path.expandvars("${ProgramFiles(x86)}\\Pandoc\\pandoc.exe")
-                )
-                search_paths.append(
-                    os.path.expandvars("${ProgramFiles(x86)}\\Pandoc\\Pandoc.exe")
-                )
 
-        # bin can also be used on windows (conda at least has it in path), so
-        # include it unconditionally
-        search_paths.append(os.path.join(sys.exec_prefix, "bin", "pandoc.exe"))
-        search_paths.append(os.path.join(sys.exec_prefix, "bin", "pandoc"))
-        # If a user added the complete path to pandoc to an env, use that as the
-        # only way to get pandoc so that a user can overwrite even a higher
-        # version in some other places.
-        if os.getenv("PYPANDOC_PANDOC", None):
-            search_paths = [os.getenv("PYPANDOC_PANDOC")]
+_PANDOC_NOT_FOUND_MSG = (
+    "No pandoc was found: either install pandoc and add it\n"
+    "to your PATH or or call pypandoc.download_pandoc(...) or\n"
+    "install pypandoc wheels with included pandoc."
+)
+
+
+def _ensure_pandoc_path() -> str:
+    """Find pandoc, if that wasn't done yet, and return its path.
+
+    The lookup is done by one thread at a time and other threads only ever see
+    the final path, never one of the candidates probed in between.
+    """
+    global __pandoc_path
+
+    _check_log_handler()
+
+    pandoc_path = __pandoc_path
+    if pandoc_path is not None:
+        return pandoc_path
+    with __pandoc_path_lock:
+        if __pandoc_path is None:
+            __pandoc_path = _find_pandoc_path()
+        return __pandoc_path
+
+
+def _find_pandoc_path() -> str:
+    global __pandoc_not_found
+
+    search_paths = _get_pandoc_search_paths()
+    candidates_key = _get_candidates_key(search_paths)
+    # If pandoc wasn't found a moment ago and neither the PATH nor any of
+    # the candidates changed since, fail fast instead of probing again.
+    failure_key = (os.environ.get("PATH", ""), candidates_key)
+    if __pandoc_not_found is not None:
+        key, expires = __pandoc_not_found
+        if key == failure_key and time.monotonic() < expires:
+            raise OSError(_PANDOC_NOT_FOUND_MSG)
+        __pandoc_not_found = None
+
+    # a persistent cache of earlier probes of exactly these binaries spares
+    # us starting all of them again
+    pandoc_path = _get_discovered_path(candidates_key)
+    if pandoc_path is None:
         curr_version = [0, 0, 0]
-        for path in search_paths:
-            # Needed for windows and subprocess which can't expand it on it's
-            # own...
-            path = os.path.expanduser(path)
-            version_string = "0.0.0"
-            # print("Trying: %s" % path)
-            try:
-                version_string = _get_pandoc_version(path)
-            except Exception:
-                # we can't use that path...
-                if os.path.exists(path):
-                    # path exist but is not usable -> not executable?
-                    log_msg = (
-                        "Found {}, but not using it because of an "
-                        "error:".format(path)
-                    )
-                    logger.exception(log_msg)
-                continue
+        for path, version_string in _probe_pandoc_versions(search_paths):
             version = [int(x) for x in version_string.split(".")]
             while len(version) < len(curr_version):
                 version.append(0)
-            # print("%s, %s" % (path, version))
             # Only use the new version if it is any bigger...
             if version > curr_version:
-                # print("Found: %s" % path)
-                __pandoc_path = path
+                pandoc_path = path
                 curr_version = version
+                curr_version_string = version_string
 
-        if __pandoc_path is None:
-            # Only print hints if requested
-            if os.path.exists("/usr/local/bin/brew"):
-                logger.info(
-                    textwrap.dedent(
-                        """\
-                    Maybe try:
-
-                        brew install pandoc
-                """
-                    )
-                )
-            elif os.path.exists("/usr/bin/apt-get"):
-                logger.info(
-                    textwrap.dedent(
-                        """\
-                    Maybe try:
-
-                        sudo apt-get install pandoc
-                """
-                    )
-                )
-            elif os.path.exists("/usr/bin/yum"):
-                logger.info(
-                    textwrap.dedent(
-                        """\
-                    Maybe try:
-
-                    sudo yum install pandoc
-                """
-                    )
+        if pandoc_path is not None:
+            _set_binary_info(pandoc_path, "version", curr_version_string)
+            _set_discovered_path(candidates_key, pandoc_path)
+
+    if pandoc_path is None:
+        # Only print hints if requested
+        if os.path.exists("/usr/local/bin/brew"):
+            logger.info(
+                textwrap.dedent(
+                    """\
+                Maybe try:
+
+                    brew install pandoc
+            """
                 )
+            )
+        elif os.path.exists("/usr/bin/apt-get"):
             logger.info(
                 textwrap.dedent(
                     """\
-                See http://johnmacfarlane.net/pandoc/installing.html
-                for installation options
+                Maybe try:
+
+                    sudo apt-get install pandoc
             """
                 )
             )
+        elif os.path.exists("/usr/bin/yum"):
             logger.info(
                 textwrap.dedent(
                     """\
-                ---------------------------------------------------------------
+                Maybe try:
 
+                sudo yum install pandoc
             """
                 )
             )
-            raise OSError(
-                "No pandoc was found: either install pandoc and add it\n"
-                "to your PATH or or call pypandoc.download_pandoc(...) or\n"
-                "install pypandoc wheels with included pandoc."
+        logger.info(
+            textwrap.dedent(
+                """\
+            See http://johnmacfarlane.net/pandoc/installing.html
+            for installation options
+        """
+            )
+        )
+        logger.info(
+            textwrap.dedent(
+                """\
+            ---------------------------------------------------------------
+
+        """
             )
+        )
+        ttl = _get_not_found_ttl()
+        if ttl > 0:
+            __pandoc_not_found = (failure_key, time.monotonic() + ttl)
+        raise OSError(_PANDOC_NOT_FOUND_MSG)
+    return pandoc_path
+
+
+def _get_not_found_ttl() -> float:
+    """Return the seconds a failed pandoc lookup is remembered."""
+    value = os.getenv("PYPANDOC_NOT_FOUND_TTL")
+    if value is None:
+        return _PANDOC_NOT_FOUND_TTL
+    try:
+        return float(value)
+    except ValueError:
+        logger.warning(
+            "Ignoring PYPANDOC_NOT_FOUND_TTL=%r, which isn't a number of "
+            "seconds; using %s",
+            value,
+            _PANDOC_NOT_FOUND_TTL,
+        )
+        return _PANDOC_NOT_FOUND_TTL
 
 
 def ensure_pandoc_installed(
@@ -1006,13 +3624,164 @@ def url2path(url):
 # -----------------------------------------------------------------------------
 def clean_version_cache():
     global __version
-    __version = None
+    with __version_lock:
+        __version = None
 
 
 def clean_pandocpath_cache():
-    global __pandoc_path
-    __pandoc_path = None
+    global __pandoc_path, __pandoc_not_found
+    global __formats_cache_hits, __formats_cache_misses
+    with __pandoc_path_lock:
+        __pandoc_path = None
+        __pandoc_not_found = None
+    with __formats_cache_lock:
+        __formats_cache.clear()
+        __formats_cache_hits = 0
+        __formats_cache_misses = 0
+
+
+def set_result_cache(cache: Union[ResultCache, DiskResultCache, None]) -> None:
+    """Cache the results of conversions in `cache`, or stop caching with None.
+
+    Conversions of in-memory sources which return their output (instead of
+    writing it to an outputfile or a sink) are cached. A cached result is
+    returned without starting pandoc, so pandoc's warnings aren't logged again.
+    See :mod:`pypandoc.result_cache` for what the results are keyed on.
+
+    :param cache: e.g. ``pypandoc.ResultCache(max_bytes=256 * 2**20)``, or
+        ``pypandoc.DiskResultCache("/var/cache/pypandoc")`` to share the
+        results with other processes
+    """
+    global __result_cache
+    __result_cache = cache
+
+
+def get_result_cache() -> Union[ResultCache, DiskResultCache, None]:
+    """Return the cache set by :func:`set_result_cache()`, if any."""
+    return __result_cache
+
+
+def set_filter_servers(enabled: bool) -> None:
+    """Run the Python filter scripts in `filters` with long-running servers.
+
+    When enabled, every ``.py`` filter script is run by a :class:`FilterServer`
+    of its own, started when the script is first used and stopped when this is
+    disabled again or the process exits. Servers can also be passed in
+    `filters` explicitly.
+
+    Only available on platforms with ``fork()`` and Unix sockets.
+    """
+    global __filter_servers
+    if enabled and (not hasattr(os, "fork") or not hasattr(socket, "AF_UNIX")):
+        raise RuntimeError("Filter servers need fork() and Unix sockets")
+    with __filter_servers_lock:
+        servers = __filter_servers
+        __filter_servers = {} if enabled else None
+    for server in (servers or {}).values():
+        server.close()
+
+
+def _close_filter_servers():
+    set_filter_servers(False)
+
+
+atexit.register(_close_filter_servers)
+
+
+def set_ast_cache(cache: Union[ResultCache, DiskResultCache, None]) -> None:
+    """Cache the JSON representation of sources in `cache`, or stop with None.
+
+    Converting an in-memory source to any format then reads it to pandoc's JSON
+    representation first, runs the filters and stores the result, compressed.
+    Later conversions of the same source with the same input format and
+    reading options, to the same or another format, only write the cached
+    document, which is much faster than reading large sources again.
+
+    :param cache: e.g. ``pypandoc.DiskResultCache("/var/cache/pypandoc-ast")``
+        or ``pypandoc.ResultCache()`` for a cache in memory
+    """
+    global __ast_cache
+    __ast_cache = cache
+
+
+def get_ast_cache() -> Union[ResultCache, DiskResultCache, None]:
+    """Return the cache set by :func:`set_ast_cache()`, if any."""
+    return __ast_cache
+
+
+def set_spawn_strategy(strategy: str) -> None:
+    """Set how pandoc is started for conversions.
+
+    - ``"subprocess"``: with :class:`subprocess.Popen` and its defaults (the
+      default)
+    - ``"posix_spawn"``: with :class:`subprocess.Popen`, but without closing
+      the other file descriptors, which allows it to use ``posix_spawn()``
+      where it's available (and there is no `cworkdir`)
+    - ``"forkserver"``: by a small helper process, which is started right
+      away. Call this early, while the process is small: starting pandoc
+      then takes the same time however much memory the process uses later.
+      Only available on platforms with Unix sockets.
+
+    On Linux, Python >= 3.10 already uses ``vfork()`` for ``"subprocess"``,
+    which doesn't depend on the size of the process either, unless something
+    prevents it.
+    """
+    global __spawn_strategy, __spawn_server
+    if strategy not in ("subprocess", "posix_spawn", "forkserver"):
+        raise ValueError("Unknown spawn strategy: %r" % strategy)
+    if strategy == "forkserver":
+        if not hasattr(socket, "AF_UNIX") or not hasattr(socket, "SCM_RIGHTS"):
+            raise RuntimeError("The forkserver spawn strategy needs Unix sockets")
+        if __spawn_server is None:
+            __spawn_server = _SpawnServer()
+        __spawn_server.start()
+    elif __spawn_server is not None:
+        __spawn_server.close()
+    __spawn_strategy = strategy
+
+
+def get_spawn_strategy() -> str:
+    """Return the strategy set by :func:`set_spawn_strategy()`."""
+    return __spawn_strategy
+
+
+def _close_spawn_server():
+    if __spawn_server is not None:
+        __spawn_server.close()
+
+
+atexit.register(_close_spawn_server)
+
+
+def get_pandoc_formats_cache_info() -> CacheInfo:
+    """Return the hit/miss statistics of the :func:`get_pandoc_formats()` cache.
+
+    :returns: a named tuple with the fields ``hits``, ``misses`` and ``currsize``
+        (the number of pandoc binaries with cached formats)
+    """
+    with __formats_cache_lock:
+        return CacheInfo(
+            __formats_cache_hits, __formats_cache_misses, len(__formats_cache)
+        )
 
 
 __version = None
+__version_lock = threading.Lock()
 __pandoc_path = None
+# held while looking for pandoc, so only one thread probes the candidates
+__pandoc_path_lock = threading.Lock()
+# (PATH and candidates key, expiry) of the last failed lookup of pandoc
+__pandoc_not_found = None
+__formats_cache = {}
+__formats_cache_hits = 0
+__formats_cache_misses = 0
+__formats_cache_lock = threading.Lock()
+__result_cache = None
+__ast_cache = None
+__filter_servers = None
+__filter_servers_lock = threading.Lock()
+__spawn_strategy = "subprocess"
+__spawn_server = None
+# the futures of the conversions which are running right now, by cache key
+__in_flight = {}
+__in_flight_lock = threading.Lock()
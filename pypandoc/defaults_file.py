@@ -0,0 +1,151 @@
+"""Writing pandoc command line options to a defaults file.
+
+pandoc (>= 2.11) reads options from a YAML ``--defaults`` file as well as from
+the command line. :func:`_to_defaults` moves the options it knows how to
+express there, so the command line stays short however many options a
+:class:`pypandoc.Converter` has. Options it doesn't know stay on the command
+line.
+"""
+
+import json
+import os
+import tempfile
+from typing import Tuple, Union
+
+# option: (key, kind), the kinds are "str", "int", "list" and "map"; -M stays
+# on the command line, where pandoc reads values like "false" as booleans and
+# not as the strings they'd be in a defaults file
+_OPTIONS = {
+    "--filter": ("filters", "list"),
+    "-F": ("filters", "list"),
+    "--lua-filter": ("filters", "list"),
+    "-L": ("filters", "list"),
+    "--variable": ("variables", "map"),
+    "-V": ("variables", "map"),
+    "--metadata-file": ("metadata-files", "list"),
+    "--css": ("css", "list"),
+    "-c": ("css", "list"),
+    "--include-in-header": ("include-in-header", "list"),
+    "-H": ("include-in-header", "list"),
+    "--include-before-body": ("include-before-body", "list"),
+    "-B": ("include-before-body", "list"),
+    "--include-after-body": ("include-after-body", "list"),
+    "-A": ("include-after-body", "list"),
+    "--bibliography": ("bibliography", "list"),
+    "--epub-embed-font": ("epub-fonts", "list"),
+    "--template": ("template", "str"),
+    "--reference-doc": ("reference-doc", "str"),
+    "--csl": ("csl", "str"),
+    "--pdf-engine": ("pdf-engine", "str"),
+    "--highlight-style": ("highlight-style", "str"),
+    "--wrap": ("wrap", "str"),
+    "--top-level-division": ("top-level-division", "str"),
+    "--reference-location": ("reference-location", "str"),
+    "--email-obfuscation": ("email-obfuscation", "str"),
+    "--id-prefix": ("identifier-prefix", "str"),
+    "--title-prefix": ("title-prefix", "str"),
+    "-T": ("title-prefix", "str"),
+    "--eol": ("eol", "str"),
+    "--data-dir": ("data-dir", "str"),
+    "--toc-depth": ("toc-depth", "int"),
+    "--columns": ("columns", "int"),
+    "--shift-heading-level-by": ("shift-heading-level-by", "int"),
+    "--slide-level": ("slide-level", "int"),
+    "--tab-stop": ("tab-stop", "int"),
+    "--dpi": ("dpi", "int"),
+}
+# flag: key, set to true
+_FLAGS = {
+    "--standalone": "standalone",
+    "-s": "standalone",
+    "--toc": "table-of-contents",
+    "--table-of-contents": "table-of-contents",
+    "--number-sections": "number-sections",
+    "-N": "number-sections",
+    "--sandbox": "sandbox",
+    "--embed-resources": "embed-resources",
+    "--self-contained": "self-contained",
+    "--section-divs": "section-divs",
+    "--incremental": "incremental",
+    "-i": "incremental",
+    "--listings": "listings",
+    "--reference-links": "reference-links",
+    "--ascii": "ascii",
+    "--html-q-tags": "html-q-tags",
+    "--strip-comments": "strip-comments",
+    "--preserve-tabs": "preserve-tabs",
+    "--file-scope": "file-scope",
+}
+
+
+def _split_key_value(value: str) -> Tuple[str, Union[str, bool]]:
+    """Split the KEY[=:]VALUE of -V or -M at the first = or :, like pandoc.
+
+    A key without a value is set to true.
+    """
+    separators = [i for i in (value.find("="), value.find(":")) if i >= 0]
+    if not separators:
+        return value, True
+    i = min(separators)
+    return value[:i], value[i + 1 :]
+
+
+def _to_defaults(args) -> Tuple[dict, list]:
+    """Split the pandoc options `args` into defaults and the remaining args.
+
+    ``--citeproc`` is added to the filters, so it keeps its place among them.
+    """
+    defaults = {}
+    remaining = []
+    args = [str(x) for x in args]
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        i += 1
+        if arg in _FLAGS:
+            defaults[_FLAGS[arg]] = True
+            continue
+        if arg in ("--citeproc", "-C"):
+            defaults.setdefault("filters", []).append("citeproc")
+            continue
+        if arg[:2] in _OPTIONS and not arg.startswith("--") and len(arg) > 2:
+            # the value follows a short option directly, e.g. -Vkey=value
+            name, value = arg[:2], arg[2:]
+        else:
+            name, has_value, value = arg.partition("=")
+            if name in _OPTIONS and not has_value:
+                if i == len(args):
+                    remaining.append(arg)
+                    continue
+                value = args[i]
+                i += 1
+        if name not in _OPTIONS:
+            remaining.append(arg)
+            continue
+
+        key, kind = _OPTIONS[name]
+        if kind == "list":
+            defaults.setdefault(key, []).append(value)
+        elif kind == "map":
+            item, item_value = _split_key_value(value)
+            defaults.setdefault(key, {})[item] = item_value
+        elif kind == "int":
+            try:
+                defaults[key] = int(value)
+            except ValueError:
+                # let pandoc complain about it
+                remaining += [name, value]
+        else:
+            defaults[key] = value
+    return defaults, remaining
+
+
+def _write_defaults_file(defaults: dict) -> str:
+    """Write `defaults` to a new temporary defaults file and return its path.
+
+    The file is written as JSON, which is valid YAML.
+    """
+    fd, path = tempfile.mkstemp(prefix="pypandoc-", suffix=".yaml")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(defaults, f, ensure_ascii=False)
+    return path
@@ -0,0 +1,267 @@
+"""Long-running servers for Python filters which run as separate programs.
+
+Pandoc starts a new Python interpreter for every ``--filter`` script and
+conversion, which then imports the filter's modules again. A
+:class:`FilterServer` runs one Python process per filter script instead, which
+imports the script's modules once, and gives pandoc a small Python script as
+the ``--filter``. The shim, started with ``python -I -S`` so it imports next
+to nothing, passes its arguments, environment, working directory, stdin and
+stdout on to the server over a Unix socket. The server forks a child for every
+conversion, which runs the unchanged filter script like ``python script.py``
+would, with its modules already imported.
+
+The server is this very file, run by the interpreter the filter is meant for;
+it mustn't import pypandoc, which that interpreter may not have installed.
+"""
+
+import ast
+import io
+import os
+import runpy
+import shutil
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import traceback
+from typing import Union
+
+# exit status and size of stderr, followed by stderr and stdout
+_RESPONSE_HEADER = struct.Struct("<iQ")
+# "--filter=<shim>": "--filter=<script>" of the running servers, so results
+# are cached by the script and not by the shim (see pypandoc.result_cache)
+_shim_args = {}
+
+# The shim sends the size of the request header, the header (NUL-terminated
+# strings: the working directory, the number of arguments, the arguments and
+# the environment) and stdin, and receive the response.
+_PYTHON_SHIM = """#!{python} -IS
+import os, socket, struct, sys
+
+s = socket.socket(socket.AF_UNIX)
+try:
+    s.connect({socket_path!r})
+except OSError as e:
+    sys.exit("pypandoc filter server for {script} isn't running: %s" % e)
+strings = [os.getcwd(), str(len(sys.argv) - 1)] + sys.argv[1:]
+strings += ["%s=%s" % item for item in os.environ.items()]
+header = b"".join(os.fsencode(x) + b"\\0" for x in strings)
+s.sendall(struct.pack("<Q", len(header)) + header)
+while True:
+    chunk = sys.stdin.buffer.read(65536)
+    if not chunk:
+        break
+    s.sendall(chunk)
+s.shutdown(socket.SHUT_WR)
+f = s.makefile("rb")
+try:
+    status, stderr_size = struct.unpack("<iQ", f.read(12))
+except struct.error:
+    sys.exit("pypandoc filter server for {script} failed")
+sys.stderr.buffer.write(f.read(stderr_size))
+sys.stderr.flush()
+chunk = f.read(65536)
+while chunk:
+    sys.stdout.buffer.write(chunk)
+    chunk = f.read(65536)
+sys.stdout.flush()
+sys.exit(status)
+"""
+
+
+class FilterServer:
+    """A long-running server for the Python filter script `script`.
+
+    Pass it in the `filters` of a conversion instead of the script's path. The
+    server is started when it's first used and restarted if it died; use it
+    as a context manager or call :meth:`close` to stop it.
+
+    Only available on platforms with ``fork()`` and Unix sockets.
+
+    :param str script: the path of the filter script
+
+    :param str python: the Python interpreter to run the server and the shim
+        with (Default value = the current interpreter)
+    """
+
+    def __init__(self, script: str, python: Union[str, None] = None):
+        if not hasattr(os, "fork") or not hasattr(socket, "AF_UNIX"):
+            raise RuntimeError("Filter servers need fork() and Unix sockets")
+        self.script = os.path.abspath(script)
+        self.python = python or sys.executable
+        self._process = None
+        self._directory = None
+        self._shim = None
+        self._lock = threading.Lock()
+
+    @property
+    def shim(self) -> str:
+        """The path of the shim to pass to pandoc as ``--filter``.
+
+        Starts the server if it isn't running.
+        """
+        with self._lock:
+            if self._process is None or self._process.poll() is not None:
+                self._start()
+            return self._shim
+
+    def _start(self) -> None:
+        self._stop()
+        self._directory = tempfile.mkdtemp(prefix="pypandoc-filter-")
+        socket_path = os.path.join(self._directory, "socket")
+        shim = self._shim = _write_shim(
+            self._directory, socket_path, self.script, self.python
+        )
+        _shim_args["--filter=" + shim] = "--filter=" + self.script
+        self._process = subprocess.Popen(
+            [self.python, os.path.abspath(__file__), self.script, socket_path],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+        )
+        # the server writes a line once it listens on the socket
+        if not self._process.stdout.readline():
+            self._process.wait()
+            raise RuntimeError(
+                "The filter server for %s exited with %s"
+                % (self.script, self._process.returncode)
+            )
+
+    def close(self) -> None:
+        """Stop the server."""
+        with self._lock:
+            self._stop()
+
+    def _stop(self) -> None:
+        if self._process is not None:
+            self._process.terminate()
+            self._process.wait()
+            self._process.stdout.close()
+            self._process = None
+        if self._directory is not None:
+            _shim_args.pop("--filter=" + self._shim, None)
+            shutil.rmtree(self._directory, ignore_errors=True)
+            self._directory = None
+
+    def __enter__(self) -> "FilterServer":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __del__(self):
+        if self._process is not None and self._process.poll() is None:
+            self._process.kill()
+
+    def __repr__(self) -> str:
+        return "FilterServer(%r)" % self.script
+
+
+def _write_shim(directory: str, socket_path: str, script: str, python: str) -> str:
+    """Write the shim for the server listening on `socket_path` to `directory`.
+
+    :returns: the path of the shim
+    """
+    shim = os.path.join(directory, "shim.py")
+    with open(shim, "w") as f:
+        f.write(
+            _PYTHON_SHIM.format(python=python, socket_path=socket_path, script=script)
+        )
+    os.chmod(shim, 0o700)
+    return shim
+
+
+def _preload(script: str) -> None:
+    """Import the modules imported at the top level of `script`, so the
+    children forked for the conversions don't have to."""
+    try:
+        with open(script, "rb") as f:
+            tree = ast.parse(f.read(), script)
+    except (OSError, SyntaxError, ValueError):
+        return
+    for node in tree.body:
+        if not isinstance(node, (ast.Import, ast.ImportFrom)):
+            continue
+        module = ast.Module(body=[node], type_ignores=[])
+        try:
+            exec(compile(module, script, "exec"), {"__name__": "__preload__"})
+        except Exception:
+            # the script will report it when it runs
+            pass
+
+
+class _Output(io.BytesIO):
+    # filters may wrap sys.stdout.buffer in a TextIOWrapper of their own, which
+    # closes it when it's garbage collected
+    def close(self):
+        pass
+
+
+def _run_filter(conn: socket.socket, script: str) -> None:
+    """Run `script` for the request on `conn`, in a forked child."""
+    f = conn.makefile("rb")
+    (size,) = struct.unpack("<Q", f.read(8))
+    strings = [os.fsdecode(x) for x in f.read(size).split(b"\0")[:-1]]
+    cwd, argc = strings[0], int(strings[1])
+    os.chdir(cwd)
+    os.environ.clear()
+    for item in strings[2 + argc :]:
+        name, _, value = item.partition("=")
+        os.environ[name] = value
+    sys.argv = [script] + strings[2 : 2 + argc]
+    sys.stdin = io.TextIOWrapper(f, encoding="utf-8")
+    stdout = _Output()
+    stderr = _Output()
+    sys.stdout = io.TextIOWrapper(stdout, encoding="utf-8", write_through=True)
+    sys.stderr = io.TextIOWrapper(stderr, encoding="utf-8", write_through=True)
+
+    status = 0
+    try:
+        runpy.run_path(script, run_name="__main__")
+    except SystemExit as e:
+        if isinstance(e.code, int):
+            status = e.code
+        elif e.code is not None:
+            print(e.code, file=sys.stderr)
+            status = 1
+    except BaseException:
+        traceback.print_exc()
+        status = 1
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    conn.sendall(_RESPONSE_HEADER.pack(status, len(stderr.getvalue())))
+    conn.sendall(stderr.getvalue())
+    conn.sendall(stdout.getvalue())
+
+
+def _serve(script: str, socket_path: str) -> None:
+    # like `python script.py`, instead of the directory of this module
+    sys.path[0] = os.path.dirname(script)
+    _preload(script)
+    server = socket.socket(socket.AF_UNIX)
+    server.bind(socket_path)
+    server.listen(64)
+    # the children are reaped automatically
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    print("ready", flush=True)
+    # nobody reads stdout anymore, filters writing to it mustn't block
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    os.close(devnull)
+    while True:
+        conn, _ = server.accept()
+        if os.fork() == 0:
+            server.close()
+            try:
+                _run_filter(conn, script)
+            finally:
+                os._exit(0)
+        conn.close()
+
+
+if __name__ == "__main__":
+    _serve(sys.argv[1], sys.argv[2])
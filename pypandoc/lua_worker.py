@@ -0,0 +1,392 @@
+"""Conversions in a pool of long-lived ``pandoc lua`` worker processes.
+
+Every worker runs ``worker.lua``, which reads framed conversion requests from
+stdin, converts them with ``pandoc.read``/``pandoc.write`` (applying Lua
+filters in between) and writes framed responses to stdout. This saves starting
+pandoc and initialising its runtime for every conversion. Only the options
+which can be expressed as pandoc reader and writer options can be used;
+:func:`pypandoc.convert_text` falls back to starting pandoc when a conversion
+needs anything else.
+"""
+
+import atexit
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from typing import Iterable, Union
+
+from .defaults_file import _split_key_value
+from .handler import logger
+
+_WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.realpath(__file__)), "worker.lua")
+
+# pandoc command line option -> (request section, option, kind of value)
+_WORKER_OPTIONS = {
+    "--standalone": (None, "standalone", "flag"),
+    "-s": (None, "standalone", "flag"),
+    "--wrap": ("writer_options", "wrap_text", "wrap"),
+    "--columns": ("writer_options", "columns", "int"),
+    "--toc": ("writer_options", "table_of_contents", "flag"),
+    "--table-of-contents": ("writer_options", "table_of_contents", "flag"),
+    "--toc-depth": ("writer_options", "toc_depth", "int"),
+    "--number-sections": ("writer_options", "number_sections", "flag"),
+    "-N": ("writer_options", "number_sections", "flag"),
+    "--section-divs": ("writer_options", "section_divs", "flag"),
+    "--reference-links": ("writer_options", "reference_links", "flag"),
+    "--tab-stop": ("reader_options", "tab_stop", "int"),
+    "--variable": ("writer_options", "variables", "keyvalue"),
+    "-V": ("writer_options", "variables", "keyvalue"),
+    "--metadata": (None, "metadata", "keyvalue"),
+    "-M": (None, "metadata", "keyvalue"),
+}
+
+
+def _worker_request(
+    to, format, extra_args, filters, sandbox=False
+) -> Union[dict, None]:
+    """Build the request for a conversion.
+
+    :returns: the request or None if the conversion can't be done by a worker
+    """
+    from . import _get_base_format
+
+    request = {"from": format, "to": to, "to_base": _get_base_format(to)}
+    if sandbox:
+        request["sandbox"] = True
+    request["filters"] = []
+    for f in filters or ():
+        if not str(f).endswith(".lua"):
+            return None
+        request["filters"].append(os.path.abspath(f))
+
+    args = [str(x) for x in extra_args]
+    while args:
+        name, has_value, value = args.pop(0).partition("=")
+        if name not in _WORKER_OPTIONS:
+            return None
+        section, key, kind = _WORKER_OPTIONS[name]
+        options = request if section is None else request.setdefault(section, {})
+        if kind == "flag":
+            if has_value:
+                return None
+            options[key] = True
+            continue
+        if not has_value:
+            if not args:
+                return None
+            value = args.pop(0)
+        if kind == "int":
+            try:
+                options[key] = int(value)
+            except ValueError:
+                return None
+        elif kind == "wrap":
+            if value not in ("auto", "none", "preserve"):
+                return None
+            options[key] = "wrap-" + value
+        else:
+            item, item_value = _split_key_value(value)
+            options.setdefault(key, {})[item] = item_value
+    return request
+
+
+class _LuaWorker:
+    """A single ``pandoc lua`` worker process."""
+
+    def __init__(self, pandoc_path: str):
+        self.jobs = 0
+        self._stderr = tempfile.TemporaryFile()
+        self._process = subprocess.Popen(
+            [pandoc_path, "lua", _WORKER_SCRIPT],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=self._stderr,
+            creationflags=0x08000000 if sys.platform == "win32" else 0,
+        )
+        status, body = self._receive()
+        if status != "ready":
+            raise RuntimeError("pandoc lua worker didn't start: %s" % body)
+        self.capabilities = json.loads(body.decode("utf-8"))
+
+    @property
+    def alive(self) -> bool:
+        return self._process.poll() is None
+
+    def _receive(self):
+        header = self._process.stdout.readline()
+        if not header:
+            self._process.wait()
+            self._stderr.seek(0)
+            raise RuntimeError(
+                'pandoc lua worker died with exitcode "{}": {}'.format(
+                    self._process.returncode,
+                    self._stderr.read().decode("utf-8", errors="replace"),
+                )
+            )
+        status, length = header.decode("ascii").split()
+        return status, self._process.stdout.read(int(length))
+
+    def convert(self, request: dict, text: bytes) -> bytes:
+        self.jobs += 1
+        options = json.dumps(request).encode("utf-8")
+        try:
+            self._process.stdin.write(b"%d %d\n" % (len(options), len(text)))
+            self._process.stdin.write(options)
+            self._process.stdin.write(text)
+            self._process.stdin.flush()
+        except OSError:
+            # the worker is gone, _receive() reports why
+            pass
+        status, body = self._receive()
+        if status != "ok":
+            raise RuntimeError(
+                "Pandoc died during conversion: %s"
+                % body.decode("utf-8", errors="replace")
+            )
+        return body
+
+    def close(self) -> None:
+        if self.alive:
+            self._process.stdin.close()
+            try:
+                self._process.wait(5)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+                self._process.wait()
+        self._process.stdout.close()
+        self._stderr.close()
+
+
+class LuaWorkerPool:
+    """A pool of long-lived ``pandoc lua`` workers.
+
+    Workers are started on demand, up to `size` of them. A worker which dies is
+    replaced, and every worker is replaced after `max_jobs` conversions to keep
+    its memory use in check. The pool can be used from several threads::
+
+        with pypandoc.LuaWorkerPool() as pool:
+            html = pool.convert_text("# some title", "html", format="md")
+
+    :param int size: the maximal number of workers
+        (Default value = the number of CPUs)
+
+    :param int max_jobs: conversions after which a worker is replaced
+        (Default value = 1000)
+
+    :param str pandoc_path: the pandoc binary to run (Default value = the one
+        returned by :func:`pypandoc.get_pandoc_path()`)
+    """
+
+    def __init__(
+        self,
+        size: Union[int, None] = None,
+        max_jobs: int = 1000,
+        pandoc_path: Union[str, None] = None,
+    ):
+        self.size = size or os.cpu_count() or 1
+        self.max_jobs = max_jobs
+        self.pandoc_path = pandoc_path
+        self._idle = []
+        self._started = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _acquire(self) -> _LuaWorker:
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise RuntimeError("The pandoc lua worker pool is closed")
+                if self._idle:
+                    return self._idle.pop()
+                if self._started < self.size:
+                    self._started += 1
+                    break
+                self._condition.wait()
+            if self.pandoc_path is None:
+                from . import get_pandoc_path
+
+                self.pandoc_path = get_pandoc_path()
+        try:
+            return _LuaWorker(self.pandoc_path)
+        except BaseException:
+            self._discard(None)
+            raise
+
+    def _release(self, worker: _LuaWorker) -> None:
+        if worker.alive and worker.jobs < self.max_jobs:
+            with self._condition:
+                if not self._closed:
+                    self._idle.append(worker)
+                    self._condition.notify()
+                    return
+        # dead, worn out or the pool is closed: the next conversion which
+        # needs a worker starts a fresh one
+        self._discard(worker)
+
+    def _discard(self, worker: Union[_LuaWorker, None]) -> None:
+        if worker is not None:
+            worker.close()
+        with self._condition:
+            self._started -= 1
+            self._condition.notify()
+
+    def capabilities(self) -> dict:
+        """Return what the workers support, e.g. ``{"lua_filters": True}``."""
+        worker = self._acquire()
+        try:
+            return dict(worker.capabilities)
+        finally:
+            self._release(worker)
+
+    def convert_text(
+        self,
+        source: Union[str, bytes],
+        to: str,
+        format: str,
+        extra_args: Iterable = (),
+        filters: Union[Iterable, None] = None,
+        encoding: str = "utf-8",
+        sandbox: bool = False,
+    ) -> str:
+        """Convert `source` from `format` to `to` in one of the workers.
+
+        The arguments have the same meaning as for :func:`pypandoc.convert_text`,
+        but only Lua filters are supported.
+
+        :raises RuntimeError: if the options can't be used with a worker or
+            the conversion fails
+        """
+        from . import normalize_format
+
+        format, to = normalize_format(format), normalize_format(to)
+        request = _worker_request(to, format, extra_args, filters, sandbox)
+        if request is None:
+            raise RuntimeError(
+                "pandoc lua workers don't support the arguments %s and filters %s"
+                % (list(extra_args), filters)
+            )
+        if sandbox and not self.capabilities().get("sandbox"):
+            raise RuntimeError("pandoc lua workers of this pandoc can't sandbox")
+        if isinstance(source, str):
+            source = source.encode("utf-8")
+        elif encoding.lower().replace("_", "-") not in ("utf-8", "utf8"):
+            source = source.decode(encoding, errors="replace").encode("utf-8")
+
+        worker = self._acquire()
+        try:
+            output = worker.convert(request, source)
+        finally:
+            self._release(worker)
+        return output.decode("utf-8", errors="replace")
+
+    def close(self) -> None:
+        """Stop all idle workers; busy ones are stopped when they are done."""
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._condition.notify_all()
+        for worker in idle:
+            self._discard(worker)
+
+
+def _convert_text(
+    backend,
+    source,
+    to,
+    format,
+    extra_args,
+    encoding,
+    outputfile,
+    filters,
+    cworkdir,
+    sandbox=False,
+):
+    """Convert `source` using pandoc lua workers, if the conversion allows it.
+
+    :param backend: "lua" for the shared pool or a :class:`LuaWorkerPool`
+
+    :returns: the converted document or None if the conversion has to be done
+        by starting pandoc
+    """
+    from . import _BINARY_INPUT_FORMATS, _get_base_format
+
+    if outputfile or cworkdir or _get_base_format(to) == "pdf":
+        return None
+    if _get_base_format(format) in _BINARY_INPUT_FORMATS:
+        return None
+    if _worker_request(to, format, extra_args, filters) is None:
+        logger.debug(
+            "pandoc lua workers don't support %s and %s", list(extra_args), filters
+        )
+        return None
+    pool = _get_shared_pool() if backend == "lua" else backend
+    if pool is None:
+        return None
+    capabilities = pool.capabilities()
+    if filters and not capabilities.get("lua_filters"):
+        return None
+    if sandbox and not capabilities.get("sandbox"):
+        # never read local files the sandbox would keep pandoc from reading
+        return None
+    return pool.convert_text(source, to, format, extra_args, filters, encoding, sandbox)
+
+
+# -----------------------------------------------------------------------------
+# Shared pool used by convert_text(..., backend="lua")
+# -----------------------------------------------------------------------------
+def _get_shared_pool() -> Union[LuaWorkerPool, None]:
+    """Return the shared pool or None if pandoc can't run the workers."""
+    global __shared_pool
+
+    from . import ensure_pandoc_minimal_version, get_pandoc_path
+
+    pandoc_path = get_pandoc_path()
+    with __shared_pool_lock:
+        if pandoc_path in __unsupported_pandoc_paths:
+            return None
+        if __shared_pool is None or __shared_pool.pandoc_path != pandoc_path:
+            if __shared_pool is not None:
+                __shared_pool.close()
+            __shared_pool = LuaWorkerPool(pandoc_path=pandoc_path)
+            try:
+                # the worker needs `pandoc lua` and pandoc.json (pandoc 3.1.1)
+                if not ensure_pandoc_minimal_version(3, 2):
+                    raise RuntimeError("pandoc lua workers need pandoc >= 3.2")
+                __shared_pool.capabilities()
+            except (OSError, RuntimeError) as e:
+                logger.warning(
+                    "Can't use pandoc lua workers, falling back to running pandoc "
+                    "for each conversion: %s",
+                    e,
+                )
+                __shared_pool.close()
+                __shared_pool = None
+                __unsupported_pandoc_paths.add(pandoc_path)
+                return None
+        return __shared_pool
+
+
+def _close_shared_pool() -> None:
+    global __shared_pool
+
+    with __shared_pool_lock:
+        if __shared_pool is not None:
+            __shared_pool.close()
+            __shared_pool = None
+        __unsupported_pandoc_paths.clear()
+
+
+atexit.register(_close_shared_pool)
+
+__shared_pool = None
+__shared_pool_lock = threading.Lock()
+__unsupported_pandoc_paths = set()
@@ -0,0 +1,190 @@
+"""Persistent on-disk cache for the results of probing pandoc binaries.
+
+Finding pandoc and asking it for its version and formats means starting
+several pandoc processes. The results only change when the binaries change,
+so they are stored in ``$XDG_CACHE_HOME/pypandoc`` (``%LOCALAPPDATA%\\pypandoc``
+on Windows) and shared by all processes of the user. Entries are keyed on the
+inode, size and modification time of the binaries, so installing, upgrading or
+removing pandoc invalidates them.
+
+Set ``PYPANDOC_CACHE_DIR`` to use another directory or ``PYPANDOC_PROBE_CACHE=0``
+to disable the cache.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+from typing import Iterable, Union
+
+from .handler import logger
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+_CACHE_FORMAT_VERSION = 1
+_CACHE_FILE_NAME = "probe.json"
+# entries per section, the oldest ones are dropped first
+_MAX_ENTRIES = 32
+
+
+def _get_cache_dir() -> str:
+    if os.getenv("PYPANDOC_CACHE_DIR"):
+        return os.path.expanduser(os.getenv("PYPANDOC_CACHE_DIR"))
+    if sys.platform == "win32":
+        base = os.getenv("LOCALAPPDATA") or tempfile.gettempdir()
+    else:
+        base = os.getenv("XDG_CACHE_HOME") or os.path.join(
+            os.path.expanduser("~"), ".cache"
+        )
+    return os.path.join(base, "pypandoc")
+
+
+def _is_enabled() -> bool:
+    return os.getenv("PYPANDOC_PROBE_CACHE", "1") not in ("0", "false", "no")
+
+
+def _get_binary_fingerprint(pandoc_path: str) -> tuple:
+    """Return a key identifying the pandoc binary at `pandoc_path`.
+
+    The key is the resolved path together with the inode, size and modification
+    time of the file, so upgrading or replacing pandoc in place changes the key.
+    """
+    resolved = os.path.realpath(shutil.which(pandoc_path) or pandoc_path)
+    try:
+        stat = os.stat(resolved)
+    except OSError:
+        return resolved, None, None, None
+    return resolved, stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def _get_candidates_key(search_paths: Iterable[str]) -> str:
+    """Return a key for a list of candidate pandoc paths.
+
+    The key changes whenever any candidate appears, disappears or changes,
+    including a different `pandoc` being found on the PATH.
+    """
+    fingerprints = [
+        [path] + list(_get_binary_fingerprint(os.path.expanduser(path)))
+        for path in search_paths
+    ]
+    return _hash(fingerprints)
+
+
+def _hash(obj) -> str:
+    return hashlib.sha256(json.dumps(obj).encode("utf-8")).hexdigest()
+
+
+def _load() -> dict:
+    try:
+        with open(os.path.join(_get_cache_dir(), _CACHE_FILE_NAME)) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(data, dict) or data.get("version") != _CACHE_FORMAT_VERSION:
+        return {}
+    return data
+
+
+def _update(section: str, key: str, values: dict) -> None:
+    """Set `values` in the entry `key` of `section` in the cache file.
+
+    Processes update the file one at a time, holding a lock on a ``.lock``
+    file next to it, so none of them loses the entries written by another.
+    """
+    cache_dir = _get_cache_dir()
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        lock = open(os.path.join(cache_dir, _CACHE_FILE_NAME + ".lock"), "a+b")
+    except OSError as e:
+        logger.debug("Couldn't write the pandoc probe cache: %s", e)
+        return
+    with lock:
+        if not _lock_file(lock, blocking=True):
+            logger.debug("Couldn't lock the pandoc probe cache")
+            return
+        try:
+            _write(section, key, values, cache_dir)
+        finally:
+            _unlock_file(lock)
+
+
+def _write(section: str, key: str, values: dict, cache_dir: str) -> None:
+    data = _load()
+    data["version"] = _CACHE_FORMAT_VERSION
+    entries = data.setdefault(section, {})
+    entry = entries.pop(key, {})
+    entry.update(values)
+    entries[key] = entry
+    while len(entries) > _MAX_ENTRIES:
+        del entries[next(iter(entries))]
+
+    tmp_name = None
+    try:
+        # write to a temporary file and rename it, so concurrent readers
+        # never see a partially written cache
+        fd, tmp_name = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_name, os.path.join(cache_dir, _CACHE_FILE_NAME))
+    except OSError as e:
+        logger.debug("Couldn't write the pandoc probe cache: %s", e)
+        if tmp_name is not None and os.path.exists(tmp_name):
+            os.remove(tmp_name)
+
+
+def _get_discovered_path(candidates_key: str) -> Union[str, None]:
+    """Return the pandoc path chosen earlier for the same candidates, if any.
+
+    :param str candidates_key: the key of the candidates as returned by
+        :func:`_get_candidates_key()`
+    """
+    if not _is_enabled():
+        return None
+    return _load().get("discovery", {}).get(candidates_key, {}).get("path")
+
+
+def _set_discovered_path(candidates_key: str, pandoc_path: str) -> None:
+    if _is_enabled():
+        _update("discovery", candidates_key, {"path": pandoc_path})
+
+
+def _get_binary_info(pandoc_path: str, name: str):
+    """Return the cached `name` ("version" or "formats") of a pandoc binary."""
+    if not _is_enabled():
+        return None
+    key = _hash(_get_binary_fingerprint(pandoc_path))
+    return _load().get("binaries", {}).get(key, {}).get(name)
+
+
+def _set_binary_info(pandoc_path: str, name: str, value) -> None:
+    if _is_enabled():
+        key = _hash(_get_binary_fingerprint(pandoc_path))
+        _update("binaries", key, {name: value})
+
+
+def _lock_file(f, blocking: bool) -> bool:
+    try:
+        if fcntl is not None:
+            flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+            fcntl.flock(f.fileno(), flags)
+        else:
+            f.seek(0)
+            mode = msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK
+            msvcrt.locking(f.fileno(), mode, 1)
+    except OSError:
+        return False
+    return True
+
+
+def _unlock_file(f) -> None:
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
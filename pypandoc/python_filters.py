@@ -0,0 +1,55 @@
+"""Running Python filters in the process of pypandoc.
+
+Python callables in the `filters` of a conversion are applied to pandoc's JSON
+representation of the document here, instead of starting a Python interpreter
+for every filter like ``--filter`` does. They follow the conventions of
+`pandocfilters <https://github.com/jgm/pandocfilters>`_: a filter is called as
+``action(key, value, format, meta)`` for every element of the document and
+returns None to keep the element, a replacement element, or a list of elements
+to replace it with (an empty list deletes it).
+"""
+
+import json
+from typing import Callable, Iterable
+
+
+def _apply_filters(document: bytes, actions: Iterable[Callable], format: str) -> bytes:
+    """Apply the Python filters `actions` to the JSON `document` one after the other.
+
+    The document is only parsed and serialised once for all of them.
+
+    :param str format: the output format, passed on to the filters
+    """
+    doc = json.loads(document)
+    if "meta" in doc:
+        meta = doc["meta"]
+    elif doc[0]:  # old API
+        meta = doc[0]["unMeta"]
+    else:
+        meta = {}
+    for action in actions:
+        doc = _walk(doc, action, format, meta)
+    return json.dumps(doc).encode("utf-8")
+
+
+def _walk(x, action, format, meta):
+    """Walk the tree `x` and apply `action` to every element, like
+    ``pandocfilters.walk()`` does."""
+    if isinstance(x, list):
+        array = []
+        for item in x:
+            if isinstance(item, dict) and "t" in item:
+                res = action(item["t"], item.get("c"), format, meta)
+                if res is None:
+                    array.append(_walk(item, action, format, meta))
+                elif isinstance(res, list):
+                    for z in res:
+                        array.append(_walk(z, action, format, meta))
+                else:
+                    array.append(_walk(res, action, format, meta))
+            else:
+                array.append(_walk(item, action, format, meta))
+        return array
+    if isinstance(x, dict):
+        return {k: _walk(v, action, format, meta) for k, v in x.items()}
+    return x
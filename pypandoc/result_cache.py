@@ -0,0 +1,477 @@
+"""Caches of conversion results.
+
+With a :class:`ResultCache` (in memory) or a :class:`DiskResultCache` (shared
+by all processes using the same directory) installed by
+:func:`pypandoc.set_result_cache()`, conversions are looked up by a hash of
+everything which determines their output: the source, the pandoc version, the
+formats and all other arguments, the working directory and the contents of
+the files named in the arguments (filters, templates, reference documents,
+...). A hit returns the earlier result without starting pandoc.
+
+Only conversions of in-memory sources which return their output are cached,
+not those writing to an outputfile or a sink or reading streamed input.
+"""
+
+import contextlib
+import functools
+import hashlib
+import json
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from typing import Union
+
+from .filter_server import _shim_args
+from .handler import logger
+from .probe_cache import _get_cache_dir, _lock_file, _unlock_file
+
+ResultCacheInfo = namedtuple(
+    "ResultCacheInfo", ["hits", "misses", "evictions", "currsize", "currbytes"]
+)
+
+# options whose value names a file that pandoc reads
+_FILE_OPTIONS = {
+    "--filter",
+    "-F",
+    "--lua-filter",
+    "-L",
+    "--template",
+    "--reference-doc",
+    "--defaults",
+    "-d",
+    "--metadata-file",
+    "--include-in-header",
+    "-H",
+    "--include-before-body",
+    "-B",
+    "--include-after-body",
+    "-A",
+    "--bibliography",
+    "--csl",
+    "--citation-abbreviations",
+    "--abbreviations",
+    "--syntax-definition",
+    "--highlight-style",
+    "--epub-cover-image",
+    "--epub-metadata",
+    "--epub-embed-font",
+}
+# short options which take a value, which may follow them directly as in
+# -Hheader.html, and those which take none; -s, -N, -p and -i take the rest
+# of their argument as an optional value
+_SHORT_OPTIONS_WITH_VALUE = set("frtwoMdVHBAFLTcD")
+_SHORT_FLAGS = set("Cvh")
+
+
+class ResultCache:
+    """A thread-safe, size-bounded LRU cache of conversion results.
+
+    :param int maxsize: the maximal number of results (Default value = 256)
+
+    :param int max_bytes: the maximal total size of the results; results
+        bigger than this are never cached (Default value = 64 MiB)
+    """
+
+    def __init__(self, maxsize: int = 256, max_bytes: int = 64 * 2**20):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self._results = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        """Return the result stored for `key` or None."""
+        with self._lock:
+            result = self._results.get(key)
+            if result is None:
+                self._misses += 1
+                return None
+            self._results.move_to_end(key)
+            self._hits += 1
+            return result
+
+    def put(self, key: str, result: Union[str, bytes]) -> None:
+        size = sys.getsizeof(result)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._results.pop(key, None)
+            if previous is not None:
+                self._bytes -= sys.getsizeof(previous)
+            self._results[key] = result
+            self._bytes += size
+            while len(self._results) > self.maxsize or self._bytes > self.max_bytes:
+                _, evicted = self._results.popitem(last=False)
+                self._bytes -= sys.getsizeof(evicted)
+                self._evictions += 1
+
+    def clear(self) -> None:
+        """Remove all results and reset the statistics."""
+        with self._lock:
+            self._results.clear()
+            self._bytes = self._hits = self._misses = self._evictions = 0
+
+    def cache_info(self) -> ResultCacheInfo:
+        """Return the hits, misses, evictions, number and total size of results."""
+        with self._lock:
+            return ResultCacheInfo(
+                self._hits,
+                self._misses,
+                self._evictions,
+                len(self._results),
+                self._bytes,
+            )
+
+
+def _get_key(pandoc_version, args, input, cworkdir, return_bytes) -> str:
+    """Return the cache key of running pandoc with `args` on `input`.
+
+    The key doesn't depend on where pandoc is installed, so caches shared by
+    several hosts are hit by all of them.
+
+    :param list args: the pandoc command line, starting with the pandoc path
+    """
+    # a filter run by a FilterServer is keyed on its script, not on its shim
+    args = [_shim_args.get(str(x), str(x)) for x in args]
+    cworkdir = cworkdir or os.getcwd()
+    files = [
+        [value, _hash_file(_resolve_file(name, value, cworkdir))]
+        for name, value in _get_file_options(args[1:])
+    ]
+
+    h = hashlib.sha256()
+    h.update(
+        json.dumps(
+            [
+                pandoc_version,
+                args[1:],
+                cworkdir,
+                return_bytes,
+                files,
+            ]
+        ).encode("utf-8")
+    )
+    h.update(input)
+    return h.hexdigest()
+
+
+def _get_file_options(args: list) -> list:
+    """Return the options in `args` which name files as (option, value) pairs.
+
+    The options are recognised in all the spellings pandoc accepts: with the
+    value in the next argument or attached (``--template=x``, ``-Hx``), within
+    a group of short options (``-CHx``) and as an abbreviated long option.
+    """
+    options = []
+    args = iter(args)
+    for arg in args:
+        if arg.startswith("--"):
+            name, has_value, value = arg.partition("=")
+            if name not in _FILE_OPTIONS:
+                # pandoc takes unambiguous prefixes of its long options
+                names = [x for x in _FILE_OPTIONS if x.startswith(name)]
+                if len(names) != 1 or name == "--":
+                    continue
+                name = names[0]
+            if not has_value:
+                value = next(args, None)
+        elif arg.startswith("-"):
+            for i, letter in enumerate(arg[1:], 2):
+                if letter not in _SHORT_FLAGS:
+                    break
+            else:
+                continue
+            if letter not in _SHORT_OPTIONS_WITH_VALUE:
+                continue
+            name, value = "-" + letter, arg[i:] or next(args, None)
+            if name not in _FILE_OPTIONS:
+                continue
+        else:
+            continue
+        if value is not None:
+            options.append((name, value))
+    return options
+
+
+def _resolve_file(option: str, value: str, cworkdir: str) -> Union[str, None]:
+    path = os.path.join(cworkdir, os.path.expanduser(value))
+    if os.path.isfile(path):
+        return path
+    if option in ("--filter", "-F"):
+        # filters may also be found on the PATH
+        return shutil.which(value)
+    # e.g. a template in pandoc's data directory, only its name is known
+    return None
+
+
+def _hash_file(path: Union[str, None]) -> Union[str, None]:
+    if path is None:
+        return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return _hash_file_contents(
+        os.path.realpath(path), stat.st_ino, stat.st_size, stat.st_mtime_ns
+    )
+
+
+@functools.lru_cache(maxsize=256)
+def _hash_file_contents(path, inode, size, mtime_ns) -> Union[str, None]:
+    # the stat values are only part of the arguments to not reuse the hash of
+    # a file which changed since
+    h = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(65536), b""):
+                h.update(chunk)
+    except OSError:
+        return None
+    return h.hexdigest()
+
+
+# magic, "s" for str or "b" for bytes, time the result was stored
+_ENTRY_HEADER = struct.Struct("<4scd")
+_ENTRY_MAGIC = b"PPR1"
+# how often a process rescans the directory to notice results stored by others
+_SCAN_INTERVAL = 60
+# temporary files older than this were left behind by a crashed process
+_STALE_TMP_AGE = 3600
+
+
+class DiskResultCache:
+    """A cache of conversion results in a directory, shared by all processes.
+
+    Every result is stored in its own file, written to a temporary file first
+    and renamed, so readers never see a partially written result. Using a
+    result updates the modification time of its file; once the directory
+    grows beyond `max_bytes`, the least recently used results are removed by
+    one process at a time, which holds a lock on the ``.lock`` file.
+
+    :param str directory: where to store the results (Default value =
+        ``results`` in the directory of the probe cache, see
+        :mod:`pypandoc.probe_cache`)
+
+    :param int max_bytes: the maximal total size of the stored results
+        (Default value = 1 GiB)
+
+    :param float ttl: the number of seconds after storing a result after
+        which it isn't used anymore and is removed by the next pruning, None
+        to keep results until they are evicted
+        (Default value = None)
+    """
+
+    def __init__(
+        self,
+        directory: Union[str, None] = None,
+        max_bytes: int = 2**30,
+        ttl: Union[float, None] = None,
+    ):
+        if directory is None:
+            directory = os.path.join(_get_cache_dir(), "results")
+        self.directory = os.path.expanduser(directory)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        # the total size of the results as of the last scan, plus what this
+        # process stored since
+        self._bytes = None
+        self._last_scan = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        """Return the result stored for `key` or None."""
+        path = self._get_path(key)
+        result = None
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            data = b""
+        if len(data) >= _ENTRY_HEADER.size:
+            magic, kind, stored = _ENTRY_HEADER.unpack_from(data)
+            if magic != _ENTRY_MAGIC:
+                pass
+            elif self.ttl is not None and time.time() - stored > self.ttl:
+                _remove(path)
+            else:
+                result = data[_ENTRY_HEADER.size :]
+                if kind == b"s":
+                    result = result.decode("utf-8")
+                with contextlib.suppress(OSError):
+                    os.utime(path)
+        with self._lock:
+            if result is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+        return result
+
+    def put(self, key: str, result: Union[str, bytes]) -> None:
+        if isinstance(result, str):
+            kind, result = b"s", result.encode("utf-8")
+        else:
+            kind = b"b"
+        data = _ENTRY_HEADER.pack(_ENTRY_MAGIC, kind, time.time()) + result
+        if len(data) > self.max_bytes:
+            return
+        path = self._get_path(key)
+        tmp_name = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_name, path)
+        except OSError as e:
+            logger.debug("Couldn't store a conversion result: %s", e)
+            if tmp_name is not None:
+                _remove(tmp_name)
+            return
+
+        with self._lock:
+            if self._bytes is not None:
+                self._bytes += len(data)
+            prune = (
+                self._bytes is None
+                or self._bytes > self.max_bytes
+                or time.monotonic() - self._last_scan > _SCAN_INTERVAL
+            )
+        if prune:
+            self._prune()
+
+    def clear(self) -> None:
+        """Remove all results and reset the statistics."""
+        with self._locked(blocking=True):
+            for path, _, _ in self._scan():
+                _remove(path)
+        with self._lock:
+            self._bytes = 0
+            self._hits = self._misses = self._evictions = 0
+
+    def cache_info(self) -> ResultCacheInfo:
+        """Return the hits, misses and evictions of this process, and the
+        number and total size of all stored results."""
+        entries = list(self._scan())
+        with self._lock:
+            return ResultCacheInfo(
+                self._hits,
+                self._misses,
+                self._evictions,
+                len(entries),
+                sum(size for _, _, size in entries),
+            )
+
+    def _get_path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def _scan(self):
+        """Yield the path, modification time and size of all stored results.
+
+        Temporary files left behind by crashed processes are removed.
+        """
+        now = time.time()
+        try:
+            subdirs = os.scandir(self.directory)
+        except OSError:
+            return
+        with subdirs:
+            for subdir in subdirs:
+                if len(subdir.name) != 2 or not subdir.is_dir():
+                    continue
+                try:
+                    entries = list(os.scandir(subdir.path))
+                except OSError:
+                    continue
+                for entry in entries:
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    if not entry.name.endswith(".tmp"):
+                        yield entry.path, stat.st_mtime, stat.st_size
+                    elif now - stat.st_mtime > _STALE_TMP_AGE:
+                        _remove(entry.path)
+
+    def _prune(self) -> None:
+        """Remove expired and least recently used results beyond `max_bytes`."""
+        with self._locked(blocking=False) as locked:
+            if not locked:
+                # another process is pruning right now
+                self._last_scan = time.monotonic()
+                return
+            entries = sorted(self._scan(), key=lambda entry: entry[1])
+            total = sum(size for _, _, size in entries)
+            evictions = 0
+            expired = time.time() - self.ttl if self.ttl is not None else None
+            for path, _, size in entries:
+                if total <= self.max_bytes:
+                    if expired is None:
+                        break
+                    # like get(), by the time the result was stored: the
+                    # modification time only tells when it was last used
+                    stored = _get_stored_time(path)
+                    if stored is None or stored >= expired:
+                        continue
+                if _remove(path):
+                    total -= size
+                    evictions += 1
+        with self._lock:
+            self._bytes = total
+            self._evictions += evictions
+            self._last_scan = time.monotonic()
+
+    @contextlib.contextmanager
+    def _locked(self, blocking: bool):
+        """Hold a lock on the ``.lock`` file shared by all processes.
+
+        Yields whether the lock was acquired, which is always the case when
+        `blocking` is True.
+        """
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            f = open(os.path.join(self.directory, ".lock"), "a+b")
+        except OSError as e:
+            logger.debug("Couldn't lock the result cache: %s", e)
+            yield False
+            return
+        with f:
+            if not _lock_file(f, blocking):
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                _unlock_file(f)
+
+
+def _get_stored_time(path: str) -> Union[float, None]:
+    """Return the time the result in `path` was stored, None if it's invalid."""
+    try:
+        with open(path, "rb") as f:
+            header = f.read(_ENTRY_HEADER.size)
+    except OSError:
+        return None
+    if len(header) < _ENTRY_HEADER.size:
+        return None
+    magic, _, stored = _ENTRY_HEADER.unpack(header)
+    return stored if magic == _ENTRY_MAGIC else None
+
+
+def _remove(path: str) -> bool:
+    try:
+        os.remove(path)
+    except OSError:
+        # already removed by another process, or still open on Windows
+        return False
+    return True
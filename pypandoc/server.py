@@ -0,0 +1,622 @@
+"""Conversions through a long-running ``pandoc server`` process.
+
+pandoc 3.x ships ``pandoc server``, which converts documents received as JSON
+over HTTP inside a single process. Converting through it saves starting pandoc
+for every conversion. Only the options which the server understands can be
+used; :func:`pypandoc.convert_text` falls back to starting pandoc when a
+conversion needs anything else (filters, an output file, unsupported
+`extra_args`, ...).
+
+``pandoc server`` has no option for the interface it listens on, it accepts
+connections on all network interfaces. Anyone who can reach the machine can
+convert documents with it while it runs, so the server is only started after
+opting in with :func:`set_server_network_access` or the `allow_network_access`
+argument of :class:`PandocServer`. On Linux, pypandoc checks that the port it
+talks to belongs to the started pandoc and not to some other local process.
+"""
+
+import atexit
+import base64
+import http.client
+import itertools
+import json
+import os
+import queue
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Iterable, Iterator, Tuple, Union
+
+from .defaults_file import _split_key_value
+from .handler import logger
+
+# pandoc command line option -> (server option, kind of value)
+_SERVER_OPTIONS = {
+    "--standalone": ("standalone", "flag"),
+    "-s": ("standalone", "flag"),
+    "--wrap": ("wrap", "str"),
+    "--columns": ("columns", "int"),
+    "--toc": ("table-of-contents", "flag"),
+    "--table-of-contents": ("table-of-contents", "flag"),
+    "--toc-depth": ("toc-depth", "int"),
+    "--number-sections": ("number-sections", "flag"),
+    "-N": ("number-sections", "flag"),
+    "--shift-heading-level-by": ("shift-heading-level-by", "int"),
+    "--tab-stop": ("tab-stop", "int"),
+    "--strip-comments": ("strip-comments", "flag"),
+    "--ascii": ("ascii", "flag"),
+    "--reference-links": ("reference-links", "flag"),
+    "--reference-location": ("reference-location", "str"),
+    "--section-divs": ("section-divs", "flag"),
+    "--html-q-tags": ("html-q-tags", "flag"),
+    "--listings": ("listings", "flag"),
+    "--incremental": ("incremental", "flag"),
+    "-i": ("incremental", "flag"),
+    "--top-level-division": ("top-level-division", "str"),
+    "--identifier-prefix": ("identifier-prefix", "str"),
+    "--title-prefix": ("title-prefix", "str"),
+    "--email-obfuscation": ("email-obfuscation", "str"),
+    "--slide-level": ("slide-level", "int"),
+    "--citeproc": ("citeproc", "flag"),
+    "-C": ("citeproc", "flag"),
+    "--variable": ("variables", "keyvalue"),
+    "-V": ("variables", "keyvalue"),
+    "--metadata": ("metadata", "keyvalue"),
+    "-M": ("metadata", "keyvalue"),
+}
+
+# sources sent to the server in one /batch request by convert_many()
+_BATCH_SIZE = 64
+_LOG_LEVELS = {"ERROR": 40, "WARNING": 30, "INFO": 20, "DEBUG": 10}
+
+
+def _server_options(extra_args: Iterable) -> Union[dict, None]:
+    """Translate pandoc command line arguments into pandoc server options.
+
+    :returns: the options or None if any argument isn't supported by the server
+    """
+    options = {}
+    args = list(extra_args)
+    while args:
+        arg = str(args.pop(0))
+        name, has_value, value = arg.partition("=")
+        if name not in _SERVER_OPTIONS:
+            return None
+        key, kind = _SERVER_OPTIONS[name]
+        if kind == "flag":
+            if has_value:
+                return None
+            options[key] = True
+            continue
+        if not has_value:
+            if not args:
+                return None
+            value = str(args.pop(0))
+        if kind == "int":
+            try:
+                options[key] = int(value)
+            except ValueError:
+                return None
+        elif kind == "keyvalue":
+            item, item_value = _split_key_value(value)
+            options.setdefault(key, {})[item] = item_value
+        else:
+            options[key] = value
+    return options
+
+
+class PandocServer:
+    """A supervised ``pandoc server`` process.
+
+    The server is started on first use (or by :meth:`start`) and restarted if
+    it dies. Requests use keep-alive HTTP connections, which are pooled, so the
+    server can be used from several threads at the same time::
+
+        with pypandoc.PandocServer(allow_network_access=True) as server:
+            html = server.convert_text("# some title", "html", format="md")
+
+    :param str pandoc_path: the pandoc binary to run (Default value = the one
+        returned by :func:`pypandoc.get_pandoc_path()`)
+
+    :param int timeout: seconds after which the server aborts a conversion
+        (Default value = 60)
+
+    :param float startup_timeout: seconds to wait for the server to answer
+        requests after starting it (Default value = 10)
+
+    :param bool allow_network_access: accept that ``pandoc server`` listens on
+        all network interfaces, so others who can reach the machine can use it
+        too. The server isn't started without it. (Default value = False)
+    """
+
+    def __init__(
+        self,
+        pandoc_path: Union[str, None] = None,
+        timeout: int = 60,
+        startup_timeout: float = 10.0,
+        allow_network_access: bool = False,
+    ):
+        self.pandoc_path = pandoc_path
+        self.timeout = timeout
+        self.startup_timeout = startup_timeout
+        self.allow_network_access = allow_network_access
+        self.port = None
+        self._process = None
+        self._stderr = None
+        self._connections = queue.LifoQueue()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def running(self) -> bool:
+        return self._process is not None and self._process.poll() is None
+
+    def start(self) -> None:
+        """Start the server unless it's already running.
+
+        :raises RuntimeError: if the server doesn't come up or network access
+            isn't allowed
+        """
+        with self._lock:
+            if self.running:
+                return
+            if not self.allow_network_access:
+                raise RuntimeError(
+                    "pandoc server listens on all network interfaces, pass "
+                    "allow_network_access=True to start it anyway"
+                )
+            self._stop()
+            if self.pandoc_path is None:
+                from . import get_pandoc_path
+
+                self.pandoc_path = get_pandoc_path()
+
+            self.port = _get_free_port()
+            logger.debug("Starting pandoc server on port %s...", self.port)
+            # a file instead of a pipe, so a chatty server can never block on
+            # a full stderr pipe nobody reads
+            self._stderr = tempfile.TemporaryFile()
+            self._process = subprocess.Popen(
+                [
+                    self.pandoc_path,
+                    "server",
+                    "--port=%d" % self.port,
+                    "--timeout=%d" % self.timeout,
+                ],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=self._stderr,
+                creationflags=0x08000000 if sys.platform == "win32" else 0,
+            )
+            try:
+                self._wait_until_ready()
+            except RuntimeError:
+                self._stop()
+                raise
+
+    def _wait_until_ready(self) -> None:
+        deadline = time.monotonic() + self.startup_timeout
+        while True:
+            if self._process.poll() is not None:
+                self._stderr.seek(0)
+                raise RuntimeError(
+                    'pandoc server died with exitcode "{}": {}'.format(
+                        self._process.returncode,
+                        self._stderr.read().decode("utf-8", errors="replace"),
+                    )
+                )
+            try:
+                status, body = self._request("GET", "/version", None, retry=False)
+                if status == 200:
+                    if _owns_listener(self._process.pid, self.port) is False:
+                        # the port was taken between picking and binding it
+                        raise RuntimeError(
+                            "port %d is used by another process" % self.port
+                        )
+                    logger.debug("pandoc server %s is ready", body.decode().strip())
+                    return
+            except http.client.RemoteDisconnected:
+                # accepting connections but not answering them means the
+                # server is broken, e.g. a pandoc built without server support
+                self._stderr.seek(0)
+                raise RuntimeError(
+                    "pandoc server closed the connection without answering: %s"
+                    % self._stderr.read().decode("utf-8", errors="replace").strip()
+                )
+            except (OSError, http.client.HTTPException):
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(
+                    "pandoc server didn't answer within %s seconds"
+                    % self.startup_timeout
+                )
+            time.sleep(0.02)
+
+    def stop(self) -> None:
+        """Stop the server and close all connections to it."""
+        with self._lock:
+            self._stop()
+
+    def _stop(self) -> None:
+        while True:
+            try:
+                self._connections.get_nowait().close()
+            except queue.Empty:
+                break
+        if self._process is not None:
+            if self._process.poll() is None:
+                self._process.terminate()
+                try:
+                    self._process.wait(5)
+                except subprocess.TimeoutExpired:
+                    self._process.kill()
+                    self._process.wait()
+            self._process = None
+        if self._stderr is not None:
+            self._stderr.close()
+            self._stderr = None
+
+    def _request(self, method, path, payload, retry=True):
+        body = None if payload is None else json.dumps(payload).encode("utf-8")
+        headers = {"Content-Type": "application/json", "Accept": "application/json"}
+        try:
+            connection = self._connections.get_nowait()
+        except queue.Empty:
+            connection = http.client.HTTPConnection("127.0.0.1", self.port)
+        try:
+            connection.request(method, path, body, headers)
+            response = connection.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            if not retry:
+                raise
+            # the server may have closed an idle keep-alive connection, or died
+            self.start()
+            return self._request(method, path, payload, retry=False)
+        self._connections.put(connection)
+        return response.status, data
+
+    def _convert(self, path, payload):
+        if not self.running:
+            self.start()
+        status, data = self._request("POST", path, payload)
+        if status != 200:
+            raise RuntimeError(
+                "pandoc server failed with status {} during conversion: {}".format(
+                    status, data.decode("utf-8", errors="replace")
+                )
+            )
+        return json.loads(data.decode("utf-8"))
+
+    def convert_text(
+        self,
+        source: Union[str, bytes],
+        to: str,
+        format: str,
+        extra_args: Iterable = (),
+        encoding: str = "utf-8",
+    ) -> Union[str, bytes]:
+        """Convert `source` from `format` to `to` using the server.
+
+        The arguments have the same meaning as for :func:`pypandoc.convert_text`.
+
+        :returns: the converted document; bytes for binary output formats
+            like docx
+
+        :raises RuntimeError: if `extra_args` contains options the server
+            doesn't support or the conversion fails
+        """
+        payload = self._payload(source, to, format, extra_args, encoding)
+        return _parse_result(self._convert("/", payload))
+
+    def convert_batch(
+        self,
+        sources: Iterable[Union[str, bytes]],
+        to: str,
+        format: str,
+        extra_args: Iterable = (),
+        encoding: str = "utf-8",
+    ) -> list:
+        """Convert all `sources` with the same options in a single request.
+
+        :returns: the converted documents, in the order of `sources`
+
+        :raises RuntimeError: if `extra_args` contains options the server
+            doesn't support or any of the conversions fails
+        """
+        outputs = []
+        for output, error in self._convert_batch(
+            list(sources), to, format, extra_args, encoding
+        ):
+            if error is not None:
+                raise error
+            outputs.append(output)
+        return outputs
+
+    def _convert_batch(self, sources, to, format, extra_args, encoding) -> list:
+        """Convert `sources` with a request to ``/batch``.
+
+        :returns: an (output, exception) pair for every source
+        """
+        results = [None] * len(sources)
+        payloads = {}
+        for i, source in enumerate(sources):
+            try:
+                payloads[i] = self._payload(source, to, format, extra_args, encoding)
+            except RuntimeError as e:
+                results[i] = (None, e)
+        if not payloads:
+            return results
+        try:
+            converted = self._convert("/batch", list(payloads.values()))
+            if not isinstance(converted, list) or len(converted) != len(payloads):
+                raise RuntimeError(
+                    "pandoc server answered a batch of %d conversions with an "
+                    "invalid response" % len(payloads)
+                )
+        except (OSError, RuntimeError) as e:
+            converted = [e] * len(payloads)
+        for i, result in zip(payloads, converted):
+            if isinstance(result, Exception):
+                results[i] = (None, result)
+                continue
+            try:
+                results[i] = (_parse_result(result), None)
+            except RuntimeError as e:
+                results[i] = (None, e)
+        return results
+
+    @staticmethod
+    def _payload(source, to, format, extra_args, encoding) -> dict:
+        from . import normalize_format
+
+        options = _server_options(extra_args)
+        if options is None:
+            raise RuntimeError(
+                "pandoc server doesn't support the arguments %s" % list(extra_args)
+            )
+        from . import _BINARY_INPUT_FORMATS
+
+        if isinstance(source, (bytearray, memoryview)):
+            source = bytes(source)
+        if isinstance(source, bytes):
+            if _base_format(format) in _BINARY_INPUT_FORMATS:
+                source = base64.b64encode(source).decode("ascii")
+            else:
+                source = source.decode(encoding, errors="replace")
+        elif not isinstance(source, str):
+            raise RuntimeError("Invalid source! Got %s" % type(source).__name__)
+        options.update(
+            {
+                "text": source,
+                "from": normalize_format(format),
+                "to": normalize_format(to),
+            }
+        )
+        return options
+
+
+def _parse_result(result) -> Union[str, bytes]:
+    if isinstance(result, str):
+        return result
+    if "error" in result and "output" not in result:
+        raise RuntimeError(
+            "pandoc server failed during conversion: %s" % result["error"]
+        )
+    for message in result.get("messages", ()):
+        message = dict(message)
+        level = _LOG_LEVELS.get(message.pop("verbosity", "WARNING"), 30)
+        logger.log(level, json.dumps(message))
+    output = result.get("output", "")
+    if result.get("base64"):
+        return base64.b64decode(output)
+    return output
+
+
+def _base_format(format: str) -> str:
+    from . import _get_base_format
+
+    return _get_base_format(format)
+
+
+def _convert_text(
+    backend,
+    source,
+    to,
+    format,
+    extra_args,
+    encoding,
+    outputfile,
+    filters,
+    cworkdir,
+    sandbox=False,
+):
+    """Convert `source` using a pandoc server, if the conversion allows it.
+
+    :param backend: "server" for the shared server or a :class:`PandocServer`
+
+    :returns: the converted document or None if the conversion has to be done
+        by starting pandoc
+
+    :raises RuntimeError: for the shared server, if network access wasn't
+        allowed with :func:`set_server_network_access`
+    """
+    _check_network_access(backend)
+    if not _can_convert(to, extra_args, outputfile, filters, cworkdir, sandbox):
+        return None
+    server = _get_shared_server() if backend == "server" else backend
+    if server is None:
+        return None
+    return server.convert_text(source, to, format, extra_args, encoding)
+
+
+def _convert_batches(
+    backend, sources, to, format, extra_args, encoding, filters, cworkdir, sandbox
+) -> Union[Iterator[Tuple], None]:
+    """Convert `sources` in ``/batch`` requests, if the conversions allow it.
+
+    The sources are read and sent in batches of up to ``_BATCH_SIZE``.
+
+    :param backend: "server" for the shared server or a :class:`PandocServer`
+
+    :returns: an iterator of an (output, exception) pair for every source or
+        None if the conversions have to be done by starting pandoc
+    """
+    _check_network_access(backend)
+    if not _can_convert(to, extra_args, None, filters, cworkdir, sandbox):
+        return None
+    server = _get_shared_server() if backend == "server" else backend
+    if server is None:
+        return None
+    return _iter_batches(server, iter(sources), to, format, extra_args, encoding)
+
+
+def _iter_batches(server, sources, to, format, extra_args, encoding):
+    while True:
+        batch = list(itertools.islice(sources, _BATCH_SIZE))
+        if not batch:
+            return
+        yield from server._convert_batch(batch, to, format, extra_args, encoding)
+
+
+def _check_network_access(backend) -> None:
+    if backend == "server" and not __network_access:
+        raise RuntimeError(
+            'backend="server" runs pandoc server, which listens on all network '
+            "interfaces; call pypandoc.set_server_network_access(True) first"
+        )
+
+
+def _can_convert(to, extra_args, outputfile, filters, cworkdir, sandbox) -> bool:
+    """Return whether the server can do a conversion with these arguments."""
+    if outputfile or filters or cworkdir or sandbox or _base_format(to) == "pdf":
+        # pandoc's --sandbox isn't an option of the server, leave sandboxed
+        # conversions to pandoc itself
+        return False
+    if _server_options(extra_args) is None:
+        logger.debug("pandoc server doesn't support %s", list(extra_args))
+        return False
+    return True
+
+
+def _get_free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _owns_listener(pid: int, port: int) -> Union[bool, None]:
+    """Check whether all TCP sockets listening on `port` belong to process `pid`.
+
+    :returns: None if that can't be told, e.g. on other systems than Linux
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+    listeners = set()
+    try:
+        fd_dir = "/proc/%d/fd" % pid
+        sockets = set()
+        for fd in os.listdir(fd_dir):
+            try:
+                sockets.add(os.readlink(os.path.join(fd_dir, fd)))
+            except FileNotFoundError:  # closed meanwhile
+                pass
+        for table in ("/proc/net/tcp", "/proc/net/tcp6"):
+            if not os.path.exists(table):  # no IPv6
+                continue
+            with open(table) as f:
+                next(f)
+                for line in f:
+                    fields = line.split()
+                    # local address, state (0A is LISTEN) and inode
+                    local_port = int(fields[1].rpartition(":")[2], 16)
+                    if local_port == port and fields[3] == "0A":
+                        listeners.add("socket:[%s]" % fields[9])
+    except (OSError, ValueError, IndexError):
+        return None
+    return bool(listeners) and listeners <= sockets
+
+
+# -----------------------------------------------------------------------------
+# Shared server used by convert_text(..., backend="server")
+# -----------------------------------------------------------------------------
+def _get_shared_server() -> Union[PandocServer, None]:
+    """Return the running shared server or None if pandoc can't run one.
+
+    A failure to start the server is remembered for the pandoc binary, so
+    conversions fall back to starting pandoc without trying again every time.
+    """
+    global __shared_server
+
+    from . import ensure_pandoc_minimal_version, get_pandoc_path
+
+    pandoc_path = get_pandoc_path()
+    with __shared_server_lock:
+        if pandoc_path in __unsupported_pandoc_paths:
+            return None
+        if __shared_server is None or __shared_server.pandoc_path != pandoc_path:
+            if __shared_server is not None:
+                __shared_server.stop()
+            __shared_server = PandocServer(pandoc_path, allow_network_access=True)
+        if not __shared_server.running:
+            try:
+                if not ensure_pandoc_minimal_version(3, 0):
+                    raise RuntimeError("pandoc server needs pandoc >= 3.0")
+                __shared_server.start()
+            except (OSError, RuntimeError) as e:
+                logger.warning(
+                    "Can't use pandoc server, falling back to running pandoc "
+                    "for each conversion: %s",
+                    e,
+                )
+                __unsupported_pandoc_paths.add(pandoc_path)
+                return None
+        return __shared_server
+
+
+def _stop_shared_server() -> None:
+    global __shared_server
+
+    with __shared_server_lock:
+        if __shared_server is not None:
+            __shared_server.stop()
+            __shared_server = None
+        __unsupported_pandoc_paths.clear()
+
+
+def set_server_network_access(allowed: bool) -> None:
+    """Allow ``convert_text(..., backend="server")`` to start ``pandoc server``.
+
+    ``pandoc server`` can't be told to listen on localhost only. While it runs,
+    anyone who can reach the machine on its (random) port can convert
+    documents with it, so only allow this on hosts which aren't reachable by
+    untrusted parties.
+
+    :param bool allowed: whether the shared server may be started; disallowing
+        it stops a running shared server
+    """
+    global __network_access, __shared_server
+
+    with __shared_server_lock:
+        __network_access = allowed
+        if not allowed and __shared_server is not None:
+            __shared_server.stop()
+            __shared_server = None
+
+
+atexit.register(_stop_shared_server)
+
+__shared_server = None
+__shared_server_lock = threading.Lock()
+__unsupported_pandoc_paths = set()
+__network_access = False
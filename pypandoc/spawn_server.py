@@ -0,0 +1,340 @@
+"""A small helper process which starts pandoc on behalf of a large process.
+
+Starting a program from a process with a lot of memory can be slow: unless
+Python can use ``vfork()`` or ``posix_spawn()``, ``subprocess`` forks, which
+copies the page tables of the whole process. A :class:`_SpawnServer` is started
+while the process is still small and starts pandoc instead, so the time it
+takes doesn't depend on the size of the process using pypandoc. The process
+creates the pipes itself and passes pandoc's ends to the server over a Unix
+socket, so pandoc's input and output don't go through the server.
+
+The helper is this module run as a script. Its process should stay small, so
+it imports nothing but the standard library, and certainly not pypandoc.
+"""
+
+import array
+import json
+import os
+import select
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+from typing import Union
+
+
+class _SpawnServer:
+    """A server process which starts programs, see the module docstring.
+
+    The server is started when it's first used and restarted if it died.
+    """
+
+    def __init__(self):
+        self._process = None
+        self._directory = None
+        self._socket_path = None
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        """Start the server if it isn't running."""
+        with self._lock:
+            if self._process is None or self._process.poll() is not None:
+                self._start()
+
+    def _start(self) -> None:
+        self._stop()
+        self._directory = tempfile.mkdtemp(prefix="pypandoc-spawn-")
+        self._socket_path = os.path.join(self._directory, "socket")
+        # the server exits when its stdin is closed, i.e. when this process
+        # exits without stopping it
+        self._process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), self._socket_path],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+        # the server writes a line once it listens on the socket
+        if not self._process.stdout.readline():
+            self._process.wait()
+            raise RuntimeError(
+                "The spawn server exited with %s" % self._process.returncode
+            )
+
+    def spawn(
+        self,
+        args: list,
+        stdin=None,
+        stdout=None,
+        stderr=None,
+        env: Union[dict, None] = None,
+        cwd: Union[str, None] = None,
+        start_new_session: bool = False,
+    ) -> "_SpawnedProcess":
+        """Start `args` like ``subprocess.Popen`` does.
+
+        `stdin`, `stdout` and `stderr` can be ``subprocess.PIPE``, a file
+        descriptor or None, which gives pandoc the server's stdin (``os.devnull``)
+        or no stdout or stderr. With `start_new_session`, signals are sent to
+        the whole process group of the program.
+        """
+        self.start()
+        connection = socket.socket(socket.AF_UNIX)
+        parent_ends = []
+        child_ends = []
+        try:
+            connection.connect(self._socket_path)
+            fds = []
+            for i, stream in enumerate((stdin, stdout, stderr)):
+                if stream == subprocess.PIPE:
+                    read_end, write_end = os.pipe()
+                    parent_end, child_end = (
+                        (write_end, read_end) if i == 0 else (read_end, write_end)
+                    )
+                    parent_ends.append(parent_end)
+                    child_ends.append(child_end)
+                    fds.append(child_end)
+                elif stream is None:
+                    parent_ends.append(None)
+                    child_ends.append(os.open(os.devnull, os.O_RDWR))
+                    fds.append(child_ends[-1])
+                else:
+                    parent_ends.append(None)
+                    fds.append(stream)
+
+            _send_fds(connection, fds)
+            request = {
+                "args": [str(x) for x in args],
+                "env": env,
+                "cwd": cwd,
+                "new_session": start_new_session,
+            }
+            connection.sendall(json.dumps(request).encode("utf-8") + b"\n")
+            for fd in child_ends:
+                os.close(fd)
+            child_ends = []
+
+            response = _read_line(connection)
+            if "pid" not in response:
+                raise OSError(
+                    response["errno"], response["strerror"], response["filename"]
+                )
+        except BaseException:
+            for fd in parent_ends + child_ends:
+                if fd is not None:
+                    os.close(fd)
+            connection.close()
+            raise
+
+        return _SpawnedProcess(
+            args,
+            connection,
+            response["pid"],
+            *(
+                None if fd is None else open(fd, "wb" if i == 0 else "rb")
+                for i, fd in enumerate(parent_ends)
+            ),
+        )
+
+    def close(self) -> None:
+        """Stop the server."""
+        with self._lock:
+            self._stop()
+
+    def _stop(self) -> None:
+        if self._process is not None:
+            self._process.stdin.close()
+            self._process.terminate()
+            self._process.wait()
+            self._process.stdout.close()
+            self._process = None
+        if self._directory is not None:
+            shutil.rmtree(self._directory, ignore_errors=True)
+            self._directory = None
+
+
+class _SpawnedProcess:
+    """A program started by a :class:`_SpawnServer`.
+
+    It has the parts of the interface of ``subprocess.Popen`` pypandoc uses.
+    """
+
+    def __init__(self, args, connection, pid, stdin, stdout, stderr):
+        self.args = args
+        self.pid = pid
+        self.stdin = stdin
+        self.stdout = stdout
+        self.stderr = stderr
+        self.returncode = None
+        self._connection = connection
+        self._lock = threading.Lock()
+
+    def poll(self) -> Union[int, None]:
+        if self.returncode is None and select.select([self._connection], [], [], 0)[0]:
+            self.wait()
+        return self.returncode
+
+    def wait(self, timeout: Union[float, None] = None) -> int:
+        with self._lock:
+            if self.returncode is not None:
+                return self.returncode
+            if (
+                timeout is not None
+                and not select.select([self._connection], [], [], timeout)[0]
+            ):
+                raise subprocess.TimeoutExpired(self.args, timeout)
+            try:
+                self.returncode = _read_line(self._connection)["returncode"]
+            except (OSError, ValueError, KeyError):
+                raise RuntimeError(
+                    "The spawn server exited while pandoc was running"
+                ) from None
+            finally:
+                self._connection.close()
+            return self.returncode
+
+    def send_signal(self, sig: int) -> None:
+        if self.returncode is None:
+            try:
+                self._connection.sendall(bytes([sig]))
+            except OSError:
+                # the program exited and the server closed the connection
+                pass
+
+    def terminate(self) -> None:
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self) -> None:
+        self.send_signal(signal.SIGKILL)
+
+    def communicate(self, input: Union[bytes, None] = None):
+        """Write `input` to stdin and read stdout and stderr until the program
+        exits, like ``subprocess.Popen.communicate()``."""
+        output = {}
+
+        def read(name, f):
+            output[name] = f.read()
+            f.close()
+
+        threads = [
+            threading.Thread(target=read, args=(name, f), daemon=True)
+            for name, f in (("stdout", self.stdout), ("stderr", self.stderr))
+            if f is not None
+        ]
+        for thread in threads:
+            thread.start()
+        if self.stdin is not None:
+            try:
+                if input:
+                    self.stdin.write(input)
+                self.stdin.close()
+            except BrokenPipeError:
+                # the program exited before reading all of its input
+                pass
+        for thread in threads:
+            thread.join()
+        self.wait()
+        return output.get("stdout"), output.get("stderr")
+
+
+def _send_fds(connection: socket.socket, fds: list) -> None:
+    data = array.array("i", fds).tobytes()
+    connection.sendmsg([b"\0"], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, data)])
+
+
+def _receive_fds(connection: socket.socket, count: int) -> list:
+    fds = array.array("i")
+    _, ancdata, _, _ = connection.recvmsg(1, socket.CMSG_LEN(count * fds.itemsize))
+    for level, kind, data in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(data[: len(data) - (len(data) % fds.itemsize)])
+    return list(fds)
+
+
+def _read_line(connection: socket.socket) -> dict:
+    """Read a line of JSON from `connection`, one byte at a time so nothing
+    after it is consumed."""
+    line = bytearray()
+    while not line.endswith(b"\n"):
+        byte = connection.recv(1)
+        if not byte:
+            raise OSError("Connection closed")
+        line += byte
+    return json.loads(line)
+
+
+def _handle(connection: socket.socket) -> None:
+    """Start the program requested on `connection` and report its exit status."""
+    fds = _receive_fds(connection, 3)
+    try:
+        request = _read_line(connection)
+        process = subprocess.Popen(
+            request["args"],
+            stdin=fds[0],
+            stdout=fds[1],
+            stderr=fds[2],
+            env=request["env"],
+            cwd=request["cwd"],
+            start_new_session=request.get("new_session", False),
+        )
+    except OSError as e:
+        response = {"errno": e.errno, "strerror": e.strerror, "filename": e.filename}
+        connection.sendall(json.dumps(response).encode("utf-8") + b"\n")
+        connection.close()
+        return
+    finally:
+        for fd in fds:
+            os.close(fd)
+    connection.sendall(json.dumps({"pid": process.pid}).encode("utf-8") + b"\n")
+
+    def forward_signals():
+        while True:
+            try:
+                data = connection.recv(16)
+            except OSError:
+                data = b""
+            if not data:
+                connection.close()
+                return
+            for sig in data:
+                if request.get("new_session") and process.poll() is None:
+                    try:
+                        os.killpg(process.pid, sig)
+                    except OSError:
+                        pass
+                else:
+                    process.send_signal(sig)
+
+    threading.Thread(target=forward_signals, daemon=True).start()
+    returncode = process.wait()
+    try:
+        connection.sendall(
+            json.dumps({"returncode": returncode}).encode("utf-8") + b"\n"
+        )
+        connection.shutdown(socket.SHUT_WR)
+    except OSError:
+        # the process using pypandoc went away
+        pass
+
+
+def _exit_with_parent() -> None:
+    while os.read(0, 4096):
+        pass
+    os._exit(0)
+
+
+def _serve(socket_path: str) -> None:
+    listener = socket.socket(socket.AF_UNIX)
+    listener.bind(socket_path)
+    listener.listen(64)
+    threading.Thread(target=_exit_with_parent, daemon=True).start()
+    print("ready", flush=True)
+    sys.stdout = open(os.devnull, "w")
+    while True:
+        connection, _ = listener.accept()
+        threading.Thread(target=_handle, args=(connection,), daemon=True).start()
+
+
+if __name__ == "__main__":
+    _serve(sys.argv[1])
@@ -0,0 +1,376 @@
+"""One thread which looks after all running pandoc processes.
+
+Instead of a thread (or two) per pandoc process which writes its input and
+reads its output, the :class:`_Supervisor` runs a single selector loop, which
+does this for all of them: it writes to the stdin pipes as soon as they can
+take more input, reads from the stdout and stderr pipes as soon as there is
+output and notices processes exiting through a pidfd (on Linux >= 5.3) or by
+polling them. Every process is handed over with :meth:`_Supervisor.communicate`,
+which returns a future of its output, so the number of threads doesn't grow
+with the number of conversions running at the same time. The loop never runs
+code which may block: an input which has to be read first, like a generator or
+a file object, is written by a thread of its own. A process can be
+given a timeout, after which it's killed (with its process group, see
+:func:`_kill_process`) and its future fails with ``subprocess.TimeoutExpired``.
+
+Only available on POSIX, where pipes can be used with selectors.
+"""
+
+import collections
+import mmap
+import os
+import selectors
+import signal
+import socket
+import subprocess
+import threading
+import time
+from concurrent.futures import Future
+from typing import Union
+
+from .handler import logger
+from .spawn_server import _SpawnedProcess
+
+# size of the chunks read from stdout and stderr
+_CHUNK_SIZE = 65536
+# the most written to stdin at once, as much as fits into an enlarged pipe
+_WRITE_SIZE = 2**20
+# objects which are already in memory and written by the loop itself
+_BYTES_LIKE = (bytes, bytearray, memoryview, mmap.mmap)
+# seconds between polls of processes which can't be waited for with a pidfd
+_POLL_INTERVAL = 0.01
+
+
+class _Child:
+    """A process looked after by the supervisor."""
+
+    def __init__(self, process, input, future: Future, timeout=None):
+        self.process = process
+        self.future = future
+        self.timeout = timeout
+        self.deadline = None if timeout is None else time.monotonic() + timeout
+        self.timed_out = False
+        # the rest of an input in memory, which the loop writes
+        self.chunk = None
+        # an iterable input, which is written by a feeder thread
+        self.input = None
+        if isinstance(input, _BYTES_LIKE):
+            self.chunk = memoryview(input).cast("B")
+        else:
+            self.input = input
+        self.feeding = False
+        self.stdout = [] if process.stdout is not None else None
+        self.stderr = []
+        self.error = None
+        # the pipes registered with the selector
+        self.registered = []
+        self.watched = False
+        self.done = False
+
+
+class _Supervisor:
+    """Runs the selector loop described in the module docstring."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = collections.deque()
+        self._thread = None
+        self._pid = None
+
+    def communicate(self, process, input=None, timeout=None) -> Future:
+        """Write `input` to `process`, read its output and wait for it to exit.
+
+        :param input: None, a bytes-like object or an iterable of bytes-like
+            objects, which is read and written in a thread of its own
+        :param timeout: None or the seconds after which the process is killed
+
+        :returns: a future of stdout (None without a pipe) and stderr, like
+            ``process.communicate()`` returns them. Cancelling it kills the
+            process. If it timed out, it fails with ``subprocess.TimeoutExpired``
+            once the process has been reaped.
+        """
+        future = Future()
+        child = _Child(process, input, future, timeout)
+        future.add_done_callback(
+            lambda f: f.cancelled() and self._call_soon(self._kill, child)
+        )
+        self._call_soon(self._add, child)
+        return future
+
+    def _call_soon(self, func, *args) -> None:
+        """Run `func` in the loop thread."""
+        with self._lock:
+            if self._pid != os.getpid():
+                # first use, or the process was forked without the thread
+                self._start()
+            self._calls.append((func, args))
+        try:
+            self._wakeup_writer.send(b"\0")
+        except BlockingIOError:
+            # the loop will wake up anyway
+            pass
+
+    def _start(self) -> None:
+        self._pid = os.getpid()
+        self._calls.clear()
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+        self._wakeup_reader.setblocking(False)
+        self._wakeup_writer.setblocking(False)
+        self._selector.register(
+            self._wakeup_reader, selectors.EVENT_READ, (None, self._wake_up)
+        )
+        # children without a pidfd, which are polled until they exited
+        self._polled = set()
+        # children with a deadline, which haven't timed out yet
+        self._timed = set()
+        self._thread = threading.Thread(
+            target=self._run, name="pypandoc-supervisor", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            for key, _ in self._selector.select(self._select_timeout()):
+                child, handler = key.data
+                self._dispatch(child, handler, child, key.fileobj)
+            while self._calls:
+                func, args = self._calls.popleft()
+                child = args[0] if args and isinstance(args[0], _Child) else None
+                self._dispatch(child, func, *args)
+            for child in list(self._polled):
+                if child.process.poll() is not None:
+                    self._polled.discard(child)
+                    self._check_done(child)
+            now = time.monotonic()
+            for child in list(self._timed):
+                if child.deadline <= now:
+                    self._time_out(child)
+
+    def _select_timeout(self) -> Union[float, None]:
+        timeout = _POLL_INTERVAL if self._polled else None
+        if self._timed:
+            remaining = min(child.deadline for child in self._timed) - time.monotonic()
+            timeout = max(0, remaining if timeout is None else min(timeout, remaining))
+        return timeout
+
+    def _dispatch(self, child: Union[_Child, None], func, *args) -> None:
+        """Call `func`; an error gives up on `child`, but never stops the loop."""
+        try:
+            func(*args)
+        except Exception as e:
+            if child is None:
+                logger.exception("Error in the pypandoc supervisor thread")
+            else:
+                self._fail(child, e)
+
+    def _wake_up(self, child, wakeup_reader) -> None:
+        try:
+            while wakeup_reader.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _add(self, child: _Child) -> None:
+        process = child.process
+        if child.deadline is not None:
+            self._timed.add(child)
+        try:
+            self._watch_exit(child)
+            if process.stdin is not None:
+                if child.input is not None:
+                    child.feeding = True
+                    threading.Thread(
+                        target=self._feed,
+                        args=(child,),
+                        name="pypandoc-feeder",
+                        daemon=True,
+                    ).start()
+                elif child.chunk:
+                    self._register(child, process.stdin, selectors.EVENT_WRITE)
+                else:
+                    process.stdin.close()
+            for pipe in (process.stdout, process.stderr):
+                if pipe is not None:
+                    self._register(child, pipe, selectors.EVENT_READ)
+        except Exception as e:
+            self._fail(child, e)
+
+    def _register(self, child: _Child, pipe, events) -> None:
+        os.set_blocking(pipe.fileno(), False)
+        handler = self._write if events == selectors.EVENT_WRITE else self._read
+        self._selector.register(pipe, events, (child, handler))
+        child.registered.append(pipe)
+
+    def _unregister(self, child: _Child, fileobj) -> None:
+        self._selector.unregister(fileobj)
+        child.registered.remove(fileobj)
+        fileobj.close()
+
+    def _watch_exit(self, child: _Child) -> None:
+        """Register something which becomes readable once the process exits."""
+        process = child.process
+        child.watched = True
+        if isinstance(process, _SpawnedProcess):
+            # the spawn server sends the exit status
+            self._selector.register(
+                process._connection, selectors.EVENT_READ, (child, self._exited)
+            )
+            return
+        try:
+            pidfd = os.pidfd_open(process.pid)
+        except (AttributeError, OSError):
+            # no pidfd on this platform, Python or kernel
+            self._polled.add(child)
+            return
+        self._selector.register(pidfd, selectors.EVENT_READ, (child, self._exited))
+
+    def _exited(self, child: _Child, fileobj) -> None:
+        self._selector.unregister(fileobj)
+        if isinstance(fileobj, int):
+            os.close(fileobj)
+        child.process.wait()
+        self._check_done(child)
+
+    def _write(self, child: _Child, stdin) -> None:
+        try:
+            while child.chunk:
+                written = os.write(stdin.fileno(), child.chunk[:_WRITE_SIZE])
+                child.chunk = child.chunk[written:]
+        except BlockingIOError:
+            # the pipe is full, wait until pandoc reads from it
+            return
+        except BrokenPipeError:
+            # pandoc exited before reading all of its input
+            pass
+        # don't keep the input, e.g. an mmap can't be closed while it's viewed
+        child.chunk = None
+        self._unregister(child, stdin)
+
+    def _feed(self, child: _Child) -> None:
+        """Write an iterable input to stdin; runs in a thread of its own, as
+        reading the input may block or even convert another document."""
+        stdin = child.process.stdin
+        try:
+            for chunk in child.input:
+                try:
+                    stdin.write(chunk)
+                except OSError:
+                    # pandoc exited (or was killed) before reading all of it
+                    break
+        except Exception as e:
+            # reading the input failed: stop pandoc, the error is raised
+            # instead of pandoc's
+            self._call_soon(self._input_failed, child, e)
+        finally:
+            try:
+                stdin.close()
+            except OSError:
+                pass
+            self._call_soon(self._fed, child)
+
+    def _input_failed(self, child: _Child, error: Exception) -> None:
+        child.error = child.error or error
+        self._kill(child)
+
+    def _fed(self, child: _Child) -> None:
+        child.feeding = False
+        self._check_done(child)
+
+    def _read(self, child: _Child, pipe) -> None:
+        output = child.stdout if pipe is child.process.stdout else child.stderr
+        try:
+            while True:
+                data = os.read(pipe.fileno(), _CHUNK_SIZE)
+                if not data:
+                    self._unregister(child, pipe)
+                    self._check_done(child)
+                    return
+                output.append(data)
+        except BlockingIOError:
+            pass
+
+    def _check_done(self, child: _Child) -> None:
+        """Complete the future of `child` once it exited and all its pipes are
+        closed."""
+        if child.done or child.process.returncode is None:
+            return
+        if child.timed_out:
+            # don't wait for anything which escaped the process group and
+            # still holds the pipes
+            for fileobj in list(child.registered):
+                self._unregister(child, fileobj)
+        if child.registered or (child.feeding and not child.timed_out):
+            # a feeder blocked by something which escaped the process group
+            # isn't waited for after a timeout
+            return
+        child.done = True
+        self._polled.discard(child)
+        self._timed.discard(child)
+        if not child.future.set_running_or_notify_cancel():
+            return
+        if child.error is not None:
+            child.future.set_exception(child.error)
+            return
+        stdout = b"".join(child.stdout) if child.stdout is not None else None
+        child.future.set_result((stdout, b"".join(child.stderr)))
+
+    def _time_out(self, child: _Child) -> None:
+        self._timed.discard(child)
+        if child.done:
+            return
+        child.timed_out = True
+        child.error = subprocess.TimeoutExpired(
+            child.process.args,
+            child.timeout,
+            b"".join(child.stdout) if child.stdout is not None else None,
+            b"".join(child.stderr),
+        )
+        self._kill(child)
+        self._check_done(child)
+
+    def _kill(self, child: _Child) -> None:
+        if child.process.returncode is None:
+            _kill_process(child.process)
+
+    def _fail(self, child: _Child, error: Exception) -> None:
+        """Give up on `child` after an unexpected error."""
+        child.error = child.error or error
+        child.chunk = None
+        for fileobj in list(child.registered):
+            try:
+                self._unregister(child, fileobj)
+            except Exception:
+                child.registered.remove(fileobj)
+        self._kill(child)
+        if not child.watched:
+            self._polled.add(child)
+
+
+def _kill_process(process) -> None:
+    """Kill `process`, and everything in its process group if it leads one.
+
+    pandoc is started in a session of its own for conversions which can time
+    out or be cancelled, so the filters and PDF engines it started are killed
+    with it and don't keep its pipes open.
+    """
+    if isinstance(process, _SpawnedProcess):
+        # the spawn server kills the process group
+        process.kill()
+        return
+    try:
+        if hasattr(os, "killpg") and os.getpgid(process.pid) == process.pid:
+            os.killpg(process.pid, signal.SIGKILL)
+            return
+        process.kill()
+    except OSError:
+        # the process exited in the meantime
+        pass
+
+
+__supervisor = _Supervisor()
+
+
+def _communicate(process, input=None, timeout=None) -> Future:
+    """Hand `process` over to the supervisor, see :meth:`_Supervisor.communicate`."""
+    return __supervisor.communicate(process, input, timeout)
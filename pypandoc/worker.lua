@@ -0,0 +1,82 @@
+-- Long-lived pypandoc conversion worker, run with `pandoc lua worker.lua`.
+--
+-- Requests are read from stdin as frames of
+--   "<options length> <text length>\n<options as JSON><text>"
+-- and answered on stdout with frames of
+--   "<status> <length>\n<body>"
+-- where status is "ok" (body is the converted document) or "error" (body is
+-- the error message). The first frame written is a "ready" frame whose body
+-- describes the capabilities of the worker.
+
+local templates = {}
+
+local function send(status, body)
+  io.stdout:write(status, " ", #body, "\n", body)
+  io.stdout:flush()
+end
+
+-- Whether readers can be run in a sandbox (the read_env argument of
+-- pandoc.read): a file outside of it must not be readable.
+local function can_sandbox()
+  return pandoc.system.with_temporary_directory("pypandoc", function (dir)
+    local path = pandoc.path.join({dir, "outside.txt"})
+    local file = io.open(path, "w")
+    file:write("outside")
+    file:close()
+    local ok, doc = pcall(pandoc.read, ".. include:: " .. path, "rst", {}, {})
+    return ok and not pandoc.write(doc, "plain"):find("outside")
+  end)
+end
+
+local function convert(request, text)
+  -- an empty list of files: the reader can't read any
+  local read_env = request.sandbox and {} or nil
+  local doc = pandoc.read(
+    text, request.from, request.reader_options or {}, read_env
+  )
+  for key, value in pairs(request.metadata or {}) do
+    doc.meta[key] = value
+  end
+  -- lua filters expect the output format in FORMAT
+  FORMAT = request.to_base
+  for _, filter in ipairs(request.filters or {}) do
+    doc = pandoc.utils.run_lua_filter(doc, filter)
+  end
+  local writer_options = request.writer_options or {}
+  if request.standalone then
+    if templates[request.to_base] == nil then
+      templates[request.to_base] =
+        pandoc.template.compile(pandoc.template.default(request.to_base))
+    end
+    writer_options.template = templates[request.to_base]
+  end
+  local output = pandoc.write(doc, request.to, writer_options)
+  -- like the pandoc command line, end the output with a newline
+  if output:sub(-1) ~= "\n" then
+    output = output .. "\n"
+  end
+  return output
+end
+
+io.stdout:setvbuf("full")
+send("ready", pandoc.json.encode({
+  version = tostring(PANDOC_VERSION),
+  lua_filters = pandoc.utils.run_lua_filter ~= nil,
+  sandbox = can_sandbox(),
+}))
+
+while true do
+  local header = io.stdin:read("l")
+  if header == nil then
+    break
+  end
+  local options_length, text_length = header:match("^(%d+) (%d+)$")
+  local request = pandoc.json.decode(io.stdin:read(tonumber(options_length)), false)
+  local text = io.stdin:read(tonumber(text_length)) or ""
+  local ok, result = pcall(convert, request, text)
+  if ok then
+    send("ok", result)
+  else
+    send("error", tostring(result))
+  end
+end
@@ -0,0 +1,130 @@
+import os
+import tempfile
+import textwrap
+import threading
+import unittest
+
+import pypandoc
+from pypandoc.lua_worker import LuaWorkerPool, _get_shared_pool, _worker_request
+
+
+class TestWorkerRequest(unittest.TestCase):
+    def test_translates_supported_arguments(self):
+        request = _worker_request(
+            "html",
+            "markdown",
+            ["-s", "--wrap=none", "--toc-depth", "2", "-V", "lang=en", "-M", "x"],
+            None,
+        )
+        self.assertEqual(
+            request,
+            {
+                "from": "markdown",
+                "to": "html",
+                "to_base": "html",
+                "filters": [],
+                "standalone": True,
+                "writer_options": {
+                    "wrap_text": "wrap-none",
+                    "toc_depth": 2,
+                    "variables": {"lang": "en"},
+                },
+                "metadata": {"x": True},
+            },
+        )
+
+    def test_rejects_unsupported_arguments(self):
+        self.assertIsNone(_worker_request("html", "md", ["--eol=lf"], None))
+        self.assertIsNone(_worker_request("html", "md", ["--wrap=all"], None))
+        self.assertIsNone(_worker_request("html", "md", [], ["pandoc-citeproc"]))
+
+
+class TestLuaWorkerPool(unittest.TestCase):
+    def setUp(self):
+        if _get_shared_pool() is None:
+            self.skipTest("pandoc can't run pandoc lua workers")
+
+    def test_same_output_as_subprocess(self):
+        lua_source = textwrap.dedent(
+            """\
+            function Strong(elem)
+                return pandoc.SmallCaps(elem.c)
+            end
+            """
+        )
+        with tempfile.NamedTemporaryFile("w", suffix=".lua", delete=False) as f:
+            f.write(lua_source)
+        try:
+            for extra_args, filters in (
+                ([], None),
+                (["--standalone", "-M", "title=Some title"], None),
+                (["--wrap=none"], [f.name]),
+            ):
+                expected = pypandoc.convert_text(
+                    "# some **title**\n",
+                    "html",
+                    format="md",
+                    extra_args=extra_args,
+                    filters=filters,
+                )
+                received = pypandoc.convert_text(
+                    "# some **title**\n",
+                    "html",
+                    format="md",
+                    extra_args=extra_args,
+                    filters=filters,
+                    backend="lua",
+                )
+                self.assertEqual(expected, received)
+        finally:
+            os.remove(f.name)
+
+    def test_workers_are_reused_and_replaced(self):
+        with LuaWorkerPool(size=2, max_jobs=3) as pool:
+            results = []
+
+            def convert():
+                for _ in range(5):
+                    results.append(pool.convert_text("*a*", "html", format="md"))
+
+            threads = [threading.Thread(target=convert) for _ in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual(results, ["<p><em>a</em></p>\n"] * 20)
+            self.assertLessEqual(pool._started, 2)
+
+            with self.assertRaisesRegex(RuntimeError, "Unknown input format"):
+                pool.convert_text("ok", "html", format="invalid")
+            # a failed conversion doesn't break the worker
+            self.assertEqual(
+                pool.convert_text("ok", "html", format="md"), "<p>ok</p>\n"
+            )
+
+    def test_sandbox(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+            f.write("secret-content")
+        self.addCleanup(os.remove, f.name)
+        source = ".. include:: %s\n" % f.name
+        expected = pypandoc.convert_text(source, "html", "rst", sandbox=True)
+        received = pypandoc.convert_text(
+            source, "html", "rst", sandbox=True, backend="lua"
+        )
+        self.assertNotIn("secret-content", received)
+        self.assertEqual(expected, received)
+        # without the sandbox the file is read
+        received = pypandoc.convert_text(source, "html", "rst", backend="lua")
+        self.assertIn("secret-content", received)
+
+    def test_closed_pool(self):
+        pool = LuaWorkerPool(size=1)
+        pool.convert_text("ok", "html", format="md")
+        pool.close()
+        self.assertEqual(pool._started, 0)
+        with self.assertRaisesRegex(RuntimeError, "closed"):
+            pool.convert_text("ok", "html", format="md")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,22 +1,33 @@
 #!/usr/bin/env python
 
+import asyncio
 import contextlib
 import io
+import json
 import logging
+import mmap
 import os
 import re
 import shutil
+import signal
+import socket
 import subprocess
 import sys
 import tempfile
 import textwrap
+import threading
+import time
 import unittest
 import warnings
+import zlib
+from concurrent.futures import CancelledError, ThreadPoolExecutor
 from pathlib import Path
+from unittest.mock import patch
 from urllib.parse import urljoin
 from urllib.request import pathname2url
 
 import pypandoc
+from pypandoc.result_cache import _get_file_options
 
 
 def _has_tinytex():
@@ -63,6 +74,18 @@ def closed_tempfile(suffix, text=None, dir_name=None, prefix=None):
             os.remove(file_name)
 
 
+# a Lua filter which keeps pandoc busy for a second
+SLOW_LUA_FILTER = textwrap.dedent(
+    """\
+    function Pandoc(doc)
+        local start = os.clock()
+        while os.clock() - start < 1 do end
+        return doc
+    end
+    """
+)
+
+
 # Stolen from pandas
 def is_list_like(arg):
     return hasattr(arg, "__iter__") and not isinstance(arg, str)
@@ -165,6 +188,138 @@ class TestPypandoc(unittest.TestCase):
         self.assertTrue("twiki" in inputs)
         self.assertTrue("markdown" in outputs)
 
+    def test_get_pandoc_formats_is_cached(self):
+        pypandoc.clean_pandocpath_cache()
+        self.assertEqual(
+            pypandoc.get_pandoc_formats_cache_info(), pypandoc.CacheInfo(0, 0, 0)
+        )
+        first = pypandoc.get_pandoc_formats()
+        first[0].append("not-a-format")
+        self.assertEqual(pypandoc.get_pandoc_formats_cache_info().misses, 1)
+
+        with patch("pypandoc.subprocess.Popen", wraps=subprocess.Popen) as popen:
+            inputs, _ = pypandoc.get_pandoc_formats()
+            self.assertEqual(popen.call_count, 0)
+            self.assertNotIn("not-a-format", inputs)
+            # steady state conversions only start the pandoc doing the work
+            pypandoc.convert_text("ok", format="md", to="rest")
+            self.assertEqual(popen.call_count, 1)
+        self.assertEqual(
+            pypandoc.get_pandoc_formats_cache_info(), pypandoc.CacheInfo(2, 1, 1)
+        )
+
+    def test_probe_cache_spares_probing_in_new_processes(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            with patch.dict(os.environ, {"PYPANDOC_CACHE_DIR": cache_dir}):
+                pypandoc.clean_pandocpath_cache()
+                pypandoc.clean_version_cache()
+                version = pypandoc.get_pandoc_version()
+                pypandoc.get_pandoc_formats()
+                self.assertTrue(os.path.exists(os.path.join(cache_dir, "probe.json")))
+
+                # simulate a fresh process: only the in-memory caches are gone
+                pypandoc.clean_pandocpath_cache()
+                pypandoc.clean_version_cache()
+                with patch(
+                    "pypandoc.subprocess.Popen", wraps=subprocess.Popen
+                ) as popen:
+                    pypandoc.convert_text("ok", format="md", to="rest")
+                    self.assertEqual(pypandoc.get_pandoc_version(), version)
+                    self.assertEqual(popen.call_count, 1)
+        finally:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+            pypandoc.clean_pandocpath_cache()
+            pypandoc.clean_version_cache()
+
+    def test_probe_cache_updates_from_processes_are_kept(self):
+        script = textwrap.dedent(
+            """
+            import sys
+            from pypandoc.probe_cache import _update
+            for i in range(6):
+                _update("discovery", "%s-%d" % (sys.argv[1], i), {"path": "p"})
+            """
+        )
+        package_dir = os.path.dirname(os.path.dirname(pypandoc.__file__))
+        with tempfile.TemporaryDirectory() as cache_dir:
+            env = dict(os.environ, PYTHONPATH=package_dir, PYPANDOC_CACHE_DIR=cache_dir)
+            processes = [
+                subprocess.Popen([sys.executable, "-c", script, str(n)], env=env)
+                for n in range(4)
+            ]
+            for process in processes:
+                self.assertEqual(process.wait(), 0)
+            with open(os.path.join(cache_dir, "probe.json")) as f:
+                entries = json.load(f)["discovery"]
+        self.assertEqual(
+            sorted(entries),
+            sorted("%d-%d" % (n, i) for n in range(4) for i in range(6)),
+        )
+
+    @unittest.skipIf(sys.platform == "win32", "uses POSIX executable bits")
+    def test_pandoc_path_prefers_highest_version(self):
+        tmp_dir = tempfile.mkdtemp()
+        old, new = os.path.join(tmp_dir, "old"), os.path.join(tmp_dir, "new")
+        for name in (old, new):
+            with open(name, "w") as f:
+                f.write("#!/bin/sh\n")
+            os.chmod(name, 0o755)
+        missing = os.path.join(tmp_dir, "missing")
+        versions = {old: "2.19.2", new: "3.1"}
+        try:
+            with patch.dict(os.environ, {"PYPANDOC_PROBE_CACHE": "0"}), patch(
+                "pypandoc._get_pandoc_search_paths", return_value=[old, missing, new]
+            ), patch(
+                "pypandoc._get_pandoc_version", side_effect=versions.__getitem__
+            ) as get_version:
+                pypandoc.clean_pandocpath_cache()
+                self.assertEqual(pypandoc.get_pandoc_path(), new)
+                # missing candidates are skipped without starting pandoc
+                self.assertEqual(
+                    sorted(c.args[0] for c in get_version.call_args_list), [new, old]
+                )
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            pypandoc.clean_pandocpath_cache()
+
+    @unittest.skipIf(sys.platform == "win32", "uses POSIX executable bits")
+    def test_pandoc_not_found_is_cached(self):
+        tmp_dir = tempfile.mkdtemp()
+        candidate = os.path.join(tmp_dir, "pandoc")
+        try:
+            with patch.dict(os.environ, {"PYPANDOC_PROBE_CACHE": "0"}), patch(
+                "pypandoc._get_pandoc_search_paths", return_value=[candidate]
+            ), patch("pypandoc._get_pandoc_version", return_value="3.1"), patch(
+                "pypandoc._probe_pandoc_versions",
+                wraps=pypandoc._probe_pandoc_versions,
+            ) as probe:
+                pypandoc.clean_pandocpath_cache()
+                for _ in range(3):
+                    with self.assertRaisesRegex(OSError, "No pandoc was found"):
+                        pypandoc.get_pandoc_path()
+                self.assertEqual(probe.call_count, 1)
+
+                # installing pandoc is noticed right away
+                with open(candidate, "w") as f:
+                    f.write("#!/bin/sh\n")
+                os.chmod(candidate, 0o755)
+                self.assertEqual(pypandoc.get_pandoc_path(), candidate)
+                self.assertEqual(probe.call_count, 2)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            pypandoc.clean_pandocpath_cache()
+
+    def test_invalid_not_found_ttl(self):
+        with patch.dict(os.environ, {"PYPANDOC_NOT_FOUND_TTL": "5m"}):
+            with self.assertLogs("pypandoc", "WARNING") as logs:
+                self.assertEqual(
+                    pypandoc._get_not_found_ttl(), pypandoc._PANDOC_NOT_FOUND_TTL
+                )
+        self.assertIn("PYPANDOC_NOT_FOUND_TTL='5m'", logs.output[0])
+        with patch.dict(os.environ, {"PYPANDOC_NOT_FOUND_TTL": "0.5"}):
+            self.assertEqual(pypandoc._get_not_found_ttl(), 0.5)
+
     def test_get_pandoc_version(self):
         assert "HOME" in os.environ, "No HOME set, this will error..."
         version = pypandoc.get_pandoc_version()
@@ -811,6 +966,1590 @@ class TestPypandoc(unittest.TestCase):
         self.assertEqual(expected.rstrip("\n"), received.rstrip("\n"))
 
 
+class TestThreads(unittest.TestCase):
+    def test_concurrent_conversions_in_different_workdirs(self):
+        def convert(workdir, i):
+            pypandoc.convert_text(
+                "*%d*" % i, "html", "md", outputfile="out.html", cworkdir=workdir
+            )
+            with open(os.path.join(workdir, "out.html")) as f:
+                return f.read()
+
+        with contextlib.ExitStack() as stack:
+            workdirs = [
+                stack.enter_context(tempfile.TemporaryDirectory()) for _ in range(8)
+            ]
+            cwd = os.getcwd()
+            # the working directory of the process must never change
+            with patch("pypandoc.os.chdir", side_effect=AssertionError("chdir")):
+                with ThreadPoolExecutor(len(workdirs)) as executor:
+                    futures = [
+                        executor.submit(convert, workdir, i)
+                        for i in range(5)
+                        for workdir in workdirs
+                    ]
+                    received = [future.result() for future in futures]
+            self.assertEqual(os.getcwd(), cwd)
+        expected = ["<p><em>%d</em></p>" % i for i in range(5) for _ in workdirs]
+        self.assertEqual([r.strip() for r in received], expected)
+
+    def test_pandoc_is_looked_up_once(self):
+        pandoc_path = pypandoc.get_pandoc_path()
+        pypandoc.clean_pandocpath_cache()
+        pypandoc.clean_version_cache()
+        barrier = threading.Barrier(8)
+
+        def lookup():
+            barrier.wait()
+            return pypandoc.get_pandoc_path(), pypandoc.get_pandoc_version()
+
+        with patch(
+            "pypandoc._find_pandoc_path", return_value=pandoc_path
+        ) as find_pandoc_path, patch(
+            "pypandoc._get_pandoc_version", wraps=pypandoc._get_pandoc_version
+        ) as get_version, patch(
+            "pypandoc._get_binary_info", return_value=None
+        ):
+            with ThreadPoolExecutor(8) as executor:
+                received = set(executor.map(lambda _: lookup(), range(8)))
+        self.assertEqual(find_pandoc_path.call_count, 1)
+        self.assertEqual(get_version.call_count, 1)
+        self.assertEqual(len(received), 1)
+        self.assertEqual(received.pop()[0], pandoc_path)
+
+
+class TestBatch(unittest.TestCase):
+    def test_convert_many(self):
+        sources = ["*%d*" % i for i in range(10)]
+        results = pypandoc.convert_many(sources, "html", "md", max_workers=3)
+        self.assertEqual([r.index for r in results], list(range(10)))
+        self.assertEqual(
+            [r.output for r in results], ["<p><em>%d</em></p>\n" % i for i in range(10)]
+        )
+        self.assertTrue(all(r.error is None for r in results))
+
+    def test_failures_are_returned(self):
+        valid = pypandoc.convert_text("some title", "json", "md")
+        results = pypandoc.convert_many([valid, "no json", valid], "html", "json")
+        self.assertEqual([r.output for r in results][::2], ["<p>some title</p>\n"] * 2)
+        self.assertIsNone(results[1].output)
+        self.assertIsInstance(results[1].error, RuntimeError)
+
+    def test_invalid_sources_are_returned(self):
+        results = pypandoc.convert_many(["*a*", 5, "*b*"], "html", "md")
+        self.assertEqual([r.index for r in results], [0, 1, 2])
+        self.assertEqual(
+            [r.output for r in results],
+            ["<p><em>a</em></p>\n", None, "<p><em>b</em></p>\n"],
+        )
+        self.assertRegex(str(results[1].error), "Invalid source")
+
+    def test_imap_convert_unordered(self):
+        sources = ["*%d*" % i for i in range(10)]
+        results = pypandoc.imap_convert(sources, "html", "md", ordered=False)
+        received = {r.index: r.output for r in results}
+        self.assertEqual(received, {i: "<p><em>%d</em></p>\n" % i for i in range(10)})
+
+    def test_imap_convert_is_lazy(self):
+        consumed = []
+
+        def sources():
+            for i in range(1000):
+                consumed.append(i)
+                yield "*%d*" % i
+
+        results = pypandoc.imap_convert(sources(), "html", "md", max_workers=2)
+        self.assertEqual(next(results).output, "<p><em>0</em></p>\n")
+        self.assertLessEqual(len(consumed), 5)
+        results.close()
+        self.assertLess(len(consumed), 1000)
+
+    def test_invalid_format(self):
+        with self.assertRaisesRegex(RuntimeError, "Invalid input format"):
+            pypandoc.convert_many(["ok"], "html", "invalid")
+
+
+class TestReturnBytes(unittest.TestCase):
+    def test_text_formats(self):
+        received = pypandoc.convert_text("# äöü\n", "html", "md", return_bytes=True)
+        expected = pypandoc.convert_text("# äöü\n", "html", "md")
+        self.assertEqual(received, expected.encode("utf-8"))
+
+    def test_binary_formats(self):
+        for to in ("docx", "odt", "epub"):
+            received = pypandoc.convert_text(
+                "# some title\n", to, "md", return_bytes=True
+            )
+            self.assertTrue(received.startswith(b"PK"), to)
+            self.assertIn("some title", pypandoc.convert_text(received, "md", to))
+
+    def test_convert_file(self):
+        with closed_tempfile(".md", text="# some title\n") as file_name:
+            received = pypandoc.convert_file(file_name, "docx", return_bytes=True)
+        self.assertTrue(received.startswith(b"PK"))
+
+    def test_outputfile_is_rejected(self):
+        with self.assertRaisesRegex(
+            RuntimeError, "return_bytes and sink can't be used"
+        ):
+            pypandoc.convert_text(
+                "ok", "docx", "md", outputfile="out.docx", return_bytes=True
+            )
+
+    @unittest.skipIf(sys.platform == "win32", "uses a shell script as pdf engine")
+    def test_pdf(self):
+        # a fake pdf engine, which writes to the output file pandoc gives it
+        engine_source = (
+            "#!/bin/sh\nfor last; do :; done\nprintf '%%PDF-1' > \"$last\"\n"
+        )
+        with tempfile.TemporaryDirectory() as tempdir:
+            engine = os.path.join(tempdir, "weasyprint")
+            with open(engine, "w") as f:
+                f.write(engine_source)
+            os.chmod(engine, 0o755)
+            args = ["--pdf-engine=" + engine]
+            received = pypandoc.convert_text(
+                "# title", "pdf", "md", extra_args=args, return_bytes=True
+            )
+            self.assertEqual(received, b"%PDF-1")
+
+
+class TestSink(unittest.TestCase):
+    source = "# some title\n\nSome *text* äöü.\n"
+
+    def setUp(self):
+        self.expected = pypandoc.convert_text(self.source, "html", "md")
+
+    def test_file_with_file_descriptor(self):
+        with tempfile.TemporaryFile() as f:
+            f.write(b"header\n")
+            received = pypandoc.convert_text(self.source, "html", "md", sink=f)
+            self.assertEqual(received, "")
+            f.write(b"footer\n")
+            f.seek(0)
+            self.assertEqual(
+                f.read().decode("utf-8"), "header\n" + self.expected + "footer\n"
+            )
+
+    def test_file_descriptor(self):
+        with tempfile.TemporaryFile() as f:
+            pypandoc.convert_text(self.source, "html", "md", sink=f.fileno())
+            f.seek(0)
+            self.assertEqual(f.read().decode("utf-8"), self.expected)
+
+    def test_file_objects_without_file_descriptor(self):
+        sink = io.BytesIO()
+        pypandoc.convert_text(self.source, "html", "md", sink=sink)
+        self.assertEqual(sink.getvalue().decode("utf-8"), self.expected)
+        sink = io.StringIO()
+        pypandoc.convert_text(self.source, "html", "md", sink=sink)
+        self.assertEqual(sink.getvalue(), self.expected)
+
+    def test_text_file(self):
+        with closed_tempfile(".html") as file_name:
+            with open(file_name, "w", encoding="latin-1") as f:
+                pypandoc.convert_text(self.source, "html", "md", sink=f)
+            with open(file_name, encoding="latin-1") as f:
+                self.assertEqual(f.read(), self.expected)
+
+    def test_binary_formats(self):
+        sink = io.BytesIO()
+        with closed_tempfile(".md", text=self.source) as file_name:
+            pypandoc.convert_file(file_name, "docx", sink=sink)
+        self.assertTrue(sink.getvalue().startswith(b"PK"))
+
+    def test_errors(self):
+        with self.assertRaisesRegex(RuntimeError, "Pandoc died with exitcode"):
+            pypandoc.convert_text(
+                "ok", "html", "md", extra_args=["--x"], sink=io.BytesIO()
+            )
+
+
+class TestResultCache(unittest.TestCase):
+    source = "# some title\n\nSome *text*.\n"
+
+    def setUp(self):
+        self.cache = pypandoc.ResultCache()
+        pypandoc.set_result_cache(self.cache)
+        self.addCleanup(pypandoc.set_result_cache, None)
+
+    def test_hit_does_not_start_pandoc(self):
+        expected = pypandoc.convert_text(self.source, "html", "md")
+        with patch("pypandoc.subprocess.Popen") as popen:
+            received = pypandoc.convert_text(self.source, "html", "md")
+        popen.assert_not_called()
+        self.assertEqual(received, expected)
+        info = self.cache.cache_info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (1, 1, 1))
+        self.assertEqual(info.currbytes, sys.getsizeof(expected))
+
+    def test_key_covers_arguments_and_source(self):
+        pypandoc.convert_text(self.source, "html", "md")
+        pypandoc.convert_text(self.source, "html", "md", extra_args=["-s"])
+        pypandoc.convert_text(self.source, "latex", "md")
+        pypandoc.convert_text(self.source + "more\n", "html", "md")
+        self.assertEqual(
+            pypandoc.convert_text(self.source, "html", "md", return_bytes=True)[:4],
+            b"<h1 ",
+        )
+        info = self.cache.cache_info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (0, 5, 5))
+
+    def test_changed_filter_is_not_hit(self):
+        with closed_tempfile(".lua") as file_name:
+            with open(file_name, "w") as f:
+                f.write("function Str(s) return pandoc.Str('a') end\n")
+            args = ["--lua-filter", file_name]
+            received = pypandoc.convert_text("x", "plain", "md", extra_args=args)
+            self.assertEqual(received.strip(), "a")
+            with open(file_name, "w") as f:
+                f.write("function Str(s) return pandoc.Str('bb') end\n")
+            received = pypandoc.convert_text("x", "plain", "md", extra_args=args)
+            self.assertEqual(received.strip(), "bb")
+        self.assertEqual(self.cache.cache_info().hits, 0)
+
+    def test_changed_include_is_not_hit(self):
+        with closed_tempfile(".html") as file_name:
+            for args in (["-H" + file_name], ["-CH", file_name]):
+                for content in ("<meta name=a>", "<meta name=bb>"):
+                    with open(file_name, "w") as f:
+                        f.write(content)
+                    received = pypandoc.convert_text(
+                        "x", "html", "md", extra_args=["-s"] + args
+                    )
+                    self.assertIn(content, received)
+        self.assertEqual(self.cache.cache_info().hits, 0)
+
+    def test_file_options(self):
+        self.assertEqual(
+            _get_file_options(
+                [
+                    "-s",
+                    "-Hh.html",
+                    "-Vx=-Ay.html",
+                    "-M",
+                    "-dz.yaml",
+                    "-Cd",
+                    "d.yaml",
+                    "--templ=t.html",
+                    "--lua-filter",
+                    "f.lua",
+                    "--include",
+                    "x.html",
+                    "-sBb.html",
+                    "-",
+                ]
+            ),
+            [
+                ("-H", "h.html"),
+                ("-d", "d.yaml"),
+                ("--template", "t.html"),
+                ("--lua-filter", "f.lua"),
+            ],
+        )
+
+    def test_outputs_to_files_are_not_cached(self):
+        with closed_tempfile(".html") as file_name:
+            for _ in range(2):
+                pypandoc.convert_text(self.source, "html", "md", outputfile=file_name)
+        pypandoc.convert_text(self.source, "html", "md", sink=io.BytesIO())
+        self.assertEqual(self.cache.cache_info(), (0, 0, 0, 0, 0))
+
+    def test_eviction(self):
+        pypandoc.set_result_cache(pypandoc.ResultCache(maxsize=2))
+        cache = pypandoc.get_result_cache()
+        for text in ("a", "b", "a", "c", "a", "b"):
+            pypandoc.convert_text(text, "html", "md")
+        info = cache.cache_info()
+        self.assertEqual(
+            (info.hits, info.misses, info.evictions, info.currsize), (2, 4, 2, 2)
+        )
+
+    def test_too_big_results_are_not_cached(self):
+        pypandoc.set_result_cache(pypandoc.ResultCache(max_bytes=10))
+        pypandoc.convert_text(self.source, "html", "md")
+        self.assertEqual(pypandoc.get_result_cache().cache_info().currsize, 0)
+
+    def test_threads(self):
+        sources = ["text %d" % (i % 4) for i in range(32)]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            received = list(
+                executor.map(lambda s: pypandoc.convert_text(s, "html", "md"), sources)
+            )
+        self.assertEqual(received, ["<p>%s</p>\n" % s for s in sources])
+        info = self.cache.cache_info()
+        self.assertEqual(info.hits + info.misses, 32)
+        self.assertEqual(info.currsize, 4)
+
+
+class TestDiskResultCache(unittest.TestCase):
+    source = "# some title\n\nSome *text*.\n"
+
+    def setUp(self):
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        self.directory = tempdir.name
+        self.addCleanup(pypandoc.set_result_cache, None)
+
+    def set_cache(self, **kwargs):
+        cache = pypandoc.DiskResultCache(self.directory, **kwargs)
+        pypandoc.set_result_cache(cache)
+        return cache
+
+    def test_shared_by_instances(self):
+        self.set_cache()
+        expected = pypandoc.convert_text(self.source, "html", "md")
+        docx = pypandoc.convert_text(self.source, "docx", "md", return_bytes=True)
+        cache = self.set_cache()
+        with patch("pypandoc.subprocess.Popen") as popen:
+            self.assertEqual(pypandoc.convert_text(self.source, "html", "md"), expected)
+            received = pypandoc.convert_text(
+                self.source, "docx", "md", return_bytes=True
+            )
+        popen.assert_not_called()
+        self.assertEqual(received, docx)
+        info = cache.cache_info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (2, 0, 2))
+
+    def test_shared_by_processes(self):
+        script = textwrap.dedent(
+            """
+            import sys
+            import pypandoc
+            cache = pypandoc.DiskResultCache(sys.argv[1])
+            pypandoc.set_result_cache(cache)
+            for i in range(8):
+                pypandoc.convert_text("text %d" % i, "html", "md")
+            """
+        )
+        package_dir = os.path.dirname(os.path.dirname(pypandoc.__file__))
+        env = dict(os.environ, PYTHONPATH=package_dir)
+        processes = [
+            subprocess.Popen([sys.executable, "-c", script, self.directory], env=env)
+            for _ in range(4)
+        ]
+        for process in processes:
+            self.assertEqual(process.wait(), 0)
+        cache = self.set_cache()
+        self.assertEqual(cache.cache_info().currsize, 8)
+        with patch("pypandoc.subprocess.Popen") as popen:
+            for i in range(8):
+                received = pypandoc.convert_text("text %d" % i, "html", "md")
+                self.assertEqual(received, "<p>text %d</p>\n" % i)
+        popen.assert_not_called()
+
+    def test_least_recently_used_are_evicted(self):
+        cache = self.set_cache()
+        cache.put("a" * 64, "a" * 1000)
+        cache.put("b" * 64, "b" * 1000)
+        os.utime(cache._get_path("a" * 64), (0, 0))
+        os.utime(cache._get_path("b" * 64), (1, 1))
+        self.assertEqual(cache.get("a" * 64), "a" * 1000)
+        cache.max_bytes = 2100
+        cache.put("c" * 64, "c" * 1000)
+        self.assertIsNone(cache.get("b" * 64))
+        self.assertEqual(cache.get("a" * 64), "a" * 1000)
+        self.assertEqual(cache.get("c" * 64), "c" * 1000)
+        self.assertEqual(cache.cache_info().evictions, 1)
+
+    def test_ttl(self):
+        cache = self.set_cache(ttl=0)
+        pypandoc.convert_text(self.source, "html", "md")
+        pypandoc.convert_text(self.source, "html", "md")
+        self.assertEqual(cache.cache_info().hits, 0)
+
+    def test_ttl_counts_from_storing(self):
+        # a result stored long ago but used recently is expired for get() and
+        # for pruning alike
+        cache = self.set_cache(ttl=60)
+        with patch("pypandoc.result_cache.time.time", return_value=time.time() - 100):
+            cache.put("a" * 64, "old")
+        cache.put("b" * 64, "new")
+        os.utime(cache._get_path("a" * 64))
+        cache._prune()
+        self.assertFalse(os.path.exists(cache._get_path("a" * 64)))
+        self.assertEqual(cache.get("b" * 64), "new")
+        self.assertEqual(cache.cache_info().evictions, 1)
+
+    def test_invalid_entries_are_misses(self):
+        cache = self.set_cache()
+        os.makedirs(os.path.dirname(cache._get_path("a" * 64)))
+        with open(cache._get_path("a" * 64), "wb") as f:
+            f.write(b"PPR")
+        self.assertIsNone(cache.get("a" * 64))
+        self.assertIsNone(cache.get("b" * 64))
+        self.assertEqual(cache.cache_info().misses, 2)
+
+    def test_clear_and_stale_temporary_files(self):
+        cache = self.set_cache()
+        cache.put("a" * 64, b"a")
+        tmp_name = os.path.join(os.path.dirname(cache._get_path("a" * 64)), "x.tmp")
+        open(tmp_name, "w").close()
+        os.utime(tmp_name, (0, 0))
+        cache.clear()
+        self.assertEqual(cache.cache_info(), (0, 0, 0, 0, 0))
+        self.assertFalse(os.path.exists(tmp_name))
+
+
+class TestSingleFlight(unittest.TestCase):
+    source = "# some title\n\nSome *text*.\n"
+
+    def setUp(self):
+        # only conversions with cached results are shared
+        pypandoc.set_result_cache(pypandoc.ResultCache())
+        self.addCleanup(pypandoc.set_result_cache, None)
+
+    def patch_run_pandoc(self, delay=0.5, error=None):
+        """Count the pandoc runs, which take at least `delay` seconds."""
+        run_pandoc = pypandoc._run_pandoc
+        calls = []
+
+        def wrapper(conversion):
+            calls.append(conversion)
+            time.sleep(delay)
+            if error is not None:
+                raise error
+            return run_pandoc(conversion)
+
+        patcher = patch("pypandoc._run_pandoc", wrapper)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return calls
+
+    def convert_in_threads(self, sources):
+        def convert(source):
+            try:
+                return pypandoc.convert_text(source, "html", "md")
+            except RuntimeError as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=len(sources)) as executor:
+            return list(executor.map(convert, sources))
+
+    def test_identical_conversions_run_once(self):
+        calls = self.patch_run_pandoc()
+        received = self.convert_in_threads([self.source] * 8)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(set(received)), 1)
+        self.assertIn("some title", received[0])
+        # the next conversion is a cache hit
+        pypandoc.convert_text(self.source, "html", "md")
+        self.assertEqual(len(calls), 1)
+
+    def test_not_shared_without_a_result_cache(self):
+        pypandoc.set_result_cache(None)
+        calls = self.patch_run_pandoc()
+        self.convert_in_threads([self.source] * 4)
+        self.assertEqual(len(calls), 4)
+
+    def test_different_conversions_run_separately(self):
+        calls = self.patch_run_pandoc()
+        received = self.convert_in_threads(["a", "b", "a", "b"])
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(received, ["<p>a</p>\n", "<p>b</p>\n"] * 2)
+
+    def test_waiters_receive_the_exception(self):
+        error = RuntimeError("Pandoc died with exitcode 1")
+        calls = self.patch_run_pandoc(error=error)
+        received = self.convert_in_threads([self.source] * 4)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(received, [error] * 4)
+
+    def test_waiters_dont_share_the_timeout(self):
+        with closed_tempfile(".lua", SLOW_LUA_FILTER) as filter_name:
+            with ThreadPoolExecutor(2) as executor:
+                leader = executor.submit(
+                    pypandoc.convert_text,
+                    self.source,
+                    "html",
+                    "md",
+                    filters=[filter_name],
+                    timeout=0.3,
+                )
+                time.sleep(0.1)
+                waiter = executor.submit(
+                    pypandoc.convert_text,
+                    self.source,
+                    "html",
+                    "md",
+                    filters=[filter_name],
+                )
+                with self.assertRaises(pypandoc.ConversionTimeoutError):
+                    leader.result()
+                # the waiter ran the conversion itself
+                self.assertIn("some title", waiter.result())
+
+    def test_waiters_check_their_timeout(self):
+        with closed_tempfile(".lua", SLOW_LUA_FILTER) as filter_name:
+            with ThreadPoolExecutor(2) as executor:
+                leader = executor.submit(
+                    pypandoc.convert_text,
+                    self.source,
+                    "html",
+                    "md",
+                    filters=[filter_name],
+                )
+                time.sleep(0.1)
+                waiter = executor.submit(
+                    pypandoc.convert_text,
+                    self.source,
+                    "html",
+                    "md",
+                    filters=[filter_name],
+                    timeout=0.2,
+                )
+                with self.assertRaises(pypandoc.ConversionTimeoutError):
+                    waiter.result(0.5)
+                self.assertFalse(leader.done())
+                self.assertIn("some title", leader.result())
+
+    def test_sync_conversion_on_the_event_loop(self):
+        # an identical sync conversion on the loop's thread doesn't wait for
+        # the async one, which can only finish once the loop runs again
+        async def main():
+            with closed_tempfile(".lua", SLOW_LUA_FILTER) as filter_name:
+                task = asyncio.ensure_future(
+                    pypandoc.convert_text_async(
+                        self.source, "html", "md", filters=[filter_name]
+                    )
+                )
+                await asyncio.sleep(0.1)
+                received = pypandoc.convert_text(
+                    self.source, "html", "md", filters=[filter_name]
+                )
+                self.assertEqual(received, await task)
+
+        errors = []
+
+        def run():
+            try:
+                asyncio.run(main())
+            except BaseException as e:
+                errors.append(e)
+
+        # a daemon thread, so a hanging loop doesn't hang the tests as well
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        thread.join(30)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(errors, [])
+
+
+class TestMulti(unittest.TestCase):
+    source = "# some title\n\nSome *text* äöü.\n"
+
+    def test_same_outputs_as_single_conversions(self):
+        args = ["--shift-heading-level-by=1", "--standalone"]
+        received = pypandoc.convert_multi(
+            self.source, ["html", "latex", "docx"], "md", extra_args=args
+        )
+        self.assertEqual(list(received), ["html", "latex", "docx"])
+        for to in ("html", "latex"):
+            expected = pypandoc.convert_text(self.source, to, "md", extra_args=args)
+            self.assertEqual(received[to], expected)
+        self.assertIn("<h2", received["html"])
+        self.assertTrue(received["docx"].startswith(b"PK"))
+
+    def test_filters_run_once(self):
+        with closed_tempfile(".txt") as log, closed_tempfile(".lua") as lua_filter:
+            with open(lua_filter, "w") as f:
+                f.write(
+                    "function Pandoc(doc)\n"
+                    "  local f = io.open(%r, 'a')\n"
+                    "  f:write('run\\n')\n"
+                    "  f:close()\n"
+                    "end\n" % log
+                )
+            pypandoc.convert_multi(
+                self.source, ["html", "plain", "rst"], "md", filters=[lua_filter]
+            )
+            with open(log) as f:
+                self.assertEqual(f.read(), "run\n")
+
+    def test_outputfiles(self):
+        with closed_tempfile(".docx") as docx, closed_tempfile(".md") as source_file:
+            with open(source_file, "w", encoding="utf-8") as f:
+                f.write(self.source)
+            received = pypandoc.convert_file_multi(
+                source_file, ["html", "docx"], outputfiles={"docx": Path(docx)}
+            )
+            self.assertEqual(received["docx"], docx)
+            self.assertIn("some title", received["html"])
+            with open(docx, "rb") as f:
+                self.assertEqual(f.read(2), b"PK")
+
+    def test_invalid_format(self):
+        with self.assertRaisesRegex(RuntimeError, "Invalid output format"):
+            pypandoc.convert_multi(self.source, ["html", "invalid"], "md")
+
+    def test_cached_outputs_dont_read_the_source(self):
+        pypandoc.set_result_cache(pypandoc.ResultCache())
+        self.addCleanup(pypandoc.set_result_cache, None)
+        expected = pypandoc.convert_multi(self.source, ["html", "latex"], "md")
+        with patch("pypandoc.subprocess.Popen") as popen:
+            received = pypandoc.convert_multi(self.source, ["html", "latex"], "md")
+        popen.assert_not_called()
+        self.assertEqual(received, expected)
+        with patch("pypandoc._get_document", wraps=pypandoc._get_document) as read:
+            received = pypandoc.convert_multi(self.source, ["rst", "html"], "md")
+        read.assert_called_once()
+        self.assertEqual(received["html"], expected["html"])
+        self.assertIn("some title", received["rst"])
+
+    def test_writing_args(self):
+        self.assertEqual(
+            pypandoc._get_writing_args(
+                ["-s", "--filter", "f", "-Lx.lua", "--lua-filter=g.lua", "--citeproc"]
+                + ["--shift-heading-level-by", "1", "--toc", "-M", "a=b"]
+            ),
+            ["-s", "--toc", "-M", "a=b"],
+        )
+
+
+class TestAstCache(unittest.TestCase):
+    source = "# some title\n\nSome *text* äöü.\n"
+
+    def setUp(self):
+        self.cache = pypandoc.ResultCache()
+        pypandoc.set_ast_cache(self.cache)
+        self.addCleanup(pypandoc.set_ast_cache, None)
+        run_pandoc = pypandoc._run_pandoc
+        self.runs = []
+
+        def wrapper(conversion):
+            self.runs.append(conversion.args[1:3])
+            return run_pandoc(conversion)
+
+        patcher = patch("pypandoc._run_pandoc", wrapper)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def convert_uncached(self, *args, **kwargs):
+        pypandoc.set_ast_cache(None)
+        try:
+            return pypandoc.convert_text(*args, **kwargs)
+        finally:
+            pypandoc.set_ast_cache(self.cache)
+
+    def test_later_conversions_write_the_cached_document(self):
+        html = pypandoc.convert_text(self.source, "html", "md")
+        self.assertEqual(
+            self.runs,
+            [["--from=markdown", "--to=json"], ["--from=json", "--to=html"]],
+        )
+        self.runs.clear()
+        latex = pypandoc.convert_text(self.source, "latex", "md", extra_args=["-s"])
+        self.assertEqual(self.runs, [["--from=json", "--to=latex"]])
+        self.assertEqual(html, self.convert_uncached(self.source, "html", "md"))
+        self.assertEqual(
+            latex,
+            self.convert_uncached(self.source, "latex", "md", extra_args=["-s"]),
+        )
+        info = self.cache.cache_info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (1, 1, 1))
+
+    def test_document_is_stored_compressed(self):
+        pypandoc.convert_text(self.source, "html", "md")
+        document = next(iter(self.cache._results.values()))
+        self.assertIn(b'"pandoc-api-version"', zlib.decompress(document))
+
+    def test_reading_options_are_part_of_the_key(self):
+        args = ["--shift-heading-level-by=1"]
+        pypandoc.convert_text(self.source, "html", "md")
+        received = pypandoc.convert_text(self.source, "html", "md", extra_args=args)
+        self.assertEqual(self.cache.cache_info().hits, 0)
+        # and not applied again when writing
+        self.assertEqual(
+            received, self.convert_uncached(self.source, "html", "md", extra_args=args)
+        )
+
+    def test_filters_run_once(self):
+        with closed_tempfile(".txt") as log, closed_tempfile(".lua") as lua_filter:
+            with open(lua_filter, "w") as f:
+                f.write(
+                    "function Pandoc(doc)\n"
+                    "  local f = io.open(%r, 'a')\n"
+                    "  f:write('run\\n')\n"
+                    "  f:close()\n"
+                    "end\n" % log
+                )
+            for to in ("html", "plain", "rst"):
+                pypandoc.convert_text(self.source, to, "md", filters=[lua_filter])
+            with open(log) as f:
+                self.assertEqual(f.read(), "run\n")
+
+    def test_outputs_to_files(self):
+        pypandoc.convert_text(self.source, "html", "md")
+        with closed_tempfile(".docx") as file_name:
+            pypandoc.convert_text(self.source, "docx", "md", outputfile=file_name)
+            with open(file_name, "rb") as f:
+                self.assertEqual(f.read(2), b"PK")
+        sink = io.StringIO()
+        pypandoc.convert_text(self.source, "plain", "md", sink=sink)
+        self.assertIn("some title", sink.getvalue())
+        self.assertEqual(self.cache.cache_info().hits, 2)
+
+    def test_reading_args(self):
+        self.assertEqual(
+            pypandoc._get_reading_args(
+                ["-s", "--template", "t.html", "-Vx=y", "--toc", "-o", "out.html"]
+                + ["--filter=f", "-M", "a=b", "--pdf-engine=xelatex"]
+            ),
+            ["--filter=f", "-M", "a=b"],
+        )
+
+
+def upper_case(key, value, format, meta):
+    if key == "Str":
+        return {"t": "Str", "c": value.upper()}
+
+
+def drop_emphasis(key, value, format, meta):
+    if key == "Emph":
+        return value
+
+
+def output_format(key, value, format, meta):
+    if key == "Str" and value == "FORMAT":
+        return {"t": "Str", "c": format}
+
+
+class TestPythonFilters(unittest.TestCase):
+    def test_filters_run_in_process(self):
+        with patch("pypandoc.subprocess.Popen", wraps=subprocess.Popen) as popen:
+            received = pypandoc.convert_text(
+                "some *text*", "html", "md", filters=[upper_case, drop_emphasis]
+            )
+        self.assertEqual(received, "<p>SOME TEXT</p>\n")
+        # read and write, no filter processes
+        self.assertEqual(popen.call_count, 2)
+
+    def test_order_of_mixed_filters(self):
+        with closed_tempfile(".lua") as to_format, closed_tempfile(".lua") as bang:
+            with open(to_format, "w") as f:
+                f.write(
+                    "function Str(s)\n"
+                    "  if s.text == 'X' then return pandoc.Str('FORMAT') end\n"
+                    "end\n"
+                )
+            with open(bang, "w") as f:
+                f.write("function Str(s) return pandoc.Str(s.text .. '!') end\n")
+            received = pypandoc.convert_text(
+                "x y",
+                "html",
+                "md",
+                filters=[upper_case, to_format, output_format, bang],
+            )
+            self.assertEqual(received, "<p>html! Y!</p>\n")
+            received = pypandoc.convert_text(
+                "x y", "html", "md", filters=[bang, upper_case]
+            )
+            self.assertEqual(received, "<p>X! Y!</p>\n")
+
+    def test_meta_and_deleting_elements(self):
+        def drop_strong(key, value, format, meta):
+            if key == "Strong" and meta["drop"]["c"]:
+                return []
+
+        received = pypandoc.convert_text(
+            "---\ndrop: true\n---\nsome **bold** text",
+            "plain",
+            "md",
+            filters=[drop_strong],
+        )
+        self.assertEqual(received.split(), ["some", "text"])
+
+    def test_other_functions(self):
+        with closed_tempfile(".md", text="# some title\n") as file_name:
+            received = pypandoc.convert_file(file_name, "rst", filters=[upper_case])
+        self.assertEqual(received.split("\n")[0], "SOME TITLE")
+        chunks = pypandoc.convert_text_stream("a b", "html", "md", filters=[upper_case])
+        self.assertEqual("".join(chunks), "<p>A B</p>\n")
+        received = pypandoc.convert_multi(
+            "a b", ["html", "plain"], "md", filters=[upper_case]
+        )
+        self.assertEqual(received, {"html": "<p>A B</p>\n", "plain": "A B\n"})
+
+    def test_not_cached_by_function(self):
+        pypandoc.set_result_cache(pypandoc.ResultCache())
+        pypandoc.set_ast_cache(pypandoc.ResultCache())
+        self.addCleanup(pypandoc.set_result_cache, None)
+        self.addCleanup(pypandoc.set_ast_cache, None)
+        self.assertEqual(
+            pypandoc.convert_text("a", "plain", "md", filters=[upper_case]), "A\n"
+        )
+        self.assertEqual(pypandoc.convert_text("a", "plain", "md"), "a\n")
+        self.assertEqual(pypandoc.convert_multi("a", ["plain"], "md"), {"plain": "a\n"})
+
+
+@unittest.skipUnless(hasattr(os, "fork"), "filter servers need fork()")
+class TestFilterServer(unittest.TestCase):
+    filter_source = textwrap.dedent(
+        """\
+        #!{}
+        import sys
+        import imported_once
+        from pandocfilters import toJSONFilter, Str
+
+        def caps(key, value, format, meta):
+            if key == "Str":
+                if value == "fail":
+                    sys.exit("failing on purpose")
+                return Str(value.upper() + "-" + format)
+
+        toJSONFilter(caps)
+        """
+    )
+
+    def setUp(self):
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        self.directory = tempdir.name
+        self.log = os.path.join(self.directory, "imports.log")
+        with open(os.path.join(self.directory, "imported_once.py"), "w") as f:
+            f.write("open(%r, 'a').write('imported\\n')\n" % self.log)
+        self.script = os.path.join(self.directory, "caps.py")
+        with open(self.script, "w") as f:
+            f.write(self.filter_source.format(sys.executable))
+        os.chmod(self.script, 0o755)
+
+    def imports(self):
+        with open(self.log) as f:
+            return f.read().count("imported")
+
+    def test_same_output_as_the_script(self):
+        expected = pypandoc.convert_text("a b", "html", "md", filters=[self.script])
+        self.assertEqual(self.imports(), 1)
+        with pypandoc.FilterServer(self.script) as server:
+            for to in ("html", "latex", "html"):
+                received = pypandoc.convert_text("a b", to, "md", filters=[server])
+                self.assertIn("A-" + to, received)
+            self.assertEqual(received, expected)
+        # imported once by the server, not for every conversion
+        self.assertEqual(self.imports(), 2)
+
+    def test_python_shim(self):
+        with pypandoc.FilterServer(self.script) as server:
+            with open(server.shim) as f:
+                self.assertEqual(f.readline(), "#!%s -IS\n" % sys.executable)
+            received = pypandoc.convert_text("a", "html", "md", filters=[server])
+        self.assertEqual(received, "<p>A-html</p>\n")
+
+    def test_errors(self):
+        with pypandoc.FilterServer(self.script) as server:
+            with self.assertRaisesRegex(RuntimeError, "failing on purpose"):
+                pypandoc.convert_text("fail", "html", "md", filters=[server])
+
+    def test_restarted_after_dying(self):
+        with pypandoc.FilterServer(self.script) as server:
+            pypandoc.convert_text("a", "html", "md", filters=[server])
+            server._process.kill()
+            server._process.wait()
+            received = pypandoc.convert_text("a", "html", "md", filters=[server])
+            self.assertEqual(received, "<p>A-html</p>\n")
+
+    def test_filter_server_mode(self):
+        pypandoc.set_filter_servers(True)
+        self.addCleanup(pypandoc.set_filter_servers, False)
+        for _ in range(3):
+            received = pypandoc.convert_text(
+                "a", "html", "md", filters=["caps.py"], cworkdir=self.directory
+            )
+            self.assertEqual(received, "<p>A-html</p>\n")
+        self.assertEqual(self.imports(), 1)
+
+    def test_cached_by_script(self):
+        pypandoc.set_result_cache(pypandoc.ResultCache())
+        self.addCleanup(pypandoc.set_result_cache, None)
+        with pypandoc.FilterServer(self.script) as server:
+            pypandoc.convert_text("a", "html", "md", filters=[server])
+            with open(self.script, "a") as f:
+                f.write("# changed\n")
+            pypandoc.convert_text("a", "html", "md", filters=[server])
+        self.assertEqual(pypandoc.get_result_cache().cache_info().hits, 0)
+
+
+class TestConverter(unittest.TestCase):
+    source = "# some title\n\nSome *text* äöü.\n"
+    args = ["--shift-heading-level-by=1", "--wrap=none", "-Vfoo=bar", "--toc"]
+
+    def test_same_output_as_convert_text(self):
+        expected = pypandoc.convert_text(
+            self.source, "html", "md", extra_args=self.args
+        )
+        for defaults_file in (False, True):
+            with pypandoc.Converter(
+                "html", "md", extra_args=self.args, defaults_file=defaults_file
+            ) as converter:
+                self.assertEqual(converter.convert_text(self.source), expected)
+                self.assertEqual(converter.convert_text(self.source), expected)
+
+    def test_same_output_as_convert_file(self):
+        with closed_tempfile(".md") as source_file:
+            with open(source_file, "w", encoding="utf-8") as f:
+                f.write(self.source)
+            expected = pypandoc.convert_file(source_file, "rst", extra_args=self.args)
+            converter = pypandoc.Converter("rst", "md", extra_args=self.args)
+            self.assertEqual(converter.convert_file(Path(source_file)), expected)
+            self.assertEqual(converter.convert_text(self.source), expected)
+
+    def test_defaults_file(self):
+        with pypandoc.Converter(
+            "html",
+            "md",
+            extra_args=self.args + ["--unknown-option"],
+            defaults_file=True,
+        ) as converter:
+            args = converter.args
+            self.assertEqual(args[1:3], ["--from=markdown", "--to=html"])
+            self.assertTrue(args[3].startswith("--defaults="))
+            self.assertEqual(args[4:], ["--unknown-option"])
+            defaults_file = args[3].partition("=")[2]
+            with open(defaults_file, encoding="utf-8") as f:
+                self.assertEqual(
+                    json.load(f),
+                    {
+                        "shift-heading-level-by": 1,
+                        "wrap": "none",
+                        "variables": {"foo": "bar"},
+                        "table-of-contents": True,
+                    },
+                )
+        self.assertFalse(os.path.exists(defaults_file))
+
+    def test_defaults_file_keeps_filter_order(self):
+        defaults, remaining = pypandoc._to_defaults(
+            ["-F", "a", "--citeproc", "--lua-filter=b.lua", "-Lc.lua", "-s"]
+        )
+        self.assertEqual(
+            defaults,
+            {"filters": ["a", "citeproc", "b.lua", "c.lua"], "standalone": True},
+        )
+        self.assertEqual(remaining, [])
+
+    def test_map_options_in_defaults_file(self):
+        for args in (
+            ["-Mtitle=Foo", "-V", "lang=en"],
+            ["-Mtitle:Foo", "-V", "lang:en"],
+            ["--metadata=title:Foo", "--variable=lang:en"],
+        ):
+            expected = pypandoc.convert_text(
+                self.source, "html", "md", extra_args=args + ["-s"]
+            )
+            self.assertIn("<title>Foo</title>", expected)
+            with pypandoc.Converter(
+                "html", "md", extra_args=args + ["-s"], defaults_file=True
+            ) as converter:
+                self.assertEqual(converter.convert_text(self.source), expected)
+        self.assertEqual(
+            pypandoc._to_defaults(["-Vgeometry:margin=1cm", "-Mdraft"]),
+            ({"variables": {"geometry": "margin=1cm"}}, ["-Mdraft"]),
+        )
+
+    def test_metadata_values_in_defaults_file(self):
+        with closed_tempfile(".tpl", "$if(draft)$DRAFT$else$FINAL$endif$\n") as tpl:
+            for value in ("false", "true", "FALSE", "1"):
+                args = ["--template", tpl, "-M", "draft=" + value]
+                expected = pypandoc.convert_text("x", "html", "md", extra_args=args)
+                with pypandoc.Converter(
+                    "html", "md", extra_args=args, defaults_file=True
+                ) as converter:
+                    self.assertEqual(converter.convert_text("x"), expected)
+
+    def test_outputfile(self):
+        converter = pypandoc.Converter("docx", "md")
+        with closed_tempfile(".docx") as docx:
+            self.assertEqual(converter.convert_text(self.source, outputfile=docx), "")
+            with open(docx, "rb") as f:
+                self.assertEqual(f.read(2), b"PK")
+        with self.assertRaisesRegex(RuntimeError, "only works by using a outputfile"):
+            converter.convert_text(self.source)
+
+    def test_return_bytes(self):
+        converter = pypandoc.Converter("docx", "md", return_bytes=True)
+        self.assertTrue(converter.convert_text(self.source).startswith(b"PK"))
+        with self.assertRaisesRegex(RuntimeError, "can't be used with an outputfile"):
+            converter.convert_text(self.source, outputfile="out.docx")
+
+    def test_invalid_format(self):
+        with self.assertRaisesRegex(RuntimeError, "Invalid output format"):
+            pypandoc.Converter("invalid", "md")
+
+
+@unittest.skipUnless(hasattr(socket, "AF_UNIX"), "needs Unix sockets")
+class TestSpawnStrategy(unittest.TestCase):
+    source = "# some title\n\nSome *text* äöü.\n"
+
+    def tearDown(self):
+        pypandoc.set_spawn_strategy("subprocess")
+
+    def test_same_output(self):
+        expected = pypandoc.convert_text(self.source, "html", "md")
+        with closed_tempfile(".md") as source_file:
+            with open(source_file, "w", encoding="utf-8") as f:
+                f.write(self.source)
+            for strategy in ("posix_spawn", "forkserver"):
+                pypandoc.set_spawn_strategy(strategy)
+                self.assertEqual(pypandoc.get_spawn_strategy(), strategy)
+                self.assertEqual(
+                    pypandoc.convert_text(self.source, "html", "md"), expected
+                )
+                self.assertEqual(pypandoc.convert_file(source_file, "html"), expected)
+                self.assertEqual(
+                    "".join(pypandoc.convert_text_stream(self.source, "html", "md")),
+                    expected,
+                )
+                received = pypandoc.convert_text(
+                    self.source, "docx", "md", return_bytes=True
+                )
+                self.assertTrue(received.startswith(b"PK"))
+
+    def test_forkserver_errors(self):
+        pypandoc.set_spawn_strategy("forkserver")
+        with self.assertRaisesRegex(RuntimeError, "Unknown option"):
+            pypandoc.convert_text(self.source, "html", "md", extra_args=["--bogus"])
+        with self.assertRaises(FileNotFoundError):
+            pypandoc.spawn_server._SpawnServer().spawn(["/nonexistent/pandoc"])
+
+    def test_forkserver_kill(self):
+        server = pypandoc.spawn_server._SpawnServer()
+        try:
+            p = server.spawn(["sleep", "10"])
+            self.assertIsNone(p.poll())
+            with self.assertRaises(subprocess.TimeoutExpired):
+                p.wait(timeout=0.01)
+            p.kill()
+            self.assertEqual(p.wait(), -signal.SIGKILL)
+        finally:
+            server.close()
+
+    def test_unknown_strategy(self):
+        with self.assertRaisesRegex(ValueError, "Unknown spawn strategy"):
+            pypandoc.set_spawn_strategy("vfork")
+
+
+@unittest.skipUnless(os.name == "posix", "the supervisor needs POSIX pipes")
+class TestSupervisor(unittest.TestCase):
+    def test_convert_many_needs_no_worker_threads(self):
+        sources = ["*%d*" % i for i in range(20)]
+        with patch("pypandoc.ThreadPoolExecutor", side_effect=AssertionError):
+            results = pypandoc.convert_many(sources, "html", "md", max_workers=8)
+        self.assertEqual(
+            [r.output for r in results], ["<p><em>%d</em></p>\n" % i for i in range(20)]
+        )
+
+    def test_large_input_and_output(self):
+        source = "Some *text* äöü.\n\n" * 5000
+        received = pypandoc.convert_text(source, "plain", "md")
+        self.assertEqual(received, "Some text äöü.\n\n" * 4999 + "Some text äöü.\n")
+
+    def test_without_pidfd(self):
+        with patch(
+            "pypandoc.supervisor.os.pidfd_open", side_effect=OSError, create=True
+        ):
+            results = pypandoc.convert_many(["*a*", "*b*"], "html", "md")
+        self.assertEqual(
+            [r.output for r in results], ["<p><em>a</em></p>\n", "<p><em>b</em></p>\n"]
+        )
+
+    def test_cancelling_kills_the_process(self):
+        p = subprocess.Popen(["sleep", "10"], stdout=subprocess.PIPE)
+        future = pypandoc.supervisor._communicate(p)
+        self.assertTrue(future.cancel())
+        self.assertEqual(p.wait(timeout=5), -signal.SIGKILL)
+
+    def test_slow_input_doesnt_hold_up_other_conversions(self):
+        started = threading.Event()
+
+        def slow_source():
+            started.set()
+            time.sleep(2)
+            yield "*a*"
+
+        with ThreadPoolExecutor(1) as executor:
+            future = executor.submit(pypandoc.convert_text, slow_source(), "html", "md")
+            started.wait()
+            start = time.monotonic()
+            received = pypandoc.convert_text("*b*", "html", "md")
+            self.assertLess(time.monotonic() - start, 1)
+            self.assertEqual(received, "<p><em>b</em></p>\n")
+            self.assertEqual(future.result(), "<p><em>a</em></p>\n")
+
+    def test_input_which_converts_itself(self):
+        def source():
+            yield pypandoc.convert_text("<em>a</em>", "md", "html")
+
+        received = pypandoc.convert_text(source(), "html", "md")
+        self.assertEqual(received, "<p><em>a</em></p>\n")
+
+    def test_errors_dont_stop_the_loop(self):
+        supervisor = pypandoc.supervisor._Supervisor()
+
+        def fail():
+            raise ValueError("failing on purpose")
+
+        with self.assertLogs("pypandoc", "ERROR"):
+            supervisor._call_soon(fail)
+            p = subprocess.Popen(["cat"], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            future = supervisor.communicate(p, b"ok")
+            self.assertEqual(future.result(timeout=10), (b"ok", b""))
+
+
+class TestTimeouts(unittest.TestCase):
+    # starts a process of its own and hangs
+    filter_source = textwrap.dedent(
+        """\
+        #!{}
+        import subprocess
+        import sys
+        import time
+
+        child = subprocess.Popen(["sleep", "30"])
+        sys.stderr.write("child %d\\n" % child.pid)
+        sys.stderr.flush()
+        time.sleep(30)
+        """
+    )
+
+    def setUp(self):
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        self.script = os.path.join(tempdir.name, "hang.py")
+        with open(self.script, "w") as f:
+            f.write(self.filter_source.format(sys.executable))
+        os.chmod(self.script, 0o755)
+
+    def assertExited(self, pid):
+        # the process may be left as a zombie until init reaps it
+        stat = "/proc/%d/stat" % pid
+        for _ in range(500):
+            try:
+                with open(stat) as f:
+                    if f.read().rpartition(")")[2].split()[0] == "Z":
+                        return
+            except FileNotFoundError:
+                return
+            time.sleep(0.01)
+        self.fail("process %d is still running" % pid)
+
+    @unittest.skipUnless(os.path.isdir("/proc"), "needs /proc")
+    def test_timeout_kills_the_process_group(self):
+        start = time.monotonic()
+        with self.assertRaises(pypandoc.ConversionTimeoutError) as cm:
+            pypandoc.convert_text("a", "html", "md", filters=[self.script], timeout=1)
+        self.assertLess(time.monotonic() - start, 10)
+        self.assertIsInstance(cm.exception, TimeoutError)
+        self.assertEqual(cm.exception.timeout, 1)
+        # the filter's child was killed with pandoc
+        self.assertExited(int(re.search(r"child (\d+)", cm.exception.stderr)[1]))
+
+    def test_fast_conversions(self):
+        received = pypandoc.convert_text("*a*", "html", "md", timeout=30)
+        self.assertEqual(received, "<p><em>a</em></p>\n")
+        chunks = pypandoc.convert_text_stream("*a*", "html", "md", timeout=30)
+        self.assertEqual("".join(chunks), "<p><em>a</em></p>\n")
+
+    def test_stream_timeout(self):
+        with self.assertRaises(pypandoc.ConversionTimeoutError):
+            list(
+                pypandoc.convert_text_stream(
+                    "a", "html", "md", filters=[self.script], timeout=0.5
+                )
+            )
+
+    def test_batch_timeout(self):
+        results = pypandoc.convert_many(
+            ["a", "b"], "html", "md", filters=[self.script], timeout=0.5
+        )
+        for result in results:
+            self.assertIsInstance(result.error, pypandoc.ConversionTimeoutError)
+
+    def test_batch_cancellation(self):
+        token = pypandoc.CancellationToken()
+        timer = threading.Timer(0.5, token.cancel)
+        timer.start()
+        self.addCleanup(timer.cancel)
+        start = time.monotonic()
+        # no more sources are read once the batch is cancelled
+        results = list(
+            pypandoc.imap_convert(
+                iter(lambda: "a", None),
+                "html",
+                "md",
+                filters=[self.script],
+                max_workers=2,
+                cancel=token,
+            )
+        )
+        self.assertLess(time.monotonic() - start, 10)
+        self.assertTrue(results)
+        for result in results:
+            self.assertIsInstance(result.error, CancelledError)
+
+    def test_cancelled_token(self):
+        token = pypandoc.CancellationToken()
+        token.cancel()
+        self.assertTrue(token.cancelled)
+        self.assertEqual(pypandoc.convert_many(["a"], "html", "md", cancel=token), [])
+
+    @unittest.skipUnless(os.name == "posix", "needs sh")
+    def test_supervisor_reaps_and_closes_pipes(self):
+        # the background sleep keeps the pipes open after the shell is killed
+        p = subprocess.Popen(
+            ["sh", "-c", "sleep 30 & echo $! >&2; exec sleep 30"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        future = pypandoc.supervisor._communicate(p, timeout=0.5)
+        with self.assertRaises(subprocess.TimeoutExpired) as cm:
+            future.result(timeout=10)
+        os.kill(int(cm.exception.stderr), signal.SIGKILL)
+        self.assertEqual(p.returncode, -signal.SIGKILL)
+
+
+class TestStreamedInput(unittest.TestCase):
+    source = "# some title\n\nSome *text* äöü.\n\n" * 1000
+
+    def setUp(self):
+        self.expected = pypandoc.convert_text(self.source, "html", "md")
+
+    def test_file_objects(self):
+        data = self.source.encode("utf-8")
+        for file in (io.BytesIO(data), io.StringIO(self.source)):
+            self.assertEqual(pypandoc.convert_text(file, "html", "md"), self.expected)
+
+    def test_chunks(self):
+        data = self.source.encode("utf-8")
+        # split in the middle of the multi-byte characters, too
+        chunks = (data[i : i + 7] for i in range(0, len(data), 7))
+        self.assertEqual(pypandoc.convert_text(chunks, "html", "md"), self.expected)
+        chunks = [self.source[:100], self.source[100:]]
+        self.assertEqual(pypandoc.convert_text(chunks, "html", "md"), self.expected)
+
+    def test_buffers(self):
+        data = self.source.encode("utf-8")
+        with tempfile.TemporaryFile() as f:
+            f.write(data)
+            f.flush()
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                for source in (bytearray(data), memoryview(data), mapped):
+                    self.assertEqual(
+                        pypandoc.convert_text(source, "html", "md"), self.expected
+                    )
+
+    def test_other_encodings(self):
+        data = self.source.encode("latin-1")
+        for source in (data, io.BytesIO(data), [data[:101], data[101:]]):
+            received = pypandoc.convert_text(source, "html", "md", encoding="latin-1")
+            self.assertEqual(received, self.expected)
+
+    def test_invalid_utf8_is_replaced(self):
+        data = b"a\xffb\n"
+        expected = pypandoc.convert_text(data.decode(errors="replace"), "html", "md")
+        for source in (data, io.BytesIO(data), [b"a\xff", b"b\n"]):
+            self.assertEqual(pypandoc.convert_text(source, "html", "md"), expected)
+
+    def test_binary_input_formats_are_not_transcoded(self):
+        with closed_tempfile(".docx") as file_name:
+            pypandoc.convert_text(self.source, "docx", "md", outputfile=file_name)
+            with open(file_name, "rb") as f:
+                expected = pypandoc.convert_text(f.read(), "md", "docx")
+                f.seek(0)
+                self.assertEqual(pypandoc.convert_text(f, "md", "docx"), expected)
+
+    def test_errors_while_reading_are_raised(self):
+        def chunks():
+            yield b"# some title\n"
+            raise ValueError("broken source")
+
+        with self.assertRaisesRegex(ValueError, "broken source"):
+            pypandoc.convert_text(chunks(), "html", "md")
+
+    def test_streamed_input_and_output(self):
+        chunks = pypandoc.convert_text_stream(io.StringIO(self.source), "html", "md")
+        self.assertEqual("".join(chunks), self.expected)
+
+    def test_files_are_passed_as_stdin(self):
+        data = self.source.encode("utf-8")
+        with tempfile.TemporaryFile() as f:
+            f.write(b"skipped" + data)
+            f.seek(7)
+            source = pypandoc._encode_text_source(f, "md", "utf-8")
+            self.assertIsInstance(source, pypandoc._FileInput)
+            self.assertEqual(source.size, len(data))
+            f.seek(7)
+            self.assertEqual(pypandoc.convert_text(f, "html", "md"), self.expected)
+            self.assertEqual(f.read(), b"")
+            f.seek(7)
+            chunks = pypandoc.convert_text_stream(f, "html", "md")
+            self.assertEqual("".join(chunks), self.expected)
+
+    def test_files_with_invalid_utf8_are_transcoded(self):
+        with tempfile.TemporaryFile() as f:
+            f.write(b"a\xffb\n")
+            f.seek(0)
+            source = pypandoc._encode_text_source(f, "md", "utf-8")
+            self.assertNotIsInstance(source, pypandoc._FileInput)
+            f.seek(0)
+            self.assertEqual(
+                pypandoc.convert_text(f, "html", "md"), "<p>a\ufffdb</p>\n"
+            )
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "needs F_SETPIPE_SZ")
+    def test_pipes_are_enlarged_for_large_inputs(self):
+        import fcntl
+
+        f_getpipe_sz = getattr(fcntl, "F_GETPIPE_SZ", 1032)
+        for input_size, expected in ((100, 65536), (2**19, 2**19), (None, 2**20)):
+            p = subprocess.Popen(["cat"], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            try:
+                pypandoc._enlarge_pipes(p, input_size)
+                for pipe in (p.stdin, p.stdout):
+                    self.assertEqual(fcntl.fcntl(pipe.fileno(), f_getpipe_sz), expected)
+            finally:
+                p.communicate()
+
+
+class TestStream(unittest.TestCase):
+    source = "# some title\n\n" + "Some *text* äöü.\n\n" * 2000
+
+    def test_convert_text_stream(self):
+        chunks = list(
+            pypandoc.convert_text_stream(self.source, "html", "md", chunk_size=1000)
+        )
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(isinstance(c, str) for c in chunks))
+        self.assertEqual(
+            "".join(chunks), pypandoc.convert_text(self.source, "html", "md")
+        )
+
+    def test_convert_text_stream_bytes(self):
+        chunks = list(
+            pypandoc.convert_text_stream(self.source, "html", "md", return_bytes=True)
+        )
+        self.assertTrue(all(isinstance(c, bytes) for c in chunks))
+        self.assertEqual(
+            b"".join(chunks).decode("utf-8"),
+            pypandoc.convert_text(self.source, "html", "md"),
+        )
+
+    def test_convert_text_stream_binary_format(self):
+        output = b"".join(pypandoc.convert_text_stream("ok", "docx", "md"))
+        self.assertTrue(output.startswith(b"PK"))
+
+    def test_convert_file_stream(self):
+        with closed_tempfile(".md", text=self.source) as file_name:
+            received = "".join(pypandoc.convert_file_stream(file_name, "rst"))
+            self.assertEqual(received, pypandoc.convert_file(file_name, "rst"))
+
+    def test_error_is_raised_at_the_end(self):
+        stream = pypandoc.convert_text_stream("ok", "html", "md", extra_args=["--x"])
+        with self.assertRaisesRegex(RuntimeError, "Pandoc died with exitcode"):
+            list(stream)
+        with self.assertRaisesRegex(RuntimeError, "Invalid input format"):
+            pypandoc.convert_text_stream("ok", "html", "invalid")
+
+    def test_closing_the_stream_kills_pandoc(self):
+        processes = []
+        popen = subprocess.Popen
+
+        def record(*args, **kwargs):
+            processes.append(popen(*args, **kwargs))
+            return processes[-1]
+
+        with patch("pypandoc.subprocess.Popen", record):
+            stream = pypandoc.convert_text_stream(
+                self.source * 10, "html", "md", chunk_size=100
+            )
+            next(stream)
+            stream.close()
+        self.assertIsNotNone(processes[0].returncode)
+
+
+class TestAsync(unittest.IsolatedAsyncioTestCase):
+    busy_filter = textwrap.dedent(
+        """\
+        function Pandoc(doc)
+            local start = os.clock()
+            while os.clock() - start < 30 do end
+            return doc
+        end
+        """
+    )
+
+    async def test_convert_text_async(self):
+        received = await pypandoc.convert_text_async("# some title\n", "rst", "md")
+        self.assertEqual(received, pypandoc.convert_text("# some title\n", "rst", "md"))
+
+    async def test_convert_file_async(self):
+        with closed_tempfile(".md", text="# some title\n") as file_name:
+            received = await pypandoc.convert_file_async(file_name, "rst")
+            self.assertEqual(received, pypandoc.convert_file(file_name, "rst"))
+
+    async def test_many_concurrent_conversions(self):
+        sources = ["*%d*" % i for i in range(20)]
+        received = await asyncio.gather(
+            *(pypandoc.convert_text_async(s, "html", "md") for s in sources)
+        )
+        self.assertEqual(received, ["<p><em>%d</em></p>\n" % i for i in range(20)])
+
+    async def test_streamed_input(self):
+        received = await pypandoc.convert_text_async(
+            io.StringIO("# some title\n"), "rst", "md"
+        )
+        self.assertEqual(received, pypandoc.convert_text("# some title\n", "rst", "md"))
+
+    async def test_return_bytes(self):
+        received = await pypandoc.convert_text_async(
+            "# some title\n", "docx", "md", return_bytes=True
+        )
+        self.assertTrue(received.startswith(b"PK"))
+
+    async def test_result_cache(self):
+        pypandoc.set_result_cache(pypandoc.ResultCache())
+        self.addCleanup(pypandoc.set_result_cache, None)
+        expected = await pypandoc.convert_text_async("# some title\n", "html", "md")
+        with patch("pypandoc.subprocess.Popen") as popen, patch(
+            "asyncio.create_subprocess_exec"
+        ) as create_subprocess_exec:
+            received = await pypandoc.convert_text_async("# some title\n", "html", "md")
+        popen.assert_not_called()
+        create_subprocess_exec.assert_not_called()
+        self.assertEqual(received, expected)
+
+    async def test_single_flight(self):
+        pypandoc.set_result_cache(pypandoc.ResultCache())
+        self.addCleanup(pypandoc.set_result_cache, None)
+        run_pandoc_async = pypandoc._run_pandoc_async
+        calls = []
+
+        async def wrapper(conversion):
+            calls.append(conversion)
+            await asyncio.sleep(0.2)
+            return await run_pandoc_async(conversion)
+
+        with patch("pypandoc._run_pandoc_async", wrapper):
+            received = await asyncio.gather(
+                *[
+                    pypandoc.convert_text_async("# title", "html", "md")
+                    for _ in range(8)
+                ]
+            )
+            self.assertEqual(len(calls), 1)
+            self.assertEqual(len(set(received)), 1)
+
+            # cancelling the task running pandoc makes a waiter run it
+            first = asyncio.ensure_future(
+                pypandoc.convert_text_async("# other", "html", "md")
+            )
+            await asyncio.sleep(0.05)
+            second = asyncio.ensure_future(
+                pypandoc.convert_text_async("# other", "html", "md")
+            )
+            await asyncio.sleep(0.05)
+            first.cancel()
+            self.assertIn("other", await second)
+            self.assertTrue(first.cancelled())
+            self.assertEqual(len(calls), 3)
+
+    async def test_ast_cache(self):
+        pypandoc.set_ast_cache(pypandoc.ResultCache())
+        self.addCleanup(pypandoc.set_ast_cache, None)
+        expected = await pypandoc.convert_text_async("# some title\n", "html", "md")
+        received = await pypandoc.convert_text_async("# some title\n", "html", "md")
+        self.assertEqual(received, expected)
+        self.assertEqual(pypandoc.get_ast_cache().cache_info().hits, 1)
+
+    async def test_python_filters(self):
+        received = await pypandoc.convert_text_async(
+            "some *text*", "html", "md", filters=[upper_case]
+        )
+        self.assertEqual(received, "<p>SOME <em>TEXT</em></p>\n")
+
+    async def test_converter(self):
+        converter = pypandoc.Converter("html", "md", defaults_file=True)
+        received = await asyncio.gather(
+            converter.convert_text_async("*a*"), converter.convert_text_async("*b*")
+        )
+        self.assertEqual(received, ["<p><em>a</em></p>\n", "<p><em>b</em></p>\n"])
+        converter.close()
+
+    async def test_forkserver(self):
+        pypandoc.set_spawn_strategy("forkserver")
+        try:
+            received = await asyncio.gather(
+                pypandoc.convert_text_async("*a*", "html", "md"),
+                pypandoc.convert_text_async("*b*", "html", "md"),
+            )
+        finally:
+            pypandoc.set_spawn_strategy("subprocess")
+        self.assertEqual(received, ["<p><em>a</em></p>\n", "<p><em>b</em></p>\n"])
+
+    async def test_timeout(self):
+        with closed_tempfile(".lua", self.busy_filter) as filter_name:
+            with self.assertRaises(pypandoc.ConversionTimeoutError):
+                await pypandoc.convert_text_async(
+                    "ok", "html", "md", filters=[filter_name], timeout=0.5
+                )
+
+    async def test_cancellation_token(self):
+        token = pypandoc.CancellationToken()
+        asyncio.get_running_loop().call_later(0.5, token.cancel)
+        with closed_tempfile(".lua", self.busy_filter) as filter_name:
+            with self.assertRaises(CancelledError):
+                await pypandoc.convert_text_async(
+                    "ok", "html", "md", filters=[filter_name], cancel=token
+                )
+
+    async def test_waiters_dont_share_the_cancellation_token(self):
+        pypandoc.set_result_cache(pypandoc.ResultCache())
+        self.addCleanup(pypandoc.set_result_cache, None)
+        source = "# some title\n"
+        token = pypandoc.CancellationToken()
+        with closed_tempfile(".lua", SLOW_LUA_FILTER) as filter_name:
+            leader = asyncio.ensure_future(
+                pypandoc.convert_text_async(
+                    source, "html", "md", filters=[filter_name], cancel=token
+                )
+            )
+            await asyncio.sleep(0.1)
+            waiter = asyncio.ensure_future(
+                pypandoc.convert_text_async(source, "html", "md", filters=[filter_name])
+            )
+            await asyncio.sleep(0.1)
+            token.cancel()
+            with self.assertRaises(CancelledError):
+                await leader
+            self.assertIn("some title", await waiter)
+
+    async def test_conversion_error(self):
+        with self.assertRaisesRegex(RuntimeError, "Pandoc died with exitcode"):
+            await pypandoc.convert_text_async("ok", "html", "md", extra_args=["--x"])
+        with self.assertRaisesRegex(RuntimeError, "Invalid input format"):
+            await pypandoc.convert_text_async("ok", "html", "invalid")
+
+    async def test_cancellation_kills_pandoc(self):
+        processes = []
+        create_subprocess_exec = asyncio.create_subprocess_exec
+
+        async def record(*args, **kwargs):
+            processes.append(await create_subprocess_exec(*args, **kwargs))
+            return processes[-1]
+
+        with closed_tempfile(".lua", self.busy_filter) as filter_name, patch(
+            "pypandoc.asyncio.create_subprocess_exec", record
+        ):
+            task = asyncio.ensure_future(
+                pypandoc.convert_text_async("ok", "html", "md", filters=[filter_name])
+            )
+            while not processes:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+        self.assertIsNotNone(processes[0].returncode)
+
+
 class TestCli(unittest.TestCase):
     def test_help(self):
         """No subcommand should print help and return non-zero."""
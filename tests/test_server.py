@@ -0,0 +1,191 @@
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import unittest
+from subprocess import PIPE
+from unittest.mock import patch
+
+import pypandoc
+from pypandoc.server import (
+    PandocServer,
+    _get_shared_server,
+    _owns_listener,
+    _server_options,
+)
+
+
+class TestServerOptions(unittest.TestCase):
+    def test_translates_supported_arguments(self):
+        options = _server_options(
+            [
+                "--standalone",
+                "-V",
+                "geometry:margin=1.5cm",
+                "--variable=lang=en",
+                "--toc-depth",
+                "2",
+                "--wrap=none",
+                "-M",
+                "title=Some title",
+                "-M",
+                "draft",
+            ]
+        )
+        self.assertEqual(
+            options,
+            {
+                "standalone": True,
+                "variables": {"geometry": "margin=1.5cm", "lang": "en"},
+                "toc-depth": 2,
+                "wrap": "none",
+                "metadata": {"title": "Some title", "draft": True},
+            },
+        )
+
+    def test_rejects_unsupported_arguments(self):
+        self.assertIsNone(_server_options(["--filter", "pandoc-citeproc"]))
+        self.assertIsNone(_server_options(["--toc-depth=two"]))
+        self.assertIsNone(_server_options(["--standalone=yes"]))
+        self.assertIsNone(_server_options(["--wrap"]))
+
+
+class TestServerBackend(unittest.TestCase):
+    def setUp(self):
+        pypandoc.set_server_network_access(True)
+        self.addCleanup(pypandoc.set_server_network_access, False)
+
+    def test_invalid_backend(self):
+        with self.assertRaisesRegex(RuntimeError, "Invalid backend"):
+            pypandoc.convert_text("ok", "rst", format="md", backend="invalid")
+        with self.assertRaisesRegex(RuntimeError, "Invalid backend"):
+            pypandoc.convert_many(["ok"], "rst", "md", backend="lua")
+
+    def test_same_output_as_subprocess(self):
+        # falls back to running pandoc where the server can't be used
+        for extra_args in ([], ["--wrap=none"], ["--eol=lf"]):
+            self.assertEqual(
+                pypandoc.convert_text(
+                    "# some title\n", "html", format="md", extra_args=extra_args
+                ),
+                pypandoc.convert_text(
+                    "# some title\n",
+                    "html",
+                    format="md",
+                    extra_args=extra_args,
+                    backend="server",
+                ),
+            )
+
+    def test_sandboxed_conversions_are_left_to_pandoc(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+            f.write("secret-content")
+        self.addCleanup(os.remove, f.name)
+        server = PandocServer()
+        with patch.object(server, "convert_text", side_effect=AssertionError):
+            received = pypandoc.convert_text(
+                ".. include:: %s\n" % f.name,
+                "html",
+                "rst",
+                sandbox=True,
+                backend=server,
+            )
+        self.assertNotIn("secret-content", received)
+
+    def test_network_access_has_to_be_allowed(self):
+        pypandoc.set_server_network_access(False)
+        with self.assertRaisesRegex(RuntimeError, "set_server_network_access"):
+            pypandoc.convert_text("ok", "html", format="md", backend="server")
+        server = PandocServer()
+        with self.assertRaisesRegex(RuntimeError, "allow_network_access"):
+            server.start()
+        self.assertFalse(server.running)
+
+    def test_server_conversion(self):
+        if _get_shared_server() is None:
+            self.skipTest("pandoc can't run pandoc server")
+        with PandocServer(allow_network_access=True) as server:
+            self.assertTrue(server.running)
+            if sys.platform.startswith("linux"):
+                self.assertTrue(_owns_listener(server._process.pid, server.port))
+            received = server.convert_text("# some title\n", "html", format="md")
+            self.assertEqual('<h1 id="some-title">some title</h1>', received.strip())
+            with self.assertRaises(RuntimeError):
+                server.convert_text("ok", "html", format="md", extra_args=["--eol=lf"])
+        self.assertFalse(server.running)
+
+    def fake_batch_server(self):
+        """A server whose /batch requests are answered by running pandoc."""
+        server = PandocServer(allow_network_access=True)
+        batches = []
+
+        def convert(path, payloads):
+            self.assertEqual(path, "/batch")
+            batches.append(payloads)
+            return [
+                (
+                    {"output": pypandoc.convert_text(p["text"], p["to"], p["from"])}
+                    if "fail" not in p["text"]
+                    else {"error": "failed"}
+                )
+                for p in payloads
+            ]
+
+        patcher = patch.object(server, "_convert", side_effect=convert)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return server, batches
+
+    def test_convert_many_in_batches(self):
+        server, batches = self.fake_batch_server()
+        sources = ["*%d*" % i for i in range(70)] + [5, b"fail"]
+        results = pypandoc.convert_many(sources, "html", "md", backend=server)
+        self.assertEqual([len(b) for b in batches], [64, 7])
+        self.assertEqual([r.index for r in results], list(range(72)))
+        self.assertEqual(
+            [r.output for r in results[:70]],
+            ["<p><em>%d</em></p>\n" % i for i in range(70)],
+        )
+        self.assertRegex(str(results[70].error), "Invalid source")
+        self.assertRegex(str(results[71].error), "failed")
+        self.assertEqual(
+            server.convert_batch(["*a*", "**b**"], "html", "md"),
+            ["<p><em>a</em></p>\n", "<p><strong>b</strong></p>\n"],
+        )
+        with self.assertRaisesRegex(RuntimeError, "failed"):
+            server.convert_batch(["*a*", "fail"], "html", "md")
+
+    def test_convert_many_falls_back_to_pandoc(self):
+        server, batches = self.fake_batch_server()
+        for kwargs in ({"extra_args": ["--eol=lf"]}, {"timeout": 10}):
+            results = pypandoc.convert_many(
+                ["*a*", 5], "html", "md", backend=server, **kwargs
+            )
+            self.assertEqual(results[0].output, "<p><em>a</em></p>\n")
+            self.assertRegex(str(results[1].error), "Invalid source")
+        self.assertEqual(batches, [])
+
+    def test_failed_batch_request(self):
+        server = PandocServer(allow_network_access=True)
+        error = RuntimeError("pandoc server failed with status 500")
+        with patch.object(server, "_convert", side_effect=error):
+            results = pypandoc.convert_many(["a", "b"], "html", "md", backend=server)
+        self.assertEqual([r.error for r in results], [error, error])
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "needs /proc")
+    def test_port_taken_by_another_process(self):
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            s.listen()
+            port = s.getsockname()[1]
+            other = subprocess.Popen([sys.executable, "-c", "input()"], stdin=PIPE)
+            try:
+                self.assertFalse(_owns_listener(other.pid, port))
+            finally:
+                other.communicate(b"\n")
+            self.assertTrue(_owns_listener(os.getpid(), port))
+
+
+if __name__ == "__main__":
+    unittest.main()